@@ -11,7 +11,7 @@ Description:
 
 """
 
-import json
+import time
 import inspect
 import yaml
 from collections import namedtuple
@@ -19,10 +19,19 @@ from collections import namedtuple
 from django.core.exceptions import PermissionDenied
 from django.http import Http404
 from django.http import HttpResponse
+from django.http import HttpResponseBadRequest
+from django.http.response import HttpResponseBase
+
+from google.appengine.ext import ndb
 
 from apps.profileviewer.util import request_property
 from apps.profileviewer.util import get_user
 from apps.profileviewer.util import set_user
+from apps.profileviewer.serializer import dumps
+from apps.profileviewer.api.metrics import RECORDER
+from apps.profileviewer.api.params import BadArgument
+from apps.profileviewer.api.params import compile_binder
+from apps.profileviewer.api.respcache import RESPONSE_CACHE
 
 
 class APIRegistry(object):
@@ -33,19 +42,32 @@ class APIRegistry(object):
                                                'spec',
                                                'secured',
                                                'disabled',
-                                               'tojson'])
+                                               'tojson',
+                                               'cache',
+                                               'bind'])
 
     ReservedArguments = {
-        '_user': lambda req: get_user(req),
+        # a batch shares one session among its calls
+        '_user': lambda req: req.batch_user() if hasattr(req, 'batch_user')
+        else get_user(req),
         '_request': lambda req: req
     }
 
     ADMIN_KEY = 'tu2013delft'
 
-    def __init__(self):
+    # Whether calls are measured, see api/metrics.py
+    INSTRUMENTED = True
+
+    # Registries by the name in their urls, e.g., /api/data/...
+    REGISTRIES = dict()
+
+    def __init__(self, name=None):
         self._ENDPOINTS = dict()
+        if name:
+            APIRegistry.REGISTRIES[name] = self
 
-    def api_endpoint(self, secured=False, disabled=False, tojson=True):
+    def api_endpoint(self, secured=False, disabled=False, tojson=True,
+                     cache=None, params=None):
         """ An decorator for API registry.
 
         Usage:
@@ -55,17 +77,35 @@ class APIRegistry(object):
                 # Do some stuff with a, b
                 return # some stuff
 
+        An endpoint written as a generator is run as a ndb.tasklet, it
+        yields futures and raises ndb.Return with the result:
+            @reg.api_endpoint()
+            def an_async_api(a):
+                x, y = yield A.get_async(a), B.query().count_async()
+                raise ndb.Return(# some stuff)
+
+        :cache: A CachePolicy for the json responses, see api/respcache.py.
+        :params: A dict of the types of arguments, arguments not listed are
+            passed as strings, see api/params.py.
+
         """
 
         def decorator(func):
             """ The decorator for collecting api methods. """
             name = func.__name__
+            spec = inspect.getargspec(func)
+            if inspect.isgeneratorfunction(func):
+                # the registry drives the future returned by the tasklet
+                func = ndb.tasklet(func)
             self._ENDPOINTS[name] = APIRegistry.EndPointSpec(
                 func=func,
-                spec=inspect.getargspec(func),
+                spec=spec,
                 secured=secured,
                 disabled=disabled,
-                tojson=tojson)
+                tojson=tojson,
+                cache=cache,
+                bind=compile_binder(spec, params or {},
+                                    APIRegistry.ReservedArguments))
             return func
 
         return decorator
@@ -94,37 +134,123 @@ class APIRegistry(object):
         else:
             return url + '?_admin_key=' + APIRegistry.ADMIN_KEY
 
-    def call_endpoint(self, request, name):
-        """Call endpoint by name.
+    @staticmethod
+    @ndb.tasklet
+    def _response(endpoint, kwargs):
+        """ Call the endpoint and wrap the result in a HttpResponse.
 
-        :request: Django HttpRequest object.
-        :name: The name of the endpoint to call.
-        :returns: Json string response.
+        Endpoints may return a future, e.g., when they are tasklets.
 
         """
-        try:
-            endpoint = self._ENDPOINTS[name]
-            if endpoint.secured:
-                APIRegistry.check_secure(request)
-            if endpoint.disabled:
-                raise KeyError()
-            kwargs = {k: request.REQUEST.get(k, None)
-                      for k in endpoint.spec.args
-                      if k not in APIRegistry.ReservedArguments}
-            for k in APIRegistry.ReservedArguments.keys():
-                if k in endpoint.spec.args:
-                    kwargs[k] = APIRegistry.ReservedArguments[k](request)
-        except KeyError:
-            raise Http404
         ret = endpoint.func(**kwargs)  # pylint: disable=W0142
-        if isinstance(ret, HttpResponse):
-            resp = ret
+        if isinstance(ret, ndb.Future):
+            ret = yield ret
+        if isinstance(ret, HttpResponseBase):
+            raise ndb.Return(ret)
         elif endpoint.tojson:
-            resp = HttpResponse(json.dumps(ret), mimetype="application/json")
+            raise ndb.Return(HttpResponse(dumps(ret),
+                                          mimetype="application/json"))
         else:
-            resp = HttpResponse(ret)
+            raise ndb.Return(HttpResponse(ret))
+
+    @staticmethod
+    @ndb.tasklet
+    def _cached_response(request, name, endpoint, kwargs):
+        """ Serve the response from RESPONSE_CACHE or call the endpoint.
+
+        A stale response is served while a task recomputes it, the task
+        calls the endpoint with _refresh to bypass the cache.
+
+        """
+        policy = endpoint.cache
+        key = RESPONSE_CACHE.key(name, policy, kwargs)
+        if not request_property(request, '_refresh'):
+            hit = RESPONSE_CACHE.get(key, policy)
+            if hit is not None:
+                created_at, body = hit
+                if time.time() - created_at >= policy.ttl:
+                    RESPONSE_CACHE.revalidate(request, key, created_at)
+                raise ndb.Return(HttpResponse(body,
+                                              mimetype="application/json"))
+        resp = yield APIRegistry._response(endpoint, kwargs)
+        if resp.status_code == 200 and not getattr(resp, 'streaming', False):
+            RESPONSE_CACHE.set(key, resp.content, policy)
+        raise ndb.Return(resp)
+
+    def _bind(self, request, name):
+        """ Return the endpoint and its arguments from the request.
+
+        :raises: Http404 if the endpoint is not available.
+        :raises: BadArgument if an argument is malformed.
+
+        """
+        endpoint = self._ENDPOINTS.get(name)
+        if endpoint is None or endpoint.disabled:
+            raise Http404
+        if endpoint.secured:
+            APIRegistry.check_secure(request)
+        return endpoint, endpoint.bind(request)
+
+    def _respond(self, request, name, endpoint, kwargs):
+        """ Return a future of the response of the endpoint. """
+        if endpoint.cache and endpoint.tojson:
+            return self._cached_response(request, name, endpoint, kwargs)
+        return self._response(endpoint, kwargs)
+
+    @staticmethod
+    def _finish(endpoint, kwargs, resp):
+        """ Add the headers and the session to the response. """
         resp['Access-Control-Allow-Origin'] = '*'
         resp['Access-Control-Allow-Headers'] = 'Origin, X-Requested-With, Content-Type, Accept'
         if '_user' in endpoint.spec.args:
             return set_user(resp, kwargs['_user'])
         return resp
+
+    def call_endpoint(self, request, name):
+        """Call endpoint by name.
+
+        :request: Django HttpRequest object.
+        :name: The name of the endpoint to call.
+        :returns: Json string response.
+
+        """
+        try:
+            endpoint, kwargs = self._bind(request, name)
+        except BadArgument as e:
+            resp = HttpResponseBadRequest(dumps({'error': str(e),
+                                                 'argument': e.name}),
+                                          mimetype="application/json")
+            resp['Access-Control-Allow-Origin'] = '*'
+            return resp
+        if APIRegistry.INSTRUMENTED:
+            RECORDER.start('%s.%s' % (
+                endpoint.func.__module__.rsplit('.', 1)[-1], name))
+        try:
+            resp = self._respond(request, name, endpoint, kwargs).get_result()
+        except Exception:
+            RECORDER.stop(error=True)
+            raise
+        RECORDER.stop(None if getattr(resp, 'streaming', False)
+                      else len(resp.content))
+        return self._finish(endpoint, kwargs, resp)
+
+    def call_endpoint_async(self, request, name):
+        """Call endpoint by name without waiting for it.
+
+        Endpoints returning futures run concurrently with the calls made
+        after them. The calls are not measured one by one, as RPCs can
+        not be told apart among concurrent calls in a thread.
+
+        :request: Django HttpRequest object.
+        :name: The name of the endpoint to call.
+        :returns: A future of the response.
+
+        """
+        endpoint, kwargs = self._bind(request, name)
+
+        @ndb.tasklet
+        def call():
+            """ Wait for the response. """
+            resp = yield self._respond(request, name, endpoint, kwargs)
+            raise ndb.Return(self._finish(endpoint, kwargs, resp))
+        return call()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Multiplexing api calls in one request.
+
+File: batch.py
+Author: SpaceLis
+Email: Wen.Li@tudelft.nl
+GitHub: http://github.com/spacelis
+Description:
+    /api/batch takes a json list of [endpoint, args] pairs, e.g.,
+    [["user/self", {}], ["data/checkins", {"candidate": "..."}]], and
+    returns the responses of all calls in one json object. The calls
+    share the session of the request and the ndb context cache. Calls to
+    endpoints returning futures overlap with the calls after them.
+
+"""
+
+import sys
+import json
+
+from django.core.exceptions import PermissionDenied
+from django.http import Http404
+from django.http import HttpResponse
+from django.http import HttpResponseBadRequest
+
+from google.appengine.ext import ndb
+
+from apps.profileviewer.api import APIRegistry
+from apps.profileviewer.api.metrics import RECORDER
+from apps.profileviewer.api.params import BadArgument
+from apps.profileviewer.serializer import dumps
+from apps.profileviewer.util import get_user
+from apps.profileviewer.util import request_property
+from apps.profileviewer.util import set_user
+
+from apps.profileviewer.api import data
+from apps.profileviewer.api import user
+from apps.profileviewer.api import taskworker
+
+# Importing the endpoint modules fills APIRegistry.REGISTRIES, which the
+# calls of a batch are dispatched through
+ENDPOINT_MODULES = (data, user, taskworker)
+
+MAX_CALLS = 20
+
+# Arguments passed on from the batch request to every call
+INHERITED = ('_admin_key', 'session_token')
+
+
+def as_param(value):
+    """ Return a json value of a call as a request parameter. """
+    if isinstance(value, basestring):
+        return value
+    if isinstance(value, list):
+        return ','.join(as_param(v) for v in value)
+    return json.dumps(value)
+
+
+class BatchCall(object):  # pylint: disable=R0902,R0903
+
+    """ A request for one call in a batch.
+
+    It looks like a Django HttpRequest to APIRegistry with the arguments
+    of the call as its parameters.
+
+    """
+
+    def __init__(self, batch, path, args):
+        self.batch = batch
+        self.request = batch.request
+        self.path = '/api/' + path
+        self.method = 'GET'
+        self.GET = dict((k, request_property(self.request, k))
+                        for k in INHERITED
+                        if request_property(self.request, k) is not None)
+        # json values are passed as they would be in a query string
+        self.GET.update((k, as_param(v)) for k, v in args.iteritems())
+        self.POST = dict()
+        self.COOKIES = self.request.COOKIES
+        self.META = self.request.META
+
+    def batch_user(self):
+        """ Return the user shared by the calls in the batch. """
+        return self.batch.user()
+
+
+class Batch(object):
+
+    """ The calls of a batch request. """
+
+    def __init__(self, request):
+        self.request = request
+        self.session = None
+
+    def user(self):
+        """ Return the user of the session, looked up once. """
+        if self.session is None:
+            self.session = get_user(self.request)
+        return self.session
+
+    @staticmethod
+    def parse(raw):
+        """ Return a list of (path, args) of the calls, e.g., "data/checkins".
+
+        :raises: ValueError for malformed calls.
+
+        """
+        calls = json.loads(raw)
+        if not isinstance(calls, list) or len(calls) > MAX_CALLS:
+            raise ValueError('Expecting a list of at most %d calls' %
+                             (MAX_CALLS, ))
+        parsed = list()
+        for call in calls:
+            path, args = (call + [{}])[:2] if isinstance(call, list) \
+                else (call, {})
+            if not isinstance(args, dict) or path.count('/') != 1:
+                raise ValueError('Malformed call: %s' % (call, ))
+            parsed.append((path, args))
+        return parsed
+
+    def start(self, path, args):
+        """ Start a call and return a future of its response. """
+        regname, name = path.split('/')
+        try:
+            reg = APIRegistry.REGISTRIES[regname]
+            return reg.call_endpoint_async(BatchCall(self, path, args), name)
+        except KeyError:
+            raise Http404
+
+    @staticmethod
+    def result(path, fut):
+        """ Return the json of the result of a call. """
+        try:
+            resp = fut.get_result()
+            status = resp.status_code
+            if getattr(resp, 'streaming', False):
+                status, body = 501, dumps('Streaming is not supported.')
+            elif resp.get('Content-Type', '').startswith('application/json'):
+                body = resp.content
+            else:
+                body = dumps(resp.content)
+        except BadArgument as e:
+            status, body = 400, dumps({'error': str(e), 'argument': e.name})
+        except Http404:
+            status, body = 404, dumps('Not found.')
+        except PermissionDenied:
+            status, body = 403, dumps('Permission denied.')
+        except Exception as e:  # pylint: disable=W0703
+            status, body = 500, dumps(repr(e))
+        return '{"endpoint":%s,"status":%d,"data":%s}' % (dumps(path),
+                                                          status, body)
+
+
+def call_batch(request):
+    """ Call the endpoints listed in the request.
+
+    :request: Django HttpRequest object with the calls in `calls`.
+    :returns: A json object with the results in the order of the calls.
+
+    """
+    batch = Batch(request)
+    try:
+        calls = Batch.parse(request_property(request, 'calls', '[]'))
+    except (ValueError, TypeError, AttributeError) as e:
+        return HttpResponseBadRequest(str(e))
+    RECORDER.start('batch')
+    futs = list()
+    for path, args in calls:
+        fut = ndb.Future()
+        try:
+            fut = batch.start(path, args)
+        except Exception:  # pylint: disable=W0703
+            fut.set_exception(*sys.exc_info()[1:])
+        futs.append(fut)
+    ndb.Future.wait_all(futs)
+    body = '{"action":"batch","num":%d,"results":[%s]}' % (
+        len(futs), ','.join(Batch.result(p, f)
+                            for (p, _), f in zip(calls, futs)))
+    RECORDER.stop(len(body))
+    resp = HttpResponse(body, mimetype="application/json")
+    resp['Access-Control-Allow-Origin'] = '*'
+    if batch.session is not None:
+        set_user(resp, batch.session)
+    return resp
@@ -17,45 +17,90 @@ import gzip
 import csv
 import sys
 import json
+import hashlib
+import urllib
 from datetime import datetime as dt
 from datetime import timedelta
 from itertools import groupby
-from itertools import cycle
-from itertools import izip
 from collections import Counter
+from StringIO import StringIO
 
 csv.field_size_limit(sys.maxsize)
 
-from fn import Stream
 from fn import _ as L
-from fn.iters import drop
-from fn.uniform import zip_longest
-from fn.uniform import map  # pylint: disable=redefined-builtin
 from django.http import Http404
 from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import redirect
+from django.utils.html import escape
 
 from google.appengine.ext import ndb
 import google.appengine.api.taskqueue as tq
 import google.appengine.api.memcache as memcache
 from google.appengine.datastore.datastore_query import Cursor
 
+from apps.profileviewer import jobs
+from apps.profileviewer import invindex
 from apps.profileviewer.api import APIRegistry
+from apps.profileviewer.api import metrics
+from apps.profileviewer.api.params import Int
+from apps.profileviewer.api.params import Bool
+from apps.profileviewer.api.params import CSV
+from apps.profileviewer.api.params import KeyOf
+from apps.profileviewer.api.params import DateTime
+from apps.profileviewer.api.params import PageCursor
+from apps.profileviewer.api.params import request_args
+from apps.profileviewer.api.respcache import CachePolicy
+from apps.profileviewer.api.respcache import RESPONSE_CACHE
+from apps.profileviewer.serializer import dumps
 from apps.profileviewer.util import throttle_map
+from apps.profileviewer.util import partition
 from apps.profileviewer.util import fixCompressedEntity
+from apps.profileviewer.util import fixCompressedEntities
 from apps.profileviewer.util import listCompressedProperty
 
-from apps.profileviewer.models import _k
 from apps.profileviewer.models import Judgement
 from apps.profileviewer.models import User
 from apps.profileviewer.models import AnnotationTask
 from apps.profileviewer.models import TaskPackage
+from apps.profileviewer.models import TaskCoverage
 from apps.profileviewer.models import GeoEntity
 from apps.profileviewer.models import ExpertiseRank
 from apps.profileviewer.models import TwitterAccount
+from apps.profileviewer.models import CheckinProfile
 from apps.profileviewer.models import newToken
-
-_REG = APIRegistry()
+from apps.profileviewer.models import ReferenceCache
+from apps.profileviewer.models import REFERENCE_CACHE
+from apps.profileviewer.search import BATCH_SIZE as SEARCH_BATCH_SIZE
+from apps.profileviewer.search import build_index
+from apps.profileviewer.search import unindex
+from apps.profileviewer.search import search_index
+from apps.profileviewer.checkin_stream import region_of
+
+_REG = APIRegistry('data')
+
+# How assign_taskpackage hands out packages: 'pool' pops the memcache pool
+# filled by refill_taskpool, 'priority' picks the least judged packages
+# until every task has REDUNDANCY_TARGET judgements.
+ASSIGN_MODE = 'pool'
+REDUNDANCY_TARGET = 3
+# A package assigned more recently than this is not handed out again
+PACKAGE_LEASE = timedelta(hours=2)
+
+# Tags of cached responses depending on entities of the kinds
+KIND_TAGS = {
+    'TwitterAccount': 'candidates',
+    'ExpertiseRank': 'rankings',
+    'GeoEntity': 'geoentities',
+    'AnnotationTask': 'tasks',
+    'TaskPackage': 'tasks',
+    'Judgement': 'judgements',
+    'TaskCoverage': 'judgements',
+    'User': 'judgements'
+}
+
+# Tag of cached responses about one TwitterAccount, see refresh_candidates
+CANDIDATE_TAG = 'candidate:%(candidate)s'
 
 
 def call_endpoint(request, name):
@@ -69,20 +114,40 @@ def call_endpoint(request, name):
     return _REG.call_endpoint(request, name)
 
 
-@_REG.api_endpoint(secured=False)
+@_REG.api_endpoint(secured=False,
+                   cache=CachePolicy(ttl=600,
+                                     tags=['candidates', CANDIDATE_TAG],
+                                     stale=3600),
+                   params={'candidate': KeyOf('TwitterAccount')})
 def checkins(candidate):
     """ Return all checkins for the candidate.
 
-    :candidate: The urlsafe key to the TwitterAccount.
+    :candidate: The key to the TwitterAccount.
     :returns: All checkins from the database made by the twitter user
 
     """
-    try:
-        ckey = _k(candidate)
-        assert ckey.kind() == 'TwitterAccount'
-        return ckey.get().checkins
-    except AssertionError:
-        return {'error': 'Please specify a valid key toa twiter account.'}
+    return candidate.get().checkins
+
+
+@_REG.api_endpoint(secured=False,
+                   cache=CachePolicy(ttl=600,
+                                     tags=['candidates', CANDIDATE_TAG],
+                                     stale=3600),
+                   params={'candidate': KeyOf('TwitterAccount')})
+def checkin_profile(candidate):
+    """ Return the histograms of the checkins of the candidate.
+
+    A small fraction of the checkins in size, see profiles.py for the
+    layout. Missing or outdated profiles are built on the way.
+
+    :candidate: The key to the TwitterAccount.
+    :returns: The profile of the checkins.
+
+    """
+    profile = CheckinProfile.getOrBuild(candidate)
+    if profile is None:
+        raise Http404
+    return profile
 
 
 @_REG.api_endpoint(secured=True)
@@ -105,9 +170,16 @@ def export_judgements(curkey):
     }
 
 
-@_REG.api_endpoint(secured=True)
-def assign_taskpackage():
-    """ Return a taskpackage unassigned. """
+@_REG.api_endpoint(secured=True, params={'target': Int(min_value=1)})
+def assign_taskpackage(mode=None, target=None):
+    """ Return a taskpackage unassigned.
+
+    :mode: 'pool' or 'priority', ASSIGN_MODE if None.
+    :target: The redundancy target for 'priority', REDUNDANCY_TARGET if None.
+
+    """
+    if (mode or ASSIGN_MODE) == 'priority':
+        return assign_least_covered(target or REDUNDANCY_TARGET)
     try:
         mc = memcache.Client()
         pool = mc.gets('geo-expertise-tp-pool')
@@ -122,6 +194,54 @@ def assign_taskpackage():
         raise TaskPackage.NoMoreTaskPackage()
 
 
+@ndb.transactional
+def claim_taskpackage(tpkey, counts, target, expired):
+    """ Reopen the tasks below target in the package and mark it assigned.
+
+    :returns: The TaskPackage or None if it was claimed by someone else or
+        has reached the target.
+
+    """
+    tp = tpkey.get()
+    if tp.assigned_at > expired:
+        return None
+    tp.refreshCoverage(counts)
+    tp.progress = sorted([t for t in tp.tasks if counts[t] < target],
+                         key=counts.get)
+    if tp.progress:
+        tp.assigned_at = dt.utcnow()
+    tp.put()
+    return tp if tp.progress else None
+
+
+def assign_least_covered(target, size=20):
+    """ Return the package with the least judged tasks below target.
+
+    Packages are looked up in the order of their coverage, which may be
+    stale as tasks are shared among packages. So it is refreshed from
+    TaskCoverage before a package is claimed. Leased packages are skipped
+    page by page, as the lease cannot be filtered on next to coverage.
+
+    :target: The number of judgements wanted for each task.
+    :size: The number of packages looked at per page.
+    :returns: The urlsafe key to the package.
+
+    """
+    expired = dt.utcnow() - PACKAGE_LEASE
+    qry = TaskPackage.query(TaskPackage.coverage < target)\
+        .order(TaskPackage.coverage)
+    cur, more = None, True
+    while more:
+        tps, cur, more = qry.fetch_page(size, start_cursor=cur)
+        for tp in tps:
+            if tp.assigned_at > expired:
+                continue
+            if claim_taskpackage(tp.key, TaskCoverage.countsOf(tp.tasks),
+                                 target, expired):
+                return tp.key.urlsafe()
+    raise TaskPackage.NoMoreTaskPackage()
+
+
 @_REG.api_endpoint(secured=True)
 def refill_taskpool(_request):
     """ Refill the taskpool with non-recently touched tasks.
@@ -167,7 +287,7 @@ def flexopen(filename):
         return open(filename)
 
 
-@_REG.api_endpoint(secured=True)
+@_REG.api_endpoint(secured=True, cache=CachePolicy(ttl=60))
 def list_datafiles():
     """ List the data files in data dir.
 
@@ -177,11 +297,12 @@ def list_datafiles():
     return os.listdir('apps/data')
 
 
-def import_entities(filename, loader, pool=20):
+def import_entities(filename, loader, pool=20, kind=None):
     """ Import entities from file.
 
     :filename: The name of file in data.
     :loader: The function describe how the data should be loaded.
+    :kind: The kind imported, whose cached responses are invalidated.
     :returns: None
 
     """
@@ -198,6 +319,9 @@ def import_entities(filename, loader, pool=20):
     except IOError:
         # Check the skip_files in app.yaml may stop app accessing the datafile
         raise Http404
+    REFERENCE_CACHE.invalidate()
+    if kind in KIND_TAGS:
+        RESPONSE_CACHE.invalidate(KIND_TAGS[kind])
     return {
         'action': 'import',
         'type': loader.func_doc,
@@ -216,11 +340,93 @@ def import_candidates(filename):
     """
     def loader(rec):
         """ Loader for Twitter accounts and checkins. """
-        TwitterAccount(
+        account = TwitterAccount(
             # parent=DEFAULT_PARENT_KEY,
             screen_name=rec['screen_name'],
-            checkins=json.loads(rec['checkins'])).put()
-    return import_entities(filename, loader)
+            checkins=json.loads(rec['checkins']))
+        account.put()
+        CheckinProfile.make(account).put()
+    ret = import_entities(filename, loader, kind='TwitterAccount')
+    ret['index_job'] = jobs.start('index_candidates').as_viewdict()
+    return ret
+
+
+def refresh_candidates(accounts):
+    """ Rebuild the profiles of the accounts whose checkins changed and
+    drop the cached responses about them.
+
+    Called wherever checkins are written, i.e., the crawler, the stream
+    and process_pois.
+
+    :accounts: TwitterAccounts already put.
+    :returns: The keys of the accounts refreshed.
+
+    """
+    changed = CheckinProfile.refresh(accounts)
+    RESPONSE_CACHE.invalidate(*[CANDIDATE_TAG % {'candidate': k.urlsafe()}
+                                for k in changed])
+    return changed
+
+
+def map_index(ents, _params, _page):
+    """ Put the search documents of a page of TwitterAccounts. """
+    build_index(ents)
+    return []
+
+
+jobs.register('index_candidates', lambda p: TwitterAccount.query(),
+              map_index, page_size=SEARCH_BATCH_SIZE,
+              # searches are cached under the tag of candidates
+              done=lambda p: RESPONSE_CACHE.invalidate('candidates'))
+
+
+@_REG.api_endpoint(secured=True)
+def index_candidates():
+    """ Rebuild the search index of candidates.
+
+    A page of documents is put per task on the batch queue, see
+    job_status for the progress. Cached searches are dropped when the
+    job is done.
+
+    """
+    ck = jobs.start('index_candidates')
+    return {
+        'action': 'index_candidates',
+        'succeeded': True,
+        'num': 0,
+        'job': ck.as_viewdict()
+    }
+
+
+@_REG.api_endpoint(secured=True,
+                   cache=CachePolicy(ttl=300, tags=['candidates'], stale=600),
+                   params={'near': CSV(float, length=3),
+                           'size': Int(min_value=1, max_value=100)})
+def search_candidates(q=None, category=None, region=None, near=None,
+                      cursor=None, size=20):
+    """ Search candidates by their checkins.
+
+    :q: A query string of the Search API over the fields screen_name,
+        places, categories and text.
+    :category: A category of places to narrow down to.
+    :region: A region in checkin_stream.REGIONS to narrow down to.
+    :near: lat,lng,meters the most visited place should be within.
+    :cursor: The cursor returned with the previous page.
+    :size: The number of candidates in a page.
+    :returns: The candidates and the counts of categories and regions
+        among all matches.
+
+    """
+    found = search_index(q, {'category': category, 'region': region},
+                         near=near, limit=size, cursor=cursor)
+    return {
+        'action': 'search_candidates',
+        'succeeded': True,
+        'num': found['num'],
+        'candidates': found['results'],
+        'facets': found['facets'],
+        'cursor': found['cursor']
+    }
 
 
 @_REG.api_endpoint(secured=True)
@@ -243,16 +449,136 @@ def import_rankings(filename):
             rank_info={'profile_type': rec['profile_type'],
                        'rank': rec['rank'],
                        'score': rec['score']}).put()
-    return import_entities(filename, loader)
+    ret = import_entities(filename, loader, kind='ExpertiseRank')
+    ret['index_job'] = jobs.start('drop_postings').as_viewdict()
+    return ret
+
+
+# ------- Inverted index of candidates ------
+def topic_in_region(topic_id, region):
+    """ Return the value of the term of a topic ranked in a region. """
+    return u'%s@%s' % (topic_id, region)
+
+
+def map_ranking_terms(rankings, _params, _page):
+    """ Emit (term, candidate) for the topics and regions of rankings. """
+    return [(invindex.term(f, v), r.candidate)
+            for r in rankings
+            # postings hold integer ids
+            if r.candidate and r.candidate.integer_id()
+            for f, v in (('topic', r.topic_id),
+                         ('region', r.region),
+                         ('topic_region',
+                          topic_in_region(r.topic_id, r.region)))
+            if v]
+
+
+def map_checkin_terms(accounts, _params, _page):
+    """ Emit (term, account) for the regions visited and the categories
+    of places checked in.
+
+    """
+    pairs = list()
+    for ta in accounts:
+        places = [c['place'] for c in ta.checkins or [] if c.get('place')]
+        terms = set(invindex.term('visited', region_of(p['lat'], p['lng']))
+                    for p in places if p.get('lat') is not None)
+        terms.update(invindex.term('category', p['category']['name'])
+                     for p in places if p.get('category'))
+        pairs.extend((t, ta.key) for t in terms)
+    return pairs
+
+
+def reduce_postings(t, keys, _params, part, last):
+    """ Return the shard of a part of the posting list of a term. """
+    return invindex.make_part(t, [k.integer_id() for k in keys], part, last)
+
+
+# A shard per reduce page, the members are small
+POSTINGS_PAGE_SIZE = 5000
+
+jobs.register('index_rankings', lambda p: ExpertiseRank.query(),
+              map_ranking_terms, reduce_postings, after='index_checkins',
+              reduce_size=POSTINGS_PAGE_SIZE, partial=True)
+jobs.register('index_checkins', lambda p: TwitterAccount.query(),
+              map_checkin_terms, reduce_postings, page_size=100,
+              reduce_size=POSTINGS_PAGE_SIZE, partial=True,
+              # candidates_by is cached under both tags
+              done=lambda p: RESPONSE_CACHE.invalidate('rankings',
+                                                       'candidates'))
 
 
 @_REG.api_endpoint(secured=True)
+def index_candidate_terms():
+    """ Rebuild the inverted index from ExpertiseRanks, then checkins.
+
+    The old postings are deleted first, so terms no longer occurring do
+    not match the candidates they used to.
+
+    """
+    ck = jobs.start('drop_postings')
+    return {
+        'action': 'index_candidate_terms',
+        'succeeded': True,
+        'num': 0,
+        'job': ck.as_viewdict()
+    }
+
+
+@_REG.api_endpoint(secured=True,
+                   cache=CachePolicy(ttl=300, tags=['rankings', 'candidates'],
+                                     stale=600),
+                   params={'topic': CSV(), 'region': CSV(),
+                           'category': CSV(), 'visited': CSV(),
+                           'after': Int(min_value=0),
+                           'size': Int(min_value=1, max_value=1000)})
+def candidates_by(topic=None, region=None, category=None, visited=None,
+                  after=0, size=100):
+    """ Return the candidates matching all the given fields, each
+    matching any of its values, e.g., topic=1,2&region=chicago.
+
+    Given both topics and regions, the candidates are ranked for one of
+    the topics in one of the regions.
+
+    :topic: topic_ids the candidates are ranked for.
+    :region: Regions the candidates are ranked in.
+    :category: Categories of places the candidates checked in.
+    :visited: Regions the candidates checked in, see checkin_stream.
+    :after: Only candidates with larger ids, the next of the last page.
+    :size: The number of candidates in a page.
+
+    """
+    fields = [('topic', topic), ('region', region),
+              ('category', category), ('visited', visited)]
+    if topic and region:
+        # a candidate ranked for the topic may be ranked in the region for
+        # another topic, so the pairs are looked up instead
+        fields[:2] = [('topic_region', [topic_in_region(t, r)
+                                        for t in topic for r in region])]
+    clauses = [[invindex.term(f, v) for v in vs] for f, vs in fields if vs]
+    ids = (yield invindex.query_async(clauses)) if clauses else []
+    start = invindex.gallop(ids, after + 1)
+    page = ids[start:start + size]
+    raise ndb.Return({
+        'action': 'candidates_by',
+        'succeeded': True,
+        'num': len(ids),
+        'candidates': [ndb.Key(TwitterAccount, i).urlsafe() for i in page],
+        'next': page[-1] if start + size < len(ids) else None
+    })
+
+
+@_REG.api_endpoint(secured=True,
+                   cache=CachePolicy(ttl=300, tags=['tasks', 'rankings'],
+                                     stale=600))
 def task_stats():
     """ Return a statistics for tasks. """
-    tasks = AnnotationTask.query()
-    stats = [(t.key.urlsafe(), r.get().topic_id, t.candidate.urlsafe())
-             for t in tasks.fetch()
-             for r in t.rankings]
+    tasks = AnnotationTask.query().fetch()
+    REFERENCE_CACHE.warm([r for t in tasks if not t.hasSummary()
+                          for r in t.rankings])
+    stats = [(t.key.urlsafe(), topic_id, t.candidate.urlsafe())
+             for t in tasks
+             for topic_id, _, _ in t.summary()]
     return {
         'tasks': len(set(t[0] for t in stats)),
         'topics': len(set([t[1] for t in stats])),
@@ -261,22 +587,27 @@ def task_stats():
     }
 
 
-@_REG.api_endpoint(secured=True)
+@_REG.api_endpoint(secured=True,
+                   cache=CachePolicy(ttl=60,
+                                     tags=sorted(set(KIND_TAGS.values())),
+                                     stale=300))
 def model_stats():
-    """ Return a statistics for tasks. """
-    return {
-        'AnnotationTask': len(AnnotationTask.query().fetch(keys_only=True)),
-        'GeoEntity': len(GeoEntity.query().fetch(keys_only=True)),
-        'TwitterAccount': len(TwitterAccount.query().fetch(keys_only=True)),
-        'TaskPackage': len(TaskPackage.query().fetch(keys_only=True)),
-        'ExpertiseRank': len(ExpertiseRank.query().fetch(keys_only=True)),
-        'Judgement': len(Judgement.query().fetch(keys_only=True)),
-        'User': len(User.query().fetch(keys_only=True)),
-        'Unfinished': sum([len(tp.progress) for tp in TaskPackage.query().fetch()])
-    }
+    """ Return a statistics for tasks.
 
+    All the counts are queried at the same time.
 
-@_REG.api_endpoint(secured=True)
+    """
+    models = [AnnotationTask, GeoEntity, TwitterAccount, TaskPackage,
+              ExpertiseRank, Judgement, User]
+    results = yield [m.query().count_async() for m in models] + \
+        [TaskPackage.query().fetch_async()]
+    stats = dict((m.__name__, c) for m, c in zip(models, results))
+    stats['Unfinished'] = sum([len(tp.progress) for tp in results[-1]])
+    raise ndb.Return(stats)
+
+
+@_REG.api_endpoint(secured=True,
+                   cache=CachePolicy(ttl=60, tags=['judgements'], stale=300))
 def judgement_stats():
     """ Return a statistics for tasks. """
     judgement = Judgement.query()
@@ -288,11 +619,88 @@ def judgement_stats():
     }
 
 
+def reset_package(tp):
+    """ Reopen all tasks of the package for assignment. """
+    tp.progress = list(tp.tasks)
+    tp.assigned_at = dt.strptime("2000-01-01", "%Y-%m-%d")
+    # corrected from TaskCoverage when the package is assigned by priority
+    tp.coverage = 0
+    return tp
+
+
+def map_reset_progress(packages, _params, _page):
+    """ Reset the progress of a page of packages. """
+    return [reset_package(tp) for tp in packages]
+
+
+def map_reset_coverage(coverages, _params, _page):
+    """ Zero the judgement counts of a page of TaskCoverages. """
+    for c in coverages:
+        c.judgements = 0
+    return coverages
+
+
+def map_delete(kind):
+    """ Return a mapper deleting a page of keys of the kind. """
+    def mapper(keys, _params, _page):
+        """ Delete the keys in parallel. """
+        futures = ndb.delete_multi_async(keys)
+        if kind == 'TwitterAccount':
+            # searches would return the deleted accounts otherwise
+            unindex(keys)
+        ndb.Future.wait_all(futures)
+        return []
+    return mapper
+
+
+def invalidate_kind(kind):
+    """ Return a done hook dropping the cached responses and references
+    of the kind, once the job has written all of it.
+
+    """
+    def done(_params):
+        """ Drop the caches. """
+        if kind in KIND_TAGS:
+            RESPONSE_CACHE.invalidate(KIND_TAGS[kind])
+        if kind in ReferenceCache.KINDS:
+            REFERENCE_CACHE.invalidate()
+    return done
+
+
+# Kinds that clear_entities accepts
+CLEARABLE_KINDS = ['User', 'Judgement', 'TaskCoverage', 'TaskPackage',
+                   'AnnotationTask', 'TwitterAccount', 'GeoEntity',
+                   'ExpertiseRank', 'CachedResponse', 'IndexEntry',
+                   'CheckinProfile', 'PoiCategory']
+
+jobs.register('reset_progress',
+              lambda p: TaskPackage.query(),
+              map_reset_progress, done=invalidate_kind('TaskPackage'))
+jobs.register('reset_coverage',
+              lambda p: TaskCoverage.query(),
+              map_reset_coverage, page_size=500,
+              done=invalidate_kind('TaskCoverage'))
+for _kind in CLEARABLE_KINDS:
+    jobs.register('clear_' + _kind,
+                  lambda p, k=_kind: ndb.Query(kind=k),
+                  map_delete(_kind), page_size=500, keys_only=True,
+                  done=invalidate_kind(_kind))
+# clears the inverted index before rebuilding it, see index_candidate_terms
+jobs.register('drop_postings', lambda p: ndb.Query(kind='IndexEntry'),
+              map_delete('IndexEntry'), page_size=500, keys_only=True,
+              after='index_rankings')
+
+
 @_REG.api_endpoint(secured=True)
 def reset(level):
     """ Reset for welcoming new judgements
         Users and Judgements will be cleared
         Taskpackages progress will be reset
+
+    Each kind is cleared by its own job, so they run in parallel on the
+    batch queue. The caches of a kind are dropped when its job is done.
+    See reset_status for the progress.
+
     """
     # reset levels
     PROGRESS = 'progress'
@@ -300,46 +708,55 @@ def reset(level):
     TASKS = 'tasks'
     ALL = 'ALL'
 
-    def remove(kind):
-        """ Remove all entities in a model """
-        return tq.Task(params={'_admin_key': APIRegistry.ADMIN_KEY,
-                               'kind': kind},
-                       url='/api/data/clear_entities',
-                       method='GET'
-                      ).add('batch')
-
-    # Resetting
-    if level in [PROGRESS, ANNOTATION, TASKS, ALL]:
-        for tp in TaskPackage.query().fetch(keys_only=True):
-            tq.Task(params={'key': tp,
-                            '_admin_key': APIRegistry.ADMIN_KEY},
-                    url='/api/data/reset_progress',
-                    method='GET').add('batch')
+    names = list()
+    if level in [PROGRESS, ANNOTATION]:
+        # packages are removed at the other levels
+        names.append('reset_progress')
     if level in [ANNOTATION, TASKS, ALL]:
-        remove('User')
-        remove('Judgement')
+        names.extend(['clear_User', 'clear_Judgement'])
+    if level == ANNOTATION:
+        # the tasks stay, judged by none of the cleared judgements
+        names.append('reset_coverage')
     if level in [TASKS, ALL]:
-        remove('TaskPackage')
-        remove('AnnotationTask')
+        names.extend(['clear_TaskPackage', 'clear_AnnotationTask',
+                      'clear_TaskCoverage'])
     if level == ALL:
-        remove('TwitterAccount')
-        remove('GeoEntity')
-        remove('ExpertiseRank')
+        # the index and profiles are derived from the kinds cleared here
+        names.extend(['clear_TwitterAccount', 'clear_GeoEntity',
+                      'clear_ExpertiseRank', 'clear_IndexEntry',
+                      'clear_CheckinProfile', 'clear_PoiCategory'])
+    jobs.start_multi(names)
 
     return {
         'action': 'reset',
         'level': level,
-        'succeeded': True
+        'succeeded': level in [PROGRESS, ANNOTATION, TASKS, ALL],
+        'num': len(names),
+        'jobs': names
     }
 
 
 @_REG.api_endpoint(secured=True)
+def reset_status():
+    """ Return the progress of the jobs started by reset. """
+    names = ['reset_progress', 'reset_coverage'] + \
+        ['clear_' + k for k in CLEARABLE_KINDS]
+    cks = [c for c in ndb.get_multi([ndb.Key(jobs.JobCheckpoint, n)
+                                     for n in names]) if c]
+    return {
+        'action': 'reset_status',
+        'succeeded': True,
+        'num': sum(c.mapped for c in cks),
+        'done': all(c.phase == jobs.DONE for c in cks),
+        'jobs': [c.as_viewdict() for c in cks]
+    }
+
+
+@_REG.api_endpoint(secured=True, params={'tpkey': KeyOf('TaskPackage')})
 def reset_progress(tpkey):
     """ Reset taskpackage progress. """
     # pylint: disable=invalid-name
-    tp = ndb.Key(urlsafe=tpkey).get()
-    tp.progress = list(tp.tasks)
-    tp.assigned_at = dt.strptime("2000-01-01", "%Y-%m-%d")
+    tp = reset_package(tpkey.get())
     tp.put()
     return {
         'action': 'reset_taskpackage',
@@ -353,17 +770,26 @@ def reset_progress(tpkey):
 def clear_entities(kind):
     """ Remove all entities from the given model
 
+    The keys are deleted in pages of 500 by a job on the batch queue.
+
     :kind: The name of the model (str)
     :returns: TODO
 
     """
-    import apps.profileviewer.models as models
-    ins = getattr(models, kind).query().fetch(keys_only=True)
-    ndb.delete_multi(ins)
+    if kind not in CLEARABLE_KINDS:
+        return {
+            'action': 'clear_entities',
+            'kind': kind,
+            'succeeded': False,
+            'num': 0
+        }
+    ck = jobs.start('clear_' + kind)
     return {
         'action': 'clear_entities',
         'kind': kind,
-        'num': len(ins)
+        'succeeded': True,
+        'num': 0,
+        'job': ck.as_viewdict()
     }
 
 
@@ -385,187 +811,345 @@ def import_geoentities(filename):
             level=rec['level'],
             info=json.loads(rec['info']),
             example=rec['example'],
-            url=rec['url']).put()
-    return import_entities(filename, loader)
+            url=rec['url'],
+            geopt=GeoEntity.geoptOf(info)).put()
+    return import_entities(filename, loader, kind='GeoEntity')
 
 
-def partition(iterator, size=10, margin=None):
-    """ Partitioning iterator into groups of elements in given size.
+@_REG.api_endpoint(secured=True)
+def index_geoentities(curkey=None):
+    """ Rebuild the spatial index of GeoEntities page by page.
 
-    The margin is for the last group of elements.
-    If there are less than margin number of elements, they will be
-    grouped together. E.g., the last group may contain 15, 14, 13
-    elements if margin is 15.
+    Each call re-puts one page and queues the next one. Entities imported
+    before geopt existed get it from their info.
 
-    :iterator: An iterator through some elements.
-    :size: The maximum size of a group.
-    :margin: If the rest of elements
-    :yields: a group containing at most the given size of
-    the elements from iterator.
+    :curkey: The urlsafe cursor to start from.
 
     """
+    cur = Cursor(urlsafe=curkey) if curkey else None
+    ents, next_cur, more = GeoEntity.query().fetch_page(500, start_cursor=cur)
+    for e in ents:
+        e.geopt = e.geopt or GeoEntity.geoptOf(e.info)
+    ndb.put_multi([e for e in ents if e.geopt is not None])
+    if more:
+        tq.Task(params={'curkey': next_cur.urlsafe(),
+                        '_admin_key': APIRegistry.ADMIN_KEY},
+                url='/api/data/index_geoentities',
+                method='GET').add('batch')
+    return {
+        'action': 'index_geoentities',
+        'succeeded': True,
+        'num': len(ents),
+        'more': more
+    }
 
-    margin = margin if margin else int(1.5 * size)
-    assert margin < 2 * size, \
-        'The margin %s is too large for size %s' % (margin, size)
 
-    grps = Stream() << map(
-        (lambda x: [i[1] for i in x]),
-        map(L[1],
-            Stream() <<
-            groupby(izip(cycle([0] * size + [1] * size), iterator),
-                    key=L[0])))
-    for nex, cur in zip_longest(drop(1, grps), grps):
-        if nex and len(cur + nex) <= margin:
-            yield cur + nex
-            return
-        else:
-            yield cur
+@_REG.api_endpoint(secured=True)
+def backfill_task_summaries(curkey=None):
+    """ Fill topic_ids, rank_methods and profile_types of AnnotationTasks
+    made before they were introduced, page by page.
 
+    Each call processes one page and queues the next one.
 
-@_REG.api_endpoint(secured=True)
-def make_simple_tasks(rank_method, topic_id):
-    """ Make tasks based on candidates. """
-    candidates = ExpertiseRank.listCandidates(rank_method, topic_id)
-    cnt = 0
-    for cand in candidates:
-        rankings = ExpertiseRank.getForCandidate(cand.candidate)
-        for _, grp in groupby(sorted(rankings, key=L.topic_id),
-                              key=L.topic_id):
-            AnnotationTask(
-                rankings=[r.key for r in grp],
-                candidate=cand.candidate).put()
-            cnt += 1
+    :curkey: The urlsafe cursor to start from.
+
+    """
+    cur = Cursor(urlsafe=curkey) if curkey else None
+    tasks, next_cur, more = AnnotationTask.query().fetch_page(
+        200, start_cursor=cur)
+    tasks = [t for t in tasks if not t.hasSummary()]
+    rkeys = list(set(r for t in tasks for r in t.rankings))
+    rankings = dict(zip(rkeys, ndb.get_multi(rkeys)))
+    for t in tasks:
+        t.fillSummary([rankings[r] for r in t.rankings])
+    ndb.put_multi(tasks)
+    if more:
+        tq.Task(params={'curkey': next_cur.urlsafe(),
+                        '_admin_key': APIRegistry.ADMIN_KEY},
+                url='/api/data/backfill_task_summaries',
+                method='GET').add('batch')
     return {
-        'action': 'make_simple_tasks',
+        'action': 'backfill_task_summaries',
         'succeeded': True,
-        'tasks': len(AnnotationTask.query().fetch(keys_only=True)),
-        'num': cnt
+        'num': len(tasks),
+        'more': more
     }
 
 
-@_REG.api_endpoint(secured=True)
-def make_compact_tasks():
-    """ Make tasks based on candidates. """
-    candidates = ExpertiseRank.listCandidates()
-    cnt = 0
-    for cand in candidates:
-        rankings = ExpertiseRank.getForCandidate(cand.candidate)
-        AnnotationTask(
-            rankings=[r.key for r in rankings],
-            candidate=cand.candidate).put()
-        cnt += 1
+def new_taskpackage(tkeys, tpid=None):
+    """ Return a new TaskPackage of the tasks (not put yet).
+
+    :tkeys: A list of keys to AnnotationTasks.
+    :tpid: The id of the package, allocated by the datastore if None.
+
+    """
+    return TaskPackage(
+        # parent=DEFAULT_PARENT_KEY,
+        id=tpid,
+        tasks=tkeys,
+        progress=tkeys,
+        done_by=list(),
+        confirm_code=newToken('').split('-')[-1],
+        assigned_at=dt(2000, 1, 1),
+        coverage=0
+    )
+
+
+def unwritten(packages):
+    """ Leave out the packages put before.
+
+    The ids of generated packages are derived from the page or group, so
+    rerunning a job without a reset keeps the progress and assignments
+    of the existing packages instead of overwriting them.
+
+    """
+    existing = ndb.get_multi([tp.key for tp in packages])
+    return [tp for tp, e in zip(packages, existing) if e is None]
+
+
+def group_id(group):
+    """ Return a short id for the group usable in entity ids. """
+    return hashlib.md5(group.encode('utf-8')).hexdigest()[:12]
+
+
+def map_candidate_tasks(compact):
+    """ Return a mapper making tasks for a page of candidates.
+
+    Task ids are derived from the candidate (and the topic), so that a
+    page done twice after an interruption overwrites the same tasks.
+
+    :compact: Whether to make one task per candidate instead of one per
+        candidate and topic.
+
+    """
+    def mapper(cands, _params, _page):
+        """ Make tasks for the candidates in the page. """
+        futs = [ExpertiseRank.query(ExpertiseRank.candidate == c.candidate)
+                .fetch_async() for c in cands]
+        tasks = list()
+        for cand, fut in zip(cands, futs):
+            cid = cand.candidate.id()
+            rankings = fut.get_result()
+            if compact:
+                tasks.append(AnnotationTask.fromRankings(
+                    rankings, cand.candidate, 'compact-%s' % (cid,)))
+                continue
+            for topic_id, grp in groupby(sorted(rankings, key=L.topic_id),
+                                         key=L.topic_id):
+                tasks.append(AnnotationTask.fromRankings(
+                    list(grp), cand.candidate,
+                    'simple-%s-%s' % (cid, group_id(topic_id))))
+        return tasks + TaskCoverage.missing([t.key for t in tasks])
+    return mapper
+
+
+def map_topical(tasks, _params, _page):
+    """ Group tasks by the topic of their first ranking. """
+    return [(t.summary()[0][0], t.key) for t in tasks]
+
+
+def map_methodical(tasks, _params, _page):
+    """ Group tasks by rank_method and topic of their checkin rankings. """
+    return [(u'%s\t%s' % (rank_method, topic_id), t.key)
+            for t in tasks
+            for rank_method, topic_id in set(
+                (rank_method, topic_id)
+                for topic_id, rank_method, profile_type in t.summary()
+                if profile_type == 'rankCheckinProfile')]
+
+
+def map_random(tasks, _params, page):
+    """ Package the tasks of a page in the order of the query.
+
+    Pages have a multiple of 10 tasks, so only the last page has a
+    remainder and partition merges it as it would over all tasks.
+
+    """
+    return unwritten([
+        new_taskpackage(tkeys, 'random-%s-%s' % (page, i))
+        for i, tkeys in enumerate(partition([t.key for t in tasks], 10))])
+
+
+def reduce_packages(prefix):
+    """ Return a reducer packaging all tasks of a group. """
+    def reducer(group, tkeys, _params):
+        """ Partition the tasks of a group into packages. """
+        gid = group_id(group)
+        return unwritten([
+            new_taskpackage(keys, '%s-%s-%s' % (prefix, gid, i))
+            for i, keys in enumerate(partition(tkeys, 10))])
+    return reducer
+
+
+jobs.register('make_simple_tasks',
+              lambda p: ExpertiseRank.listCandidates(p.get('rank_method'),
+                                                     p.get('topic_id')),
+              map_candidate_tasks(compact=False), page_size=50)
+jobs.register('make_compact_tasks',
+              lambda p: ExpertiseRank.listCandidates(),
+              map_candidate_tasks(compact=True), page_size=50)
+jobs.register('make_topical_taskpackages',
+              lambda p: AnnotationTask.query(),
+              map_topical, reduce_packages('topical'))
+jobs.register('make_methodical_taskpackages',
+              lambda p: AnnotationTask.query(),
+              map_methodical, reduce_packages('methodical'))
+jobs.register('make_random_taskpackages',
+              lambda p: AnnotationTask.query(),
+              map_random)
+
+
+def map_another_pass(coverages, params, page):
+    """ Package the least judged tasks of a page. """
+    tkeys = [ndb.Key(AnnotationTask, c.key.id()) for c in coverages]
+    return unwritten([
+        new_taskpackage(keys, 'another-%s-%s-%s' % (params['level'], page, i))
+        for i, keys in enumerate(partition(tkeys, 10))])
+
+
+def map_judgement_tasks(judgements, _params, _page):
+    """ Group judgements by their task. """
+    return [(j.task.urlsafe(), j.key) for j in judgements]
+
+
+def reduce_task_coverage(group, jkeys, _params):
+    """ Count the submissions of a task, one judgement per topic. """
+    tkey = ndb.Key(urlsafe=group)
+    task = REFERENCE_CACHE.get(tkey)
+    if task is None:
+        return []
+    return [TaskCoverage(key=TaskCoverage.keyOf(tkey),
+                         judgements=len(jkeys) // max(1, len(set(
+                             topic_id for topic_id, _, _ in task.summary()))))]
+
+
+def map_missing_coverage(tasks, _params, _page):
+    """ Add zero coverages for tasks never judged. """
+    return TaskCoverage.missing([t.key for t in tasks])
+
+
+def map_package_coverage(packages, _params, _page):
+    """ Refresh the coverage of packages with one lookup per page. """
+    counts = TaskCoverage.countsOf(list(set(t for tp in packages
+                                             for t in tp.tasks)))
+    for tp in packages:
+        tp.refreshCoverage(dict((t, counts[t]) for t in tp.tasks))
+    return packages
+
+
+jobs.register('make_another_pass_taskpackages',
+              lambda p: TaskCoverage.query(
+                  TaskCoverage.judgements == p['level']),
+              map_another_pass)
+jobs.register('count_task_judgements',
+              lambda p: Judgement.query(projection=['task']),
+              map_judgement_tasks, reduce_task_coverage,
+              after='init_task_coverage')
+jobs.register('init_task_coverage',
+              lambda p: AnnotationTask.query(),
+              map_missing_coverage, after='index_package_coverage')
+jobs.register('index_package_coverage',
+              lambda p: TaskPackage.query(),
+              map_package_coverage)
+
+
+def start_job(name, **params):
+    """ Start a generation job and return the response of the endpoint. """
+    ck = jobs.start(name, params)
+    RESPONSE_CACHE.invalidate('tasks')
     return {
-        'action': 'make_compact_tasks',
+        'action': name,
         'succeeded': True,
-        'tasks': len(AnnotationTask.query().fetch(keys_only=True)),
-        'num': cnt
+        'num': 0,
+        'job': ck.as_viewdict()
     }
 
 
+@_REG.api_endpoint(secured=True)
+def make_simple_tasks(rank_method, topic_id):
+    """ Make tasks based on candidates, one per candidate and topic.
+
+    The tasks are made by a job on the batch queue, see job_status.
+
+    """
+    return start_job('make_simple_tasks',
+                     rank_method=rank_method, topic_id=topic_id)
+
+
+@_REG.api_endpoint(secured=True)
+def make_compact_tasks():
+    """ Make tasks based on candidates, one per candidate. """
+    return start_job('make_compact_tasks')
+
+
 @_REG.api_endpoint(secured=True)
 def make_topical_taskpackages():
-    """ Group tasks in to packages. """
-    mapping = sorted([(at.key, at.rankings[0].get().topic_id)
-                      for at in AnnotationTask.query().fetch()],
-                     key=L[1])
-    cnt = 0
-    for _, tasks in groupby(mapping, key=L[1]):
-        for tkeys in partition([t[0] for t in tasks], 10):
-            TaskPackage(
-                # parent=DEFAULT_PARENT_KEY,
-                tasks=tkeys,
-                progress=tkeys,
-                done_by=list(),
-                confirm_code=newToken('').split('-')[-1],
-                assigned_at=dt(2000, 1, 1)
-            ).put()
-            cnt += 1
-    return {
-        'action': 'make_topical_taskpackages',
-        'succeeded': True,
-        'task_packages': len(TaskPackage.query().fetch(keys_only=True)),
-        'num': cnt
-    }
+    """ Group tasks in to packages by topic. """
+    return start_job('make_topical_taskpackages')
 
 
 @_REG.api_endpoint(secured=True)
 def make_methodical_taskpackages():
-    """ Group tasks in to packages. """
-    def iter_annotationtask():
-        """ iterating though pairs of task and rank_method."""
-        for atask in AnnotationTask.query().fetch():
-            for rank_key in atask.rankings:
-                rank = rank_key.get()
-                if rank.rank_info['profile_type'] == 'rankCheckinProfile':
-                    yield atask.key, rank.rank_method, rank.topic_id
-    pairs = sorted(iter_annotationtask(), key=lambda x: (x[1], x[2]))
-    cnt = 0
-    for _, tasks in groupby(pairs, key=lambda x: (x[1], x[2])):
-        for tkeys in partition([t[0] for t in tasks], 10):
-            TaskPackage(
-                # parent=DEFAULT_PARENT_KEY,
-                tasks=tkeys,
-                progress=tkeys,
-                done_by=list(),
-                confirm_code=newToken('').split('-')[-1],
-                assigned_at=dt(2000, 1, 1)
-            ).put()
-            cnt += 1
-    return {
-        'action': 'make_methodical_taskpackages',
-        'succeeded': True,
-        'taskpackages': len(TaskPackage.query().fetch(keys_only=True)),
-        'num': cnt
-    }
+    """ Group tasks in to packages by rank_method and topic. """
+    return start_job('make_methodical_taskpackages')
 
 
 @_REG.api_endpoint(secured=True)
 def make_random_taskpackages():
     """ Group tasks in to packages. """
-    cnt = 0
-    for tasks in partition(AnnotationTask.query().fetch(), 10):
-        tkeys = [t.key for t in tasks]
-        TaskPackage(
-            # parent=DEFAULT_PARENT_KEY,
-            tasks=tkeys,
-            progress=tkeys,
-            done_by=list(),
-            confirm_code=newToken('').split('-')[-1],
-            assigned_at=dt(2000, 1, 1)
-        ).put()
-        cnt += 1
+    return start_job('make_random_taskpackages')
+
+
+@_REG.api_endpoint(secured=True)
+def run_job(name):
+    """ Process the next page of a job, resuming from its checkpoint. """
+    ck = jobs.run_page(name)
     return {
-        'action': 'make_random_taskpackages',
-        'succeeded': True,
-        'taskpackages': len(TaskPackage.query().fetch(keys_only=True)),
-        'num': cnt
+        'action': 'run_job',
+        'succeeded': ck is not None,
+        'num': ck.page if ck else 0,
+        'job': ck.as_viewdict() if ck else None
     }
 
+
 @_REG.api_endpoint(secured=True)
-def make_another_pass_taskpackages():
-    """ Group tasks in to packages. """
-    cnt = 0
-    tasks_dist = Counter([j.task for j in Judgement.query().fetch(projection=('task',))] +
-                         AnnotationTask.query().fetch(keys_only=True))
-    least = tasks_dist.most_common()[-1][1]
-    tasks = [k for k, c in tasks_dist.most_common() if c == least]
-    for tkeys in partition(tasks, 10):
-        TaskPackage(
-            # parent=DEFAULT_PARENT_KEY,
-            tasks=tkeys,
-            progress=tkeys,
-            done_by=list(),
-            confirm_code=newToken('').split('-')[-1],
-            assigned_at=dt(2000, 1, 1)
-        ).put()
-        cnt += 1
+def job_status(name=None):
+    """ Return the checkpoints of the named or all jobs. """
+    names = [name] if name else sorted(jobs.JOBS)
+    cks = [c for c in ndb.get_multi([ndb.Key(jobs.JobCheckpoint, n)
+                                     for n in names]) if c]
     return {
-        'action': 'make_another_pass_taskpackages',
+        'action': 'job_status',
         'succeeded': True,
-        'num': cnt
+        'num': len(cks),
+        'jobs': [c.as_viewdict() for c in cks]
     }
 
+
+@_REG.api_endpoint(secured=True)
+def make_another_pass_taskpackages():
+    """ Group the least judged tasks in to packages. """
+    least = TaskCoverage.query().order(TaskCoverage.judgements).get()
+    if least is None:
+        return {
+            'action': 'make_another_pass_taskpackages',
+            'succeeded': False,
+            'num': 0
+        }
+    return start_job('make_another_pass_taskpackages',
+                     level=least.judgements)
+
+
+@_REG.api_endpoint(secured=True)
+def index_task_coverage():
+    """ Rebuild TaskCoverage from Judgements and the coverage of packages.
+
+    Needed once for judgements made before TaskCoverage was introduced.
+
+    """
+    return start_job('count_task_judgements')
+
+
 @_REG.api_endpoint()
 def AxdFKxbczxW(cf_code):
     """ Verify confirmation code.
@@ -581,57 +1165,164 @@ def AxdFKxbczxW(cf_code):
     return False
 
 
+def iter_csv(records):
+    """ Iterate through the lines of records in csv.
+
+    :records: An iterator through records in dict objects
+    :yields: The header and then one line per record
+
+    """
+    buf = StringIO()
+    csvwr = None
+    for rec in records:
+        if csvwr is None:
+            csvwr = csv.DictWriter(buf, rec.keys())
+            csvwr.writeheader()
+        csvwr.writerow(rec)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+
+def iter_json(records):
+    """ Iterate through the pieces of a json array of records.
+
+    :records: An iterator through records in dict objects
+
+    """
+    sep = '['
+    for rec in records:
+        yield sep + json.dumps(rec)
+        sep = ',\n'
+    yield '[]' if sep == '[' else ']'
+
+
 def export_as_csv(records):
     """ Export the records in csv
 
-    :records: A list of records in dict objects
-    :returns: A http response
+    :records: An iterator through records in dict objects
+    :returns: A http response streaming the records
 
     """
-    response = HttpResponse(content_type='text/csv')
+    response = StreamingHttpResponse(iter_csv(records),
+                                     content_type='text/csv')
     response['Content-Disposition'] = 'attachment; filename="exported_taskpackages.csv"'
-
-    iterrec = iter(records)
-    try:
-        rec = iterrec.next()
-        csvwr = csv.DictWriter(response, rec.keys())
-        csvwr.writeheader()
-        csvwr.writerow(rec)
-        csvwr.writerows(iterrec)
-    except StopIteration:
-        pass
     return response
 
 
-@_REG.api_endpoint(secured=True, tojson=False)
-def tasksearch(_request, timespan=None, topic_id=None, judgement_id=None):
-    """TODO: Docstring for tasks.
-    :returns: TODO
+def iter_pages(qry, size=200):
+    """ Iterate through the results of qry page by page.
+
+    The next page is requested before the current one is handed out.
+
+    :qry: A ndb query.
+    :size: The number of entities in a page.
+    :yields: Lists of entities.
 
     """
-    url_template = lambda tid, jmds: _request.build_absolute_uri('/task/%s?review=%s' % (tid, ','.join(jmds)))
-    resp = HttpResponse()
-    resp.write('<html><body><ol>')
+    fut = qry.fetch_page_async(size)
+    while fut:
+        ents, cur, more = fut.get_result()
+        fut = qry.fetch_page_async(size, start_cursor=cur) if more else None
+        yield ents
+
+
+def review_rows(jdgs, names, url_template):
+    """ Return the dicts of judgements listed for reviewing.
+
+    :jdgs: A list of Judgements.
+    :names: A dict of screen_names by candidate key.
+    :url_template: A function(task, jkey) returning the url for reviewing.
+
+    """
+    return [{'jkey': j.key.urlsafe(),
+             'judge': j.judge.urlsafe() if j.judge else None,
+             'candidate': names.get(j.candidate),
+             'topic_id': j.topic_id,
+             'score': j.score,
+             'created_at': j.created_at.isoformat() if j.created_at else None,
+             'url': url_template(j.task.urlsafe(), j.key.urlsafe())}
+            for j in jdgs]
+
+
+@_REG.api_endpoint(secured=True, tojson=False,
+                   params={'timespan': CSV(DateTime(), length=2),
+                           'judgement_id': KeyOf('Judgement'),
+                           'judge': KeyOf('User'),
+                           'cursor': PageCursor,
+                           'size': Int(min_value=1, max_value=500)})
+def tasksearch(_request, timespan=None, topic_id=None, judgement_id=None,
+               judge=None, cursor=None, size=50, fmt='html'):
+    """ Search judgements for reviewing, the latest first, page by page.
+
+    The queries are served by the composite indexes on (topic_id,
+    created_at), (judge, created_at) and (judge, topic_id, created_at)
+    in index.yaml.
+
+    :timespan: The start and the end of created_at.
+    :topic_id: The topic judged.
+    :judgement_id: A judgement of the judge, use judge to save a get.
+    :judge: The key of the User judging.
+    :cursor: The cursor returned with the previous page.
+    :size: The number of judgements in a page.
+    :fmt: 'html' or 'json'.
+    :returns: A page of judgements with the cursor of the next page.
+
+    """
+    url_template = lambda tid, jkey: _request.build_absolute_uri(
+        '/task/%s?review=%s' % (tid, jkey))
     jmd = Judgement.query()
 
     if timespan is not None:
-        start, end = [dt.strptime(x, '%Y-%m-%dT%H:%M:%S') for x in timespan.split(',')]
-        jmd = jmd.filter(Judgement.created_at > start).filter(Judgement.created_at < end)
+        start, end = timespan
+        jmd = jmd.filter(Judgement.created_at > start)\
+            .filter(Judgement.created_at < end)
 
     if topic_id is not None:
         jmd = jmd.filter(Judgement.topic_id == topic_id)
 
-    if judgement_id is not None:
-        jmd = jmd.filter(Judgement.judge == _k(judgement_id, 'Judgement').get().judge)
+    if judge is None and judgement_id is not None:
+        judge = (yield judgement_id.get_async()).judge
+    if judge is not None:
+        jmd = jmd.filter(Judgement.judge == judge)
 
-    for j in jmd.fetch(50):
-        resp.write('<li><a href="{0}">{1.topic_id}</a>  {2} :  {1.score}</li>'\
-                    .format(url_template(j.task.urlsafe(), [j.key.urlsafe()]), j, j.candidate.get().screen_name))
-    resp.write('</ol></body></html>')
-    return resp
+    jdgs, next_cur, more = yield jmd.order(-Judgement.created_at)\
+        .fetch_page_async(size, start_cursor=cursor)
+    # names of all candidates in the page are resolved in one batch
+    names = yield TwitterAccount.screenNamesAsync(
+        [j.candidate for j in jdgs])
+    rows = review_rows(jdgs, names, url_template)
+    next_cursor = next_cur.urlsafe() if more and next_cur else None
 
+    if fmt == 'json':
+        raise ndb.Return(HttpResponse(dumps({
+            'action': 'tasksearch',
+            'succeeded': True,
+            'num': len(rows),
+            'cursor': next_cursor,
+            'more': bool(next_cursor),
+            'judgements': rows
+        }), mimetype="application/json"))
 
-@_REG.api_endpoint(secured=True, tojson=False)
+    resp = HttpResponse()
+    resp.write('<html><body><ol>')
+    for r in rows:
+        resp.write(u'<li><a href="{0}">{1}</a>  {2} :  {3}</li>'.format(
+            escape(r['url']), escape(r['topic_id']), escape(r['candidate']),
+            r['score']).encode('utf-8'))
+    resp.write('</ol>')
+    if next_cursor:
+        args = dict((k, v.encode('utf-8'))
+                    for k, v in request_args(_request).iteritems())
+        args['cursor'] = next_cursor
+        resp.write('<a href="%s">next</a>' % (escape(
+            _request.build_absolute_uri(
+                _request.path + '?' + urllib.urlencode(args))), ))
+    resp.write('</body></html>')
+    raise ndb.Return(resp)
+
+
+@_REG.api_endpoint(secured=True, tojson=False, params={'verbose': Bool})
 def export_taskpackages(_request, fmt='csv', verbose=False):
     """ Return a list of URLs to those taskpackages.
     :returns: @todo
@@ -640,37 +1331,65 @@ def export_taskpackages(_request, fmt='csv', verbose=False):
     url_template = lambda tpid: _request.build_absolute_uri(
         '/pagerouter?action=taskpackage&tpid=%s' % (tpid,))
 
-    def major_ranking(tasks):
-        """ Find the major rank_method in the tasks """
-        return Counter([r.get().rank_method
-                        for t in tasks
-                        for r in t.get().rankings]).most_common(1)[0]
+    def major_rankings(taskpackages):
+        """ Find the major rank_method in each of the task packages """
+        tkeys = list(set(t for tp in taskpackages for t in tp.tasks))
+        tasks = dict(zip(tkeys, REFERENCE_CACHE.get_multi(tkeys)))
+        rkeys = list(set(r for t in tasks.values() for r in t.rankings))
+        methods = dict(zip(rkeys, [r.rank_method for r in
+                                   REFERENCE_CACHE.get_multi(rkeys)]))
+        return [Counter([methods[r]
+                         for t in tp.tasks
+                         for r in tasks[t].rankings]).most_common(1)[0]
+                for tp in taskpackages]
 
     def iter_taskpackage():
-        """ Iterating though task packages """
-        for taskpackage in TaskPackage.query().fetch():
-            if len(taskpackage.progress) == 0:
-                continue
+        """ Iterating though task packages page by page """
+        for page in iter_pages(TaskPackage.query()):
+            page = [tp for tp in page if len(tp.progress) > 0]
             if verbose:
-                yield {'tpkey': taskpackage.key.urlsafe(),
-                       'url': url_template(taskpackage.key.urlsafe()),
-                       'confirm_code': taskpackage.confirm_code,
-                       'rank_method': major_ranking(taskpackage.tasks),
-                       'package_size': str(len(taskpackage.tasks))}
+                for taskpackage, rank_method in zip(page,
+                                                    major_rankings(page)):
+                    yield {'tpkey': taskpackage.key.urlsafe(),
+                           'url': url_template(taskpackage.key.urlsafe()),
+                           'confirm_code': taskpackage.confirm_code,
+                           'rank_method': rank_method,
+                           'package_size': str(len(taskpackage.tasks))}
             else:
-                yield {'tpkey': taskpackage.key.urlsafe(),
-                       'url': url_template(taskpackage.key.urlsafe()),
-                       'confirm_code': taskpackage.confirm_code}
+                for taskpackage in page:
+                    yield {'tpkey': taskpackage.key.urlsafe(),
+                           'url': url_template(taskpackage.key.urlsafe()),
+                           'confirm_code': taskpackage.confirm_code}
 
     if fmt == 'json':
-        response = HttpResponse(content_type='application/json')
+        response = StreamingHttpResponse(iter_json(iter_taskpackage()),
+                                         content_type='application/json')
         response['Content-Disposition'] = 'attachment; filename="exported_taskpackages.json"'
-        json.dump(list(iter_taskpackage()), response)
     else:
         response = export_as_csv(iter_taskpackage())
     return response
 
 
+@_REG.api_endpoint(secured=True,
+                   params={'windows': Int(min_value=1,
+                                          max_value=metrics.WINDOWS)})
+def api_metrics(windows=None):
+    """ Return the latency and cost percentiles of api endpoints.
+
+    :windows: The number of the latest windows of metrics.WINDOW seconds
+        to report, metrics.WINDOWS if None.
+
+    """
+    endpoints = metrics.report(windows or metrics.WINDOWS)
+    return {
+        'action': 'api_metrics',
+        'succeeded': True,
+        'num': len(endpoints),
+        'window': metrics.WINDOW,
+        'endpoints': endpoints
+    }
+
+
 @_REG.api_endpoint(secured=True)
 def assert_error():
     """ Bring a debug page for console. """
@@ -679,62 +1398,73 @@ def assert_error():
 @_REG.api_endpoint()
 def missing_tasks():
     """ Bring a debug page for console. """
-    tasks = Counter([k.urlsafe() for k in AnnotationTask.query().fetch(keys_only=True)])
-    done = Counter([j.task.urlsafe() for j in Judgement.query(projection=('task',)).fetch()])
-    expect = tasks + done
-    level = expect.most_common()[-1][1]
-    missing = list([k for k, c in expect.most_common() if c == level])
-    return {
+    least = yield TaskCoverage.query().order(TaskCoverage.judgements)\
+        .get_async()
+    level = least.judgements if least else 0
+    qry = TaskCoverage.query(TaskCoverage.judgements == level)
+    keys, num = yield qry.fetch_async(1000, keys_only=True), \
+        qry.count_async()
+    raise ndb.Return({
         'pass': level,
-        'missing': missing,
-        'missing_num': len(missing)
-    }
+        'missing': [ndb.Key(AnnotationTask, k.id()).urlsafe() for k in keys],
+        'missing_num': num
+    })
 
 # Fix compression wrapping for the restored data
 
 
-def add_fixing_task(model):
-    """ Add a fixing task to GAE queue so that the server will call the tasks
-        at the defined schedule rate.
+def map_fixing(model):
+    """ Return a mapper fixing the compressed fields of a page.
+
+    Only the entities actually changed are returned for the put_multi.
 
     """
     fields = listCompressedProperty(model)
-    i = 0
-    for i, k in enumerate(model.query().fetch(keys_only=True)):
-        tq.Task(params={'key': k.urlsafe(),
-                        'fields': ','.join(fields),
-                        '_admin_key': APIRegistry.ADMIN_KEY},
-                url='/api/data/fix_entity',
-                method='GET').add('batch')
-    return i
+
+    def mapper(ents, _params, _page):
+        """ Fix a page of entities. """
+        return fixCompressedEntities(ents, fields)
+    return mapper
+
+
+# Models whose compressed fields may need fixing after a restore
+FIXABLE_MODELS = [TwitterAccount, GeoEntity, ExpertiseRank]
+
+for _model in FIXABLE_MODELS:
+    jobs.register('fix_' + _model.__name__,
+                  lambda p, m=_model: m.query(),
+                  map_fixing(_model))
 
 
 @_REG.api_endpoint(secured=True)
 def fix_datastore():
     """ As resutore
+
+    A job per model fixes a page of entities per task on the batch
+    queue, see job_status for the progress.
+
     :returns: @todo
 
     """
-    cnt = add_fixing_task(TwitterAccount)
-    cnt += add_fixing_task(GeoEntity)
-    cnt += add_fixing_task(ExpertiseRank)
+    cks = jobs.start_multi(['fix_' + m.__name__ for m in FIXABLE_MODELS])
     return {
         'action': 'fix_datastore',
         'suceeded': 'Unknown',
-        'num': cnt,
-        'message': 'The Fixing tasks added to the batch queue.'
+        'num': len(cks),
+        'jobs': [ck.as_viewdict() for ck in cks],
+        'message': 'The Fixing jobs added to the batch queue.'
     }
 
 
-@_REG.api_endpoint(secured=True)
+@_REG.api_endpoint(secured=True, params={'key': KeyOf(), 'fields': CSV()})
 def fix_entity(key, fields):
     """@todo: Docstring for fix_entity.
 
-    :key: @todo
-    :fields: @todo
+    :key: The key of the entity.
+    :fields: A list of field names.
 
     """
-    fixCompressedEntity(_k(key), fields.split(','))
+    fixCompressedEntity(key, fields)
     return {
         'action': 'fix_entity',
         'suceeded': True,
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Instrumentation of api endpoints.
+
+File: metrics.py
+Author: SpaceLis
+Email: Wen.Li@tudelft.nl
+GitHub: http://github.com/spacelis
+Description:
+    Every call to an endpoint is measured for wall time, datastore RPCs
+    and bytes, memcache hits and misses and the size of the response. The
+    RPCs are counted by a post-call hook on the apiproxy.
+
+    Measurements go into histograms with logarithmic buckets. Each
+    instance buffers them and merges them into memcache every
+    FLUSH_INTERVAL seconds, with one entry per time window, so that the
+    last WINDOWS windows form a rolling histogram.
+
+"""
+
+import math
+import time
+import logging
+import threading
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+
+METRICS = ('wall_ms', 'datastore_rpcs', 'datastore_bytes',
+           'memcache_hits', 'memcache_misses', 'response_bytes')
+
+PREFIX = 'api-metrics:'
+WINDOW = 300
+WINDOWS = 12
+FLUSH_INTERVAL = 10
+
+# Buckets grow by 2 ** (1 / BUCKET_STEPS), i.e. about 19% in width
+BUCKET_STEPS = 4
+
+
+def bucket_of(value):
+    """ Return the histogram bucket of a non-negative value. """
+    return int(BUCKET_STEPS * math.log(value + 1, 2))
+
+
+def bucket_bound(bucket):
+    """ Return the upper bound of values in the bucket. """
+    return 2 ** ((bucket + 1.0) / BUCKET_STEPS) - 1
+
+
+class Histogram(object):
+
+    """ Counts of values per bucket. """
+
+    def __init__(self, counts=None):
+        self.counts = counts or dict()
+
+    def add(self, value, n=1):
+        """ Count the value n times. """
+        b = bucket_of(value)
+        self.counts[b] = self.counts.get(b, 0) + n
+
+    def merge(self, other):
+        """ Add the counts of another Histogram. """
+        for b, n in other.counts.iteritems():
+            self.counts[b] = self.counts.get(b, 0) + n
+        return self
+
+    def total(self):
+        """ Return the number of values counted. """
+        return sum(self.counts.itervalues())
+
+    def percentile(self, p):
+        """ Return the upper bound of the bucket holding the p-th percentile.
+
+        :p: A percentile between 0 and 100.
+
+        """
+        total = self.total()
+        if not total:
+            return None
+        rank = p / 100.0 * total
+        seen = 0
+        for b in sorted(self.counts):
+            seen += self.counts[b]
+            if seen >= rank:
+                return bucket_bound(b)
+        return bucket_bound(max(self.counts))
+
+
+class CallStats(object):
+
+    """ The costs of the endpoint call in the current thread. """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self.values = dict((m, 0) for m in METRICS)
+
+    def on_rpc(self, service, call, request, response):
+        """ Account an RPC made during the call. """
+        if service == 'datastore_v3':
+            self.values['datastore_rpcs'] += 1
+            self.values['datastore_bytes'] += \
+                request.ByteSize() + response.ByteSize()
+        elif service == 'memcache' and call == 'Get':
+            hits = response.item_size()
+            self.values['memcache_hits'] += hits
+            self.values['memcache_misses'] += request.key_size() - hits
+
+
+class Recorder(object):
+
+    """ Collect CallStats per endpoint and flush them into memcache. """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.buffer = dict()
+        self.last_flush = time.time()
+        self.proxy = None
+
+    def _hook(self, service, call, request, response):
+        """ The post-call hook of apiproxy. """
+        stats = getattr(self.local, 'stats', None)
+        if stats is not None:
+            stats.on_rpc(service, call, request, response)
+
+    def start(self, name):
+        """ Start measuring a call to the endpoint in this thread. """
+        proxy = apiproxy_stub_map.apiproxy
+        if proxy is not self.proxy:
+            # the apiproxy is replaced in tests
+            proxy.GetPostCallHooks().Append('api_metrics', self._hook)
+            self.proxy = proxy
+        self.local.stats = CallStats(name)
+
+    def stop(self, response_bytes=None, error=False):
+        """ Finish measuring the call in this thread and record it.
+
+        :response_bytes: The size of the response, None if unknown.
+        :error: Whether the call raised an exception.
+
+        """
+        stats = getattr(self.local, 'stats', None)
+        if stats is None:
+            return
+        self.local.stats = None
+        stats.values['wall_ms'] = (time.time() - stats.started) * 1000
+        if response_bytes is None:
+            del stats.values['response_bytes']
+        else:
+            stats.values['response_bytes'] = response_bytes
+        with self.lock:
+            entry = self.buffer.setdefault(
+                stats.name, {'calls': 0, 'errors': 0, 'histograms': {}})
+            entry['calls'] += 1
+            entry['errors'] += int(error)
+            for m, v in stats.values.iteritems():
+                entry['histograms'].setdefault(m, Histogram()).add(v)
+        if time.time() - self.last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """ Merge the buffered histograms into the current window. """
+        with self.lock:
+            buf, self.buffer = self.buffer, dict()
+            self.last_flush = time.time()
+        if not buf:
+            return
+        key = PREFIX + str(int(time.time() // WINDOW))
+        client = memcache.Client()
+        for _ in range(5):
+            stored = client.gets(key)
+            merged = merge_entries(stored or {}, buf)
+            if stored is None:
+                if client.add(key, merged, time=WINDOW * (WINDOWS + 1)):
+                    return
+            elif client.cas(key, merged, time=WINDOW * (WINDOWS + 1)):
+                return
+        logging.warn('Metrics of %d endpoints dropped on contention',
+                     len(buf))
+
+
+def merge_entries(into, other):
+    """ Merge the entries per endpoint of other into a copy of into. """
+    merged = dict((name, {'calls': e['calls'],
+                          'errors': e['errors'],
+                          'histograms': dict((m, Histogram(dict(h.counts)))
+                                             for m, h in
+                                             e['histograms'].iteritems())})
+                  for name, e in into.iteritems())
+    for name, e in other.iteritems():
+        entry = merged.setdefault(
+            name, {'calls': 0, 'errors': 0, 'histograms': {}})
+        entry['calls'] += e['calls']
+        entry['errors'] += e['errors']
+        for m, h in e['histograms'].iteritems():
+            entry['histograms'].setdefault(m, Histogram()).merge(h)
+    return merged
+
+
+def report(windows=WINDOWS, percentiles=(50, 90, 99)):
+    """ Return the percentiles of each endpoint over the last windows.
+
+    :windows: The number of windows of WINDOW seconds to include.
+    :percentiles: The percentiles to report for each metric.
+    :returns: A list of dicts per endpoint, the most time consuming first.
+
+    """
+    RECORDER.flush()
+    now = int(time.time() // WINDOW)
+    keys = [str(w) for w in range(now - windows + 1, now + 1)]
+    merged = dict()
+    for entries in memcache.get_multi(keys, key_prefix=PREFIX).itervalues():
+        merged = merge_entries(merged, entries)
+    endpoints = list()
+    for name, e in merged.iteritems():
+        stats = {'endpoint': name, 'calls': e['calls'], 'errors': e['errors']}
+        for m, h in e['histograms'].iteritems():
+            stats[m] = dict(('p%d' % p, h.percentile(p))
+                            for p in percentiles)
+        wall = e['histograms'].get('wall_ms')
+        # approximated by the bucket bounds
+        stats['total_ms'] = sum(bucket_bound(b) * n for b, n in
+                                wall.counts.iteritems()) if wall else 0
+        endpoints.append(stats)
+    return sorted(endpoints, key=lambda s: -s['total_ms'])
+
+
+RECORDER = Recorder()
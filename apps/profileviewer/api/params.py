@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Typed parameters of api endpoints.
+
+File: params.py
+Author: SpaceLis
+Email: Wen.Li@tudelft.nl
+GitHub: http://github.com/spacelis
+Description:
+    A parameter type is a function turning the string from the request
+    into the value passed to the endpoint and raising ValueError for
+    malformed input, e.g.,
+        @reg.api_endpoint(params={'windows': Int(min_value=1),
+                                  'tkey': CSV(KeyOf('TwitterAccount'))})
+
+    APIRegistry compiles the types of an endpoint into a binder when the
+    endpoint is registered, see compile_binder().
+
+"""
+
+from datetime import datetime as dt
+
+from google.appengine.datastore.datastore_query import Cursor
+
+from apps.profileviewer.models import _k
+
+
+class BadArgument(ValueError):
+
+    """ Raised when an argument of a call is malformed. """
+
+    def __init__(self, name, value, reason):
+        super(BadArgument, self).__init__(
+            'Bad argument %s=%r: %s' % (name, value, reason))
+        self.name = name
+        self.value = value
+        self.reason = reason
+
+
+def Int(min_value=None, max_value=None):  # pylint: disable=C0103
+    """ An integer within [min_value, max_value]. """
+    def parse(s):
+        """ Parse an integer. """
+        v = int(s)
+        if min_value is not None and v < min_value:
+            raise ValueError('less than %d' % (min_value, ))
+        if max_value is not None and v > max_value:
+            raise ValueError('greater than %d' % (max_value, ))
+        return v
+    return parse
+
+
+_TRUE = frozenset(['1', 'true', 'yes', 'on'])
+_FALSE = frozenset(['', '0', 'false', 'no', 'off'])
+
+
+def Bool(s):  # pylint: disable=C0103
+    """ A boolean, e.g., 1/0, true/false, yes/no or on/off. """
+    v = s.lower()
+    if v in _TRUE:
+        return True
+    if v in _FALSE:
+        return False
+    raise ValueError('not a boolean')
+
+
+def KeyOf(kind=None):  # pylint: disable=C0103
+    """ A urlsafe key, of the kind if given. """
+    def parse(s):
+        """ Parse a urlsafe key. """
+        try:
+            return _k(s, kind)
+        except Exception:  # pylint: disable=W0703
+            # decoding errors of keys are not ValueErrors
+            raise ValueError('not a key of ' + (kind or 'any kind'))
+    return parse
+
+
+def DateTime(fmt='%Y-%m-%dT%H:%M:%S'):  # pylint: disable=C0103
+    """ A datetime in the format. """
+    return lambda s: dt.strptime(s, fmt)
+
+
+def PageCursor(s):  # pylint: disable=C0103
+    """ A urlsafe query cursor. """
+    try:
+        return Cursor(urlsafe=s)
+    except Exception:  # pylint: disable=W0703
+        raise ValueError('not a cursor')
+
+
+def CSV(item=None, length=None):  # pylint: disable=C0103
+    """ A comma separated list of the item type, strings if None.
+
+    :length: The number of items required, any if None.
+
+    """
+    def parse(s):
+        """ Parse the items. """
+        items = s.split(',') if s else []
+        if length is not None and len(items) != length:
+            raise ValueError('expecting %d items' % (length, ))
+        return [item(x) for x in items] if item else items
+    return parse
+
+
+def _lookup(request, name):
+    """ Return the value of the argument in POST or GET or None. """
+    v = request.POST.get(name)
+    return request.GET.get(name) if v is None else v
+
+
+def request_args(request):
+    """ Return a dict of the arguments in GET and POST of a request.
+
+    POST takes precedence like the deprecated request.REQUEST.
+
+    """
+    args = dict(request.GET.items())
+    args.update(request.POST.items())
+    return args
+
+
+def compile_binder(spec, params, reserved):
+    """ Return a function(request) returning the arguments of an endpoint.
+
+    Everything depending on the endpoint alone is worked out here, once.
+    Missing arguments are None, unless the endpoint has a default for
+    them. Typed arguments are parsed before the reserved ones are made,
+    so malformed input is rejected before any datastore access.
+
+    :spec: The argspec of the endpoint.
+    :params: A dict of parameter types by argument name.
+    :reserved: A dict of functions(request) for reserved arguments.
+    :raises: TypeError if params names arguments the endpoint lacks.
+
+    """
+    unknown = set(params) - set(spec.args)
+    if unknown:
+        raise TypeError('No such arguments: ' + ', '.join(sorted(unknown)))
+    optional = set(spec.args[len(spec.args) - len(spec.defaults or ()):])
+    plain = tuple((k, params.get(k), k in optional)
+                  for k in spec.args if k not in reserved)
+    made = tuple((k, reserved[k]) for k in spec.args if k in reserved)
+
+    def bind(request):
+        """ Bind the arguments of the request.
+
+        :raises: BadArgument for malformed arguments.
+
+        """
+        kwargs = dict()
+        for name, parse, has_default in plain:
+            value = _lookup(request, name)
+            if value is None:
+                if not has_default:
+                    kwargs[name] = None
+                continue
+            if parse is not None:
+                try:
+                    value = parse(value)
+                except (ValueError, TypeError) as e:
+                    raise BadArgument(name, value, str(e))
+            kwargs[name] = value
+        for name, make in made:
+            kwargs[name] = make(request)
+        return kwargs
+    return bind
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Caching the responses of read-only api endpoints.
+
+File: respcache.py
+Author: SpaceLis
+Email: Wen.Li@tudelft.nl
+GitHub: http://github.com/spacelis
+Description:
+    The serialised json of an endpoint is kept in an instance-local LRU
+    and in memcache under a key made of the endpoint, the arguments it
+    varies on and the versions of its tags. Invalidating a tag bumps its
+    version, so every response depending on it misses from then on.
+
+    A response older than its ttl but within the stale period is still
+    served while a task on the batch queue recomputes it.
+
+    A tag may name an argument, e.g., 'candidate:%(candidate)s', so that
+    the responses about one entity are invalidated on their own.
+
+"""
+
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from google.appengine.ext import ndb
+from google.appengine.api import memcache
+import google.appengine.api.taskqueue as tq
+
+from apps.profileviewer.api.params import request_args
+
+
+class CachePolicy(object):  # pylint: disable=R0903
+
+    """ How the response of an endpoint is cached.
+
+    :ttl: Seconds a response is fresh.
+    :vary_on: The names of the arguments making a different response,
+        all arguments of the endpoint if None.
+    :tags: The names of data the response depends on, filled with the
+        arguments of the call if they name any, see tagsOf().
+    :stale: Seconds after ttl a response is still served while being
+        recomputed.
+
+    """
+
+    def __init__(self, ttl, vary_on=None, tags=(), stale=0):
+        self.ttl = ttl
+        self.vary_on = vary_on
+        self.tags = tuple(tags)
+        self.stale = stale
+
+    def tagsOf(self, kwargs):
+        """ Return the tags of a call, keys in the arguments by urlsafe.
+
+        :kwargs: The arguments of the call.
+
+        """
+        args = dict((k, v.urlsafe() if isinstance(v, ndb.Key) else v)
+                    for k, v in kwargs.iteritems())
+        return [t % args if '%(' in t else t for t in self.tags]
+
+
+class ResponseCache(object):
+
+    """ Serialised responses in an instance-local LRU and memcache. """
+
+    PREFIX = 'api-resp:'
+    TAG_PREFIX = 'api-tag:'
+
+    def __init__(self, size=500):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, name, policy, kwargs):
+        """ Return the cache key of a call.
+
+        :name: The name of the endpoint.
+        :policy: The CachePolicy of the endpoint.
+        :kwargs: The arguments of the call, typed ones by their repr.
+
+        """
+        args = policy.vary_on if policy.vary_on is not None \
+            else sorted(k for k in kwargs if not k.startswith('_'))
+        tags = policy.tagsOf(kwargs)
+        versions = memcache.get_multi(  # pylint: disable=E1101
+            tags, key_prefix=self.TAG_PREFIX) if tags else {}
+        return hashlib.md5(json.dumps([
+            name,
+            [(a, kwargs.get(a)) for a in args],
+            [versions.get(t, 0) for t in tags]
+        ], default=repr)).hexdigest()
+
+    def get(self, key, policy):
+        """ Return (created_at, body) of a response not older than
+        ttl + stale or None.
+
+        """
+        with self._lock:
+            hit = self._entries.pop(key, None)
+            if hit is not None:
+                self._entries[key] = hit
+        if hit is None:
+            hit = memcache.get(self.PREFIX + key)  # pylint: disable=E1101
+            if hit is not None:
+                self._remember(key, hit)
+        if hit is not None and \
+                time.time() - hit[0] < policy.ttl + policy.stale:
+            return hit
+        return None
+
+    def set(self, key, body, policy):
+        """ Store the serialised response. """
+        hit = (time.time(), body)
+        memcache.set(self.PREFIX + key, hit,  # pylint: disable=E1101
+                     time=policy.ttl + policy.stale)
+        self._remember(key, hit)
+
+    def _remember(self, key, hit):
+        """ Keep the response in the local LRU. """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = hit
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def revalidate(request, key, created_at):
+        """ Queue a call to recompute a stale response.
+
+        The task is named after the response, so it is queued once.
+
+        """
+        params = request_args(request)
+        params['_refresh'] = '1'
+        try:
+            tq.Task(params=params,
+                    name='refresh-%s-%d' % (key, created_at),
+                    url=request.path,
+                    method='GET').add('batch')
+        except (tq.TaskAlreadyExistsError, tq.TombstonedTaskError):
+            pass
+
+    def invalidate(self, *tags):
+        """ Make the responses depending on the tags miss. """
+        if tags:
+            memcache.offset_multi(  # pylint: disable=E1101
+                dict((t, 1) for t in tags),
+                key_prefix=self.TAG_PREFIX, initial_value=0)
+
+    def clear(self):
+        """ Drop the local LRU. """
+        with self._lock:
+            self._entries.clear()
+
+
+RESPONSE_CACHE = ResponseCache()
@@ -17,14 +17,18 @@ from google.appengine.ext import ndb
 from google.appengine.api.taskqueue import Task
 
 from apps.profileviewer.api import APIRegistry
+from apps.profileviewer.api.params import Int
+from apps.profileviewer.api.params import CSV
+from apps.profileviewer.api.params import KeyOf
+from apps.profileviewer.api.data import refresh_candidates
 from apps.profileviewer.twitter_util import new_twitter_client
-from apps.profileviewer.twitter_util import new_foursquare_client
-from apps.profileviewer.twitter_util import CATEGORY_MAP
+from apps.profileviewer.twitter_util import resolve_categories
+from apps.profileviewer.twitter_util import TWITTER_CACHE
 from apps.profileviewer.models import GeoEntity
 from apps.profileviewer.models import TwitterAccount
-from apps.profileviewer.twitter_util import update_poi_category
+from apps.profileviewer.checkin_stream import stream_checkins as run_stream
 
-api = APIRegistry()
+api = APIRegistry('taskworker')
 
 
 @csrf_exempt
@@ -58,24 +62,56 @@ def test_cache_checkins():
     Task(params=d, url='/api/taskworker/cache_checkins').add('crawler')
 
 
-@api.api_endpoint(secured=True)
+@api.api_endpoint(secured=True,
+                  params={'tkey': CSV(KeyOf('TwitterAccount'))})
 def process_pois(tkey):
-    """ crawling poi information for all checkins from a user
+    """ crawling poi information for all checkins from users
+
+    Places are deduplicated over all checkins, only the ones without
+    a known category are looked up on Foursquare.
 
-    :tkey: A TwitterAccount.
+    :tkey: Keys of TwitterAccounts.
     :returns: @todo
 
     """
-    ta = ndb.Key(urlsafe=tkey, kind='TwitterAccount').get()
-    for s in ta.checkins:
-        poi_id = s['place']['id']
-        if GeoEntity.contains(tfid=poi_id):
-            return  # TODO should copy those from Geoentities to checkins
-        update_poi_category(s['place'])
-    ta.put()
+    accounts = [ta for ta in ndb.get_multi(tkey) if ta]
+    places = dict((s['place']['id'], s['place'])
+                  for ta in accounts for s in ta.checkins or [])
+    categories = GeoEntity.getPoiCategories(places.keys())
+    unseen = [p for pid, p in places.iteritems() if pid not in categories]
+
+    # match unseen places against the local spatial index first
+    matches = [GeoEntity.nearby_async(p['lat'], p['lng'], 100, p['name'])
+               for p in unseen]
+    resolved = dict()
+    for p, m in zip(unseen, matches):
+        for _, ent in m.get_result():
+            if ent.info and ent.info.get('category'):
+                resolved[p['id']] = ent.info['category']
+                break
+    matched = len(resolved)
+    unseen = [p for p in unseen if p['id'] not in resolved]
+    resolved.update(resolve_categories(unseen))
+    GeoEntity.putPoiCategories(places.values(), resolved)
+    categories.update(resolved)
+
+    for ta in accounts:
+        for s in ta.checkins or []:
+            s['place']['category'] = categories.get(s['place']['id']) \
+                or s['place'].get('category')
+    ndb.put_multi(accounts)
+    refresh_candidates(accounts)
+    return {
+        'action': 'process_pois',
+        'succeeded': True,
+        'places': len(places),
+        'matched': matched,
+        'fetched': len(unseen),
+        'resolved': len(resolved) - matched
+    }
 
 
-@api.api_endpoint(secured=True)
+@api.api_endpoint(secured=True, params={'twitter_id': Int()})
 def cache_checkins(token, secret, twitter_id=None, twitter_account=None):
     """ Crawling the user by screen_name.
 
@@ -99,9 +135,30 @@ def cache_checkins(token, secret, twitter_id=None, twitter_account=None):
 
     except IndexError:
         tu = cli.get_user(user_id=twitter_id)
-        t = TwitterAccount.createForCheckins(tu.screen_name,
-                                             tu.id)
-        t.fetchCheckins(cli)
+        ta = TwitterAccount.createForCheckins(tu.screen_name,
+                                              tu.id)
+        ta.fetchCheckins(cli)
+    refresh_candidates([ta])
+
+
+@api.api_endpoint(secured=True,
+                  params={'regions': CSV(), 'duration': Int(min_value=1)})
+def stream_checkins(token, secret, regions, duration=None):
+    """ Collect checkins in the regions from the streaming API.
+
+    Meant for a backend instance as the request lasts for duration.
+
+    :token: An access_token.
+    :secret: An access_token_secret
+    :regions: Names of regions in checkin_stream.REGIONS.
+    :duration: Seconds to keep the stream open.
+    :returns: The statistics of the ingestion.
+
+    """
+    stats = run_stream(token, secret, regions, duration,
+                       on_flush=refresh_candidates)
+    stats.update({'action': 'stream_checkins', 'succeeded': True})
+    return stats
 
 
 @api.api_endpoint(secured=True)
@@ -117,3 +174,27 @@ def cache_user(token, secret):
     cache_checkins(token, secret, cli.me().id)
     #for f in cli.friends_ids():
         #cache_checkins(token, secret, twitter_id=f)
+
+
+@api.api_endpoint(secured=True)
+def twitter_cache_stats():
+    """ Return the hit rates of the Twitter response cache.
+
+    :returns: The report of TWITTER_CACHE on this instance.
+
+    """
+    return TWITTER_CACHE.report()
+
+
+@api.api_endpoint(secured=True)
+def cleanup_twitter_cache():
+    """ Remove expired Twitter responses from the cache.
+
+    :returns: The number of entries removed.
+
+    """
+    return {
+        'action': 'cleanup_twitter_cache',
+        'succeeded': True,
+        'num': TWITTER_CACHE.cleanup()
+    }
@@ -26,7 +26,7 @@ from apps.profileviewer.models import TwitterAccount
 from apps.profileviewer.twitter_util import APICRED
 
 
-_REG = APIRegistry()
+_REG = APIRegistry('user')
 
 
 EMAILPTN = re.compile(r"^[-!#$%&'*+/0-9=?A-Z^_a-z{|}~]"
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Collecting checkins from the Twitter streaming API.
+
+File: checkin_stream.py
+Author: SpaceLis
+Email: Wen.Li@tudelft.nl
+GitHub: http://github.com/spacelis
+Description:
+    A geo-filtered stream of tweets is consumed by CheckinListener which
+    buffers checkins per user and appends them to TwitterAccounts in
+    batches.
+
+"""
+
+import json
+import time
+import logging
+from threading import Timer
+
+import tweepy as tw
+from google.appengine.ext import ndb
+
+from apps.profileviewer.models import TwitterAccount
+from apps.profileviewer.twitter_util import new_twitter_auth
+from apps.profileviewer.twitter_util import strip_checkin
+
+
+# Bounding boxes as [sw_lng, sw_lat, ne_lng, ne_lat]
+REGIONS = {
+    'chicago': [-87.94, 41.64, -87.52, 42.02],
+    'new-york': [-74.26, 40.48, -73.70, 40.92],
+    'los-angeles': [-118.67, 33.70, -118.16, 34.34],
+    'san-francisco': [-122.52, 37.70, -122.35, 37.83],
+}
+
+# The region of points outside REGIONS
+OTHER_REGION = 'other'
+
+# Datastore limits the number of values in an IN filter
+IN_FILTER_SIZE = 30
+
+
+def region_of(lat, lng):
+    """ Return the name of the region in REGIONS holding the point. """
+    for name, (w, s, e, n) in REGIONS.iteritems():
+        if s <= lat <= n and w <= lng <= e:
+            return name
+    return OTHER_REGION
+
+
+class CheckinListener(tw.StreamListener):
+
+    """ Buffer checkins from a stream and store them in batches.
+
+    :batch_size: Flush when this many checkins are buffered.
+    :flush_interval: Flush when the last flush is older (in seconds).
+    :create_accounts: Whether to create TwitterAccounts for unknown users,
+        otherwise their checkins are dropped.
+    :deadline: Stop the stream after this time (time.time()).
+    :on_flush: Called with the TwitterAccounts put by a flush.
+
+    """
+
+    def __init__(self, batch_size=500, flush_interval=60,
+                 create_accounts=False, deadline=None, on_flush=None):
+        super(CheckinListener, self).__init__()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.create_accounts = create_accounts
+        self.deadline = deadline
+        self.on_flush = on_flush
+        self.pending = dict()
+        self.buffered = 0
+        self.last_flush = time.time()
+        self.stats = {'tweets': 0, 'checkins': 0, 'stored': 0, 'flushes': 0}
+
+    def on_data(self, raw_data):
+        """ Buffer the tweet if it is a checkin. """
+        if isinstance(raw_data, memoryview):
+            raw_data = raw_data.tobytes()
+        tweet = json.loads(raw_data)
+        if tweet.get('place') and 'user' in tweet:
+            self.stats['tweets'] += 1
+            try:
+                ck = strip_checkin(tweet)
+            except (KeyError, IndexError, TypeError):
+                logging.warn('Malformed checkin: %s', tweet.get('id'))
+            else:
+                self.pending.setdefault(ck['user']['id'], []).append(ck)
+                self.buffered += 1
+                self.stats['checkins'] += 1
+        return self.check()
+
+    def on_timeout(self):
+        """ Flush in quiet periods. """
+        return self.check()
+
+    def check(self):
+        """ Flush if a threshold is reached.
+
+        :returns: False if the deadline has passed.
+
+        """
+        now = time.time()
+        if self.buffered >= self.batch_size or \
+                now - self.last_flush >= self.flush_interval:
+            self.flush()
+        if self.deadline and now >= self.deadline:
+            return False
+
+    def flush(self):
+        """ Append the buffered checkins to their TwitterAccounts.
+
+        :returns: The number of checkins stored.
+
+        """
+        pending, self.pending = self.pending, dict()
+        self.buffered = 0
+        self.last_flush = time.time()
+        if not pending:
+            return 0
+
+        uids = pending.keys()
+        qrys = [TwitterAccount.query(
+            TwitterAccount.twitter_id.IN(uids[i:i + IN_FILTER_SIZE])
+        ).fetch_async() for i in range(0, len(uids), IN_FILTER_SIZE)]
+        accounts = [ta for q in qrys for ta in q.get_result()]
+
+        stored = 0
+        for ta in accounts:
+            cks = pending.pop(ta.twitter_id, [])
+            known = set(c['id'] for c in ta.checkins or [])
+            new = [c for c in cks if c['id'] not in known]
+            ta.checkins = (ta.checkins or []) + new
+            stored += len(new)
+        if self.create_accounts:
+            for uid, cks in pending.iteritems():
+                accounts.append(TwitterAccount(
+                    screen_name=cks[0]['user']['screen_name'],
+                    twitter_id=uid,
+                    checkins=cks))
+                stored += len(cks)
+        ndb.put_multi(accounts)
+        if self.on_flush:
+            self.on_flush(accounts)
+
+        self.stats['stored'] += stored
+        self.stats['flushes'] += 1
+        return stored
+
+
+def stream_checkins(token, secret, regions, duration=None, **kwargs):
+    """ Collect checkins in the regions from the streaming API.
+
+    :token: An access_token.
+    :secret: An access_token_secret.
+    :regions: A list of names in REGIONS.
+    :duration: Stop after the given seconds, otherwise run until the
+        stream is disconnected.
+    :**kwargs: Passed to CheckinListener.
+    :returns: The statistics of the listener.
+
+    """
+    locations = [c for r in regions for c in REGIONS[r]]
+    deadline = time.time() + duration if duration else None
+    listener = CheckinListener(deadline=deadline, **kwargs)
+    stream = tw.Stream(new_twitter_auth(token, secret), listener)
+    timer = None
+    if duration:
+        # a quiet stream may not reach the listener before the deadline
+        timer = Timer(duration, stream.disconnect)
+        timer.start()
+    try:
+        stream.filter(locations=locations)
+    finally:
+        if timer:
+            timer.cancel()
+        listener.flush()
+    return listener.stats
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Geohash encoding for spatial indexing.
+
+File: geohash.py
+Author: SpaceLis
+Email: Wen.Li@tudelft.nl
+GitHub: http://github.com/spacelis
+Description:
+    Encode coordinates into geohashes and find the cells covering a
+    circle, so that nearby lookups become prefix equality queries.
+
+"""
+
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS = 6371000.0
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180.0
+
+# Resolutions stored for every indexed point
+MIN_PRECISION = 3
+MAX_PRECISION = 8
+
+
+def encode(lat, lng, precision=MAX_PRECISION):
+    """ Return the geohash of the coordinates.
+
+    :lat: Latitude in degrees.
+    :lng: Longitude in degrees.
+    :precision: The length of the geohash.
+    :returns: A geohash string.
+
+    """
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    chars = []
+    bits, ch, even = 0, 0, True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                ch = ch << 1 | 1
+                lng_lo = mid
+            else:
+                ch <<= 1
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                ch = ch << 1 | 1
+                lat_lo = mid
+            else:
+                ch <<= 1
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[ch])
+            bits, ch = 0, 0
+    return ''.join(chars)
+
+
+def prefixes(lat, lng):
+    """ Return the geohashes of all indexed resolutions.
+
+    :returns: A list of geohashes from MIN_PRECISION to MAX_PRECISION.
+
+    """
+    gh = encode(lat, lng, MAX_PRECISION)
+    return [gh[:p] for p in range(MIN_PRECISION, MAX_PRECISION + 1)]
+
+
+def cell_size(precision):
+    """ Return the size of a cell in degrees.
+
+    :returns: (lat_degrees, lng_degrees)
+
+    """
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def precision_for(lat, radius):
+    """ Return the finest indexed precision whose cells are not smaller
+    than radius at the given latitude, so 3x3 cells cover the circle.
+
+    :lat: Latitude in degrees.
+    :radius: Radius in meters.
+
+    """
+    coslat = max(math.cos(math.radians(lat)), 1e-6)
+    for p in range(MAX_PRECISION, MIN_PRECISION - 1, -1):
+        dlat, dlng = cell_size(p)
+        if min(dlat, dlng * coslat) * METERS_PER_DEGREE >= radius:
+            return p
+    return MIN_PRECISION
+
+
+def covering(lat, lng, radius):
+    """ Return the geohashes of cells covering the circle.
+
+    :lat: Latitude of the center in degrees.
+    :lng: Longitude of the center in degrees.
+    :radius: Radius in meters.
+    :returns: A sorted list of distinct geohashes (at most 9).
+
+    """
+    p = precision_for(lat, radius)
+    dlat, dlng = cell_size(p)
+    cells = set()
+    for i in (-1, 0, 1):
+        for j in (-1, 0, 1):
+            clat = min(max(lat + i * dlat, -90.0), 90.0)
+            clng = (lng + j * dlng + 180.0) % 360.0 - 180.0
+            cells.add(encode(clat, clng, p))
+    return sorted(cells)
+
+
+def distance(lat1, lng1, lat2, lng2):
+    """ Return the great circle distance in meters (haversine). """
+    rlat1, rlat2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((rlat2 - rlat1) / 2) ** 2 + \
+        math.cos(rlat1) * math.cos(rlat2) * \
+        math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" An inverted index of candidates in the datastore.
+
+File: invindex.py
+Author: SpaceLis
+Email: Wen.Li@tudelft.nl
+GitHub: http://github.com/spacelis
+Description:
+    Terms like "topic:<topic_id>" or "region:<region>" map to the sorted
+    ids of the TwitterAccounts they describe. A posting list is stored in
+    shards, each an IndexEntry with its ids sorted, delta encoded and
+    compressed. make_shards splits a whole list into shards of at most
+    SHARD_SIZE ids, make_part writes a shard per part as a job reduces
+    them. The first shard of a term knows how many shards there are, so
+    the posting lists of any number of terms are read with two get_multi
+    calls and the shards of a term are merged.
+
+    Posting lists are combined in-process. Intersections gallop through
+    the longer lists, so their cost grows with the shortest list.
+
+    The index does not depend on the Search API, which search.py uses
+    for full-text search.
+
+"""
+
+import zlib
+import heapq
+import struct
+from bisect import bisect_left
+
+from google.appengine.ext import ndb
+
+
+# The most ids in one shard, about 400KB before compression
+SHARD_SIZE = 50000
+
+
+class IndexEntry(ndb.Model):  # pylint: disable=R0903
+
+    """ A shard of the posting list of a term.
+
+    The id is the term followed by the number of the shard, e.g.,
+    "topic:123#0".
+
+    """
+
+    postings = ndb.model.BlobProperty(indexed=False)
+    num = ndb.model.IntegerProperty(indexed=False)
+    # the number of shards of the term, kept on the first shard
+    shards = ndb.model.IntegerProperty(indexed=False)
+
+    @staticmethod
+    def keyOf(term, shard=0):
+        """ Return the key of a shard of the term. """
+        return ndb.Key(IndexEntry, '%s#%d' % (term, shard))
+
+    def ids(self):
+        """ Return the ids in the shard. """
+        return decode_postings(self.postings)
+
+
+def term(field, value):
+    """ Return the term of a value of a field, e.g., topic:123. """
+    return u'%s:%s' % (field, value)
+
+
+def encode_postings(ids):
+    """ Return sorted ids as compressed gaps of 8 bytes.
+
+    Gaps between nearby ids have zero high bytes, which compress well,
+    and unpack in C instead of varints decoded byte by byte.
+
+    """
+    gaps = [b - a for a, b in zip([0] + ids[:-1], ids)]
+    return zlib.compress(struct.pack('<%dQ' % len(gaps), *gaps))
+
+
+def decode_postings(blob):
+    """ Return the sorted ids encoded by encode_postings. """
+    raw = zlib.decompress(blob)
+    ids = list(struct.unpack('<%dQ' % (len(raw) // 8), raw))
+    for i in xrange(1, len(ids)):
+        ids[i] += ids[i - 1]
+    return ids
+
+
+def make_part(t, ids, part, last):
+    """ Return the IndexEntries to put for a part of the posting list of
+    a term, the parts being reduced one after another.
+
+    :t: The term.
+    :ids: The integer ids in the part, in any order.
+    :part: The number of the part from 0, also the number of its shard.
+    :last: Whether it is the last part, when the first shard is told how
+        many shards there are.
+    :returns: A list of IndexEntries to put.
+
+    """
+    entries = list()
+    if ids or part == 0:
+        ids = sorted(set(ids))
+        entries.append(IndexEntry(key=IndexEntry.keyOf(t, part),
+                                  postings=encode_postings(ids),
+                                  num=len(ids)))
+    if last:
+        # the first shard has been put with the first part
+        head = entries[0] if part == 0 else IndexEntry.keyOf(t).get()
+        head.shards = part + len(entries)
+        if part:
+            entries.append(head)
+    return entries
+
+
+def make_shards(t, ids):
+    """ Return the IndexEntries of the posting list of a term.
+
+    :t: The term.
+    :ids: The integer ids of TwitterAccounts, in any order.
+    :returns: A list of IndexEntries to put.
+
+    """
+    ids = sorted(set(ids))
+    chunks = [ids[i:i + SHARD_SIZE]
+              for i in xrange(0, len(ids), SHARD_SIZE)] or [[]]
+    entries = [IndexEntry(key=IndexEntry.keyOf(t, n),
+                          postings=encode_postings(c),
+                          num=len(c))
+               for n, c in enumerate(chunks)]
+    entries[0].shards = len(chunks)
+    return entries
+
+
+@ndb.tasklet
+def lookup_async(terms):
+    """ Return the posting lists of the terms.
+
+    :terms: A list of terms.
+    :returns: A dict of the sorted ids by term, empty for unknown terms.
+
+    """
+    terms = list(set(terms))
+    heads = yield ndb.get_multi_async([IndexEntry.keyOf(t) for t in terms])
+    rest = [IndexEntry.keyOf(t, n)
+            for t, h in zip(terms, heads) if h
+            for n in range(1, h.shards or 1)]
+    tails = yield ndb.get_multi_async(rest)
+    shards = dict((k, e) for k, e in zip(rest, tails) if e)
+    postings = dict()
+    for t, h in zip(terms, heads):
+        lists = [h.ids()] if h else [[]]
+        lists.extend(shards[IndexEntry.keyOf(t, n)].ids()
+                     for n in range(1, (h.shards or 1) if h else 1)
+                     if IndexEntry.keyOf(t, n) in shards)
+        # shards of parts may hold overlapping ranges of ids
+        postings[t] = lists[0] if len(lists) == 1 else union(lists)
+    raise ndb.Return(postings)
+
+
+def gallop(seq, x, lo=0):
+    """ Return the first index from lo of sorted seq not less than x.
+
+    The distance is probed in growing steps before the bisection, so
+    short hops cost O(log hop) instead of O(log len(seq)).
+
+    """
+    n = len(seq)
+    hi, step = lo, 1
+    while hi < n and seq[hi] < x:
+        lo = hi + 1
+        hi += step
+        step *= 2
+    return bisect_left(seq, x, lo, min(hi, n))
+
+
+def intersect(lists):
+    """ Return the sorted ids in all of the sorted lists. """
+    if not lists:
+        return []
+    lists = sorted(lists, key=len)
+    result = lists[0]
+    for other in lists[1:]:
+        common = []
+        i = 0
+        for x in result:
+            i = gallop(other, x, i)
+            if i == len(other):
+                break
+            if other[i] == x:
+                common.append(x)
+                i += 1
+        result = common
+        if not result:
+            break
+    return list(result)
+
+
+def union(lists):
+    """ Return the sorted ids in any of the sorted lists. """
+    result = []
+    for x in heapq.merge(*lists):
+        if not result or result[-1] != x:
+            result.append(x)
+    return result
+
+
+@ndb.tasklet
+def query_async(clauses):
+    """ Return the ids matching all clauses, each matching any of its
+    terms, e.g., [['topic:1', 'topic:2'], ['region:chicago']].
+
+    :clauses: A list of lists of terms.
+    :returns: The sorted ids.
+
+    """
+    postings = yield lookup_async([t for c in clauses for t in c])
+    raise ndb.Return(intersect([union([postings[t] for t in c])
+                                for c in clauses]))
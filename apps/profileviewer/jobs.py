@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Resumable batch jobs over the datastore.
+
+File: jobs.py
+Author: SpaceLis
+Email: Wen.Li@tudelft.nl
+GitHub: http://github.com/spacelis
+Description:
+    A job maps over the pages of a query, one page per task on the batch
+    queue. Map-only jobs write the mapper's output directly. Jobs with a
+    reducer write (group, key) pairs as GroupMember entities whose ids
+    sort by group, so the reduce phase reads every group contiguously
+    with a key-ordered query. The datastore takes the place of spill files
+    in an external sort, memory stays bounded by a page and the largest
+    group. Partial reducers take the slices of a group page by page, so
+    not even a group has to fit.
+
+    A JobCheckpoint records the cursor after each page. Outputs should
+    have ids derived from their inputs, so that redoing an interrupted
+    page overwrites instead of duplicating them.
+
+"""
+
+import time
+import hashlib
+from collections import namedtuple
+from datetime import datetime as dt
+
+from google.appengine.ext import ndb
+import google.appengine.api.taskqueue as tq
+from google.appengine.datastore.datastore_query import Cursor
+
+from apps.profileviewer.api import APIRegistry
+from apps.profileviewer.util import enqueue
+
+
+MAP = 'map'
+REDUCE = 'reduce'
+CLEANUP = 'cleanup'
+DONE = 'done'
+
+Job = namedtuple('Job', ['name', 'query', 'mapper', 'reducer', 'page_size',
+                         'after', 'keys_only', 'done', 'reduce_size',
+                         'partial'])
+
+JOBS = dict()
+
+
+def register(name, query, mapper, reducer=None, page_size=200, after=None,
+             keys_only=False, done=None, reduce_size=None, partial=False):
+    """ Register a job.
+
+    :name: The name of the job, also the id of its checkpoint.
+    :query: A function(params) returning the ndb query to map over.
+    :mapper: A function(entities, params, page) returning a list of
+        entities to put for map-only jobs, or a list of (group, key)
+        pairs if reducer is given.
+    :reducer: A function(group, keys, params) returning a list of
+        entities to put for all keys of a group.
+    :page_size: The number of entities processed by one task.
+    :after: The name of a job started with the same params when this one
+        is done.
+    :keys_only: Whether the mapper gets keys instead of entities.
+    :done: A function(params) called when the job is done, e.g., to drop
+        caches once rather than per page.
+    :reduce_size: The number of GroupMembers reduced by one task,
+        page_size if None.
+    :partial: Whether the reducer is a function(group, keys, params, part,
+        last) called with each slice of a group read in a page instead.
+        Parts are numbered from 0 within a group and last tells whether
+        it is the final one, whose keys may be empty.
+
+    """
+    JOBS[name] = Job(name, query, mapper, reducer, page_size, after,
+                     keys_only, done, reduce_size or page_size, partial)
+
+
+class JobCheckpoint(ndb.Model):  # pylint: disable=R0903
+
+    """ The progress of a job. """
+
+    params = ndb.model.JsonProperty(indexed=False)
+    phase = ndb.model.StringProperty(indexed=False)
+    cursor = ndb.model.StringProperty(indexed=False)
+    page = ndb.model.IntegerProperty(indexed=False)
+    run = ndb.model.IntegerProperty(indexed=False)
+    carry = ndb.model.JsonProperty(indexed=False, compressed=True)
+    mapped = ndb.model.IntegerProperty(indexed=False)
+    # whether the reduce phase is over, the cleanup after it ends the job
+    reduced = ndb.model.BooleanProperty(indexed=False, default=False)
+    written = ndb.model.IntegerProperty(indexed=False)
+    started_at = ndb.model.DateTimeProperty(indexed=False)
+    updated_at = ndb.model.DateTimeProperty(indexed=False, auto_now=True)
+
+    def as_viewdict(self):
+        """ Return the dict representation of the checkpoint. """
+        return {
+            'job': self.key.id(),
+            'params': self.params,
+            'phase': self.phase,
+            'page': self.page,
+            'mapped': self.mapped,
+            'written': self.written,
+            'started_at': self.started_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+            if self.updated_at else None
+        }
+
+
+class GroupMember(ndb.Model):  # pylint: disable=R0903
+
+    """ A key emitted by a mapper for a group, a child of the checkpoint.
+
+    The id is the md5 of the group followed by the urlsafe key, so that
+    ordering by key puts members of the same group next to each other.
+
+    """
+
+    group = ndb.model.StringProperty(indexed=False)
+    member = ndb.model.KeyProperty(indexed=False)
+
+    @staticmethod
+    def make(parent, group, member):
+        """ Return a GroupMember for member in group. """
+        gid = hashlib.md5(group.encode('utf-8')).hexdigest()
+        return GroupMember(parent=parent,
+                           id=gid + member.urlsafe(),
+                           group=group,
+                           member=member)
+
+
+def _task(ck):
+    """ Return the task for the next page of the job. """
+    return tq.Task(params={'name': ck.key.id(),
+                           '_admin_key': APIRegistry.ADMIN_KEY},
+                   name='job-%s-%s-%s' % (ck.key.id(), ck.run, ck.page),
+                   url='/api/data/run_job',
+                   method='GET')
+
+
+def _schedule(ck):
+    """ Queue the task for the next page of the job. """
+    try:
+        _task(ck).add('batch')
+    except (tq.TaskAlreadyExistsError, tq.TombstonedTaskError):
+        # the page has been queued already
+        pass
+
+
+def _begin(name, params):
+    """ Put a fresh checkpoint and remove what an earlier run left. """
+    if name not in JOBS:
+        raise KeyError(name)
+    ck = JobCheckpoint(id=name,
+                       params=params or {},
+                       phase=CLEANUP,
+                       page=0,
+                       run=int(time.time()),
+                       carry=None,
+                       mapped=0,
+                       reduced=False,
+                       written=0,
+                       started_at=dt.utcnow())
+    ck.put()
+    # members left by an earlier run are removed before mapping
+    _cleanup_page(ck, MAP)
+    ck.put()
+    return ck
+
+
+def start(name, params=None):
+    """ Start a job from the beginning.
+
+    :name: The name of a registered job.
+    :params: A dict of parameters passed to the job functions.
+    :returns: The checkpoint of the job.
+
+    """
+    ck = _begin(name, params)
+    _schedule(ck)
+    return ck
+
+
+def start_multi(names, params=None):
+    """ Start jobs running in parallel, queuing their first pages in
+    batches.
+
+    :names: A list of names of registered jobs.
+    :params: A dict of parameters passed to all the jobs.
+    :returns: A list of the checkpoints.
+
+    """
+    cks = [_begin(name, params) for name in names]
+    enqueue([_task(ck) for ck in cks], 'batch')
+    return cks
+
+
+def status(name):
+    """ Return the checkpoint of a job or None. """
+    return JobCheckpoint.get_by_id(name)
+
+
+def _cleanup_page(ck, next_phase):
+    """ Delete one page of GroupMembers of the job. """
+    keys, _, more = GroupMember.query(ancestor=ck.key).fetch_page(
+        500, keys_only=True)
+    ndb.delete_multi(keys)
+    if not more:
+        ck.phase = next_phase
+        ck.cursor = None
+    ck.page += 1
+
+
+def _fetch(qry, ck, size, **kwargs):
+    """ Fetch the page after the cursor of the checkpoint. """
+    cur = Cursor(urlsafe=ck.cursor) if ck.cursor else None
+    ents, next_cur, more = qry.fetch_page(size, start_cursor=cur, **kwargs)
+    ck.cursor = next_cur.urlsafe() if more and next_cur else None
+    return ents, more
+
+
+def _map_page(job, ck):
+    """ Map one page of the input query. """
+    ents, more = _fetch(job.query(ck.params), ck, job.page_size,
+                        keys_only=job.keys_only)
+    out = job.mapper(ents, ck.params, ck.page)
+    if job.reducer:
+        ndb.put_multi([GroupMember.make(ck.key, g, k) for g, k in out])
+    else:
+        ndb.put_multi(out)
+        ck.written += len(out)
+    ck.mapped += len(ents)
+    if not more:
+        ck.phase = REDUCE if job.reducer else DONE
+        ck.cursor = None
+
+
+def _reduce_slices(job, ck, groups, more):
+    """ Return the output of a partial reducer over the slices of groups
+    in a page.
+
+    Only the group and the number of its next part are carried over to
+    the next page, as [group, part].
+
+    """
+    group, part = ck.carry or (None, 0)
+    out = []
+    if group is not None and (not groups or groups[0][0] != group):
+        # the carried group ended with the previous page
+        out.extend(job.reducer(group, [], ck.params, part, True))
+    ck.carry = None
+    for i, (g, keys) in enumerate(groups):
+        p = part if i == 0 and g == group else 0
+        last = not more or i < len(groups) - 1
+        out.extend(job.reducer(g, keys, ck.params, p, last))
+        if not last:
+            ck.carry = [g, p + 1]
+    return out
+
+
+def _reduce_page(job, ck):
+    """ Reduce the groups completed in one page of GroupMembers.
+
+    The last group of a page may continue on the next page, its keys are
+    carried over in the checkpoint unless the reducer is partial.
+
+    """
+    members, more = _fetch(
+        GroupMember.query(ancestor=ck.key).order(GroupMember.key),
+        ck, job.reduce_size)
+    groups = []
+    if ck.carry and not job.partial:
+        groups.append((ck.carry[0], [ndb.Key(urlsafe=k)
+                                     for k in ck.carry[1]]))
+    for m in members:
+        if groups and groups[-1][0] == m.group:
+            groups[-1][1].append(m.member)
+        else:
+            groups.append((m.group, [m.member]))
+    if job.partial:
+        out = _reduce_slices(job, ck, groups, more)
+    else:
+        ck.carry = None
+        if more and groups:
+            group, keys = groups.pop()
+            ck.carry = [group, [k.urlsafe() for k in keys]]
+        out = [e for g, gkeys in groups
+               for e in job.reducer(g, gkeys, ck.params)]
+    ndb.put_multi(out)
+    ck.written += len(out)
+    if not more:
+        ck.phase = CLEANUP
+        ck.reduced = True
+        ck.cursor = None
+
+
+def run_page(name):
+    """ Process the next page of a job and queue the one after.
+
+    Calling it again after an interruption resumes from the checkpoint.
+
+    :name: The name of the job.
+    :returns: The checkpoint after the page.
+
+    """
+    ck = JobCheckpoint.get_by_id(name)
+    if ck is None or ck.phase == DONE:
+        return ck
+    job = JOBS[name]
+    if ck.phase == CLEANUP:
+        # a job over an empty query has mapped nothing after reducing too
+        _cleanup_page(ck, DONE if ck.reduced else MAP)
+    else:
+        if ck.phase == MAP:
+            _map_page(job, ck)
+        else:
+            _reduce_page(job, ck)
+        ck.page += 1
+    if ck.phase == DONE and job.done:
+        # before the checkpoint is put, so a failing hook redoes the page
+        job.done(ck.params)
+    ck.put()
+    if ck.phase != DONE:
+        _schedule(ck)
+    elif job.after:
+        start(job.after, ck.params)
+    return ck
@@ -19,10 +19,14 @@ import time
 from datetime import datetime as dt
 import base64
 import json
+from collections import OrderedDict
 
 from django.http import Http404
 from google.appengine.ext import ndb
 from google.appengine.api import memcache
+from apps.profileviewer import geohash
+from apps.profileviewer import profiles
+from apps.profileviewer.serializer import js_literal
 from apps.profileviewer.twitter_util import iter_timeline
 from apps.profileviewer.twitter_util import new_twitter_client
 from apps.profileviewer.twitter_util import strip_checkin
@@ -102,8 +106,8 @@ class Encodable(object):
     :bm_updatable: Defines the properties accepting updates for load().
 
     Methods:
-        js_encode() will return a snippet of javascript with base64 encoded
-        data.
+        js_encode() will return a snippet of javascript with the data as an
+        object literal.
         js_decode() will will populate a model object with a dict while keep
         non-updatable properties untouched.
 
@@ -112,12 +116,12 @@ class Encodable(object):
 
     """
 
-    JS_CLASS = """ JSON.parse(atob("%s")) """
+    JS_CLASS = """ %s """
 
     def js_encode(self):
         """ encode for javascript. """
         d = self.as_viewdict()
-        return self.JS_CLASS % (base64.b64encode(json.dumps(d)), )
+        return self.JS_CLASS % (js_literal(d), )
 
     @staticmethod
     def js_decode(b64str):
@@ -248,6 +252,40 @@ class TwitterAccount(ndb.Model):  # pylint: disable=R0903,R0921
         except IndexError:
             raise KeyError
 
+    SCREEN_NAME_PREFIX = 'screen-name:'
+    # seconds before a renamed account shows its new name
+    SCREEN_NAME_TTL = 3600
+
+    @staticmethod
+    @ndb.tasklet
+    def screenNamesAsync(keys):
+        """ Return the screen_names of the accounts.
+
+        Names are looked up in memcache first, so the accounts and their
+        checkins are only loaded for names not seen within
+        SCREEN_NAME_TTL. The lookups
+        of a tasklet are batched by the ndb context.
+
+        :keys: A list of ndb.Key of TwitterAccounts.
+        :returns: A dict of screen_names (None for missing accounts) by key.
+
+        """
+        ctx = ndb.get_context()
+        keys = list(set(keys))
+        cached = yield [ctx.memcache_get(TwitterAccount.SCREEN_NAME_PREFIX +
+                                         k.urlsafe()) for k in keys]
+        names = dict((k, n) for k, n in zip(keys, cached) if n is not None)
+        missing = [k for k in keys if k not in names]
+        accounts = yield ndb.get_multi_async(missing)
+        yield [ctx.memcache_set(TwitterAccount.SCREEN_NAME_PREFIX +
+                                k.urlsafe(), ta.screen_name,
+                                time=TwitterAccount.SCREEN_NAME_TTL)
+               for k, ta in zip(missing, accounts)
+               if ta is not None and ta.screen_name]
+        names.update((k, ta.screen_name if ta else None)
+                     for k, ta in zip(missing, accounts))
+        raise ndb.Return(names)
+
     def fetchCheckins(self, api_client):
         """ Return the checkin as a block of base64 encoded.
 
@@ -275,6 +313,73 @@ class TwitterAccount(ndb.Model):  # pylint: disable=R0903,R0921
             return None
 
 
+class CheckinProfile(ndb.Model):  # pylint: disable=R0903
+
+    """ The histograms of the checkins of a TwitterAccount, see profiles.py.
+
+    The id is the id of the account.
+
+    """
+
+    profile = ndb.model.JsonProperty(indexed=False, compressed=True)
+    digest = ndb.model.StringProperty(indexed=False)
+    built_at = ndb.model.DateTimeProperty(indexed=False, auto_now=True)
+
+    @staticmethod
+    def keyOf(tkey):
+        """ Return the key of the profile of the account. """
+        return ndb.Key(CheckinProfile, tkey.id())
+
+    @staticmethod
+    def digestOf(checkins):
+        """ Return the digest of the checkins a profile is built from. """
+        return hashlib.md5(json.dumps(checkins or [],
+                                      sort_keys=True)).hexdigest()
+
+    @staticmethod
+    def make(account):
+        """ Return a new profile of the account to put. """
+        return CheckinProfile(
+            key=CheckinProfile.keyOf(account.key),
+            profile=profiles.build_profile(account.checkins or []),
+            digest=CheckinProfile.digestOf(account.checkins))
+
+    @staticmethod
+    def refresh(accounts):
+        """ Put the profiles of the accounts whose checkins changed since
+        their profiles were built.
+
+        :accounts: TwitterAccounts already put.
+        :returns: The keys of the accounts whose profiles were put.
+
+        """
+        cps = ndb.get_multi([CheckinProfile.keyOf(ta.key) for ta in accounts])
+        stale = [ta for ta, cp in zip(accounts, cps)
+                 if cp is None or
+                 cp.profile.get('version') != profiles.VERSION or
+                 cp.digest != CheckinProfile.digestOf(ta.checkins)]
+        ndb.put_multi([CheckinProfile.make(ta) for ta in stale])
+        return [ta.key for ta in stale]
+
+    @staticmethod
+    def getOrBuild(tkey):
+        """ Return the profile of the account, built if missing or of an
+        older version.
+
+        :tkey: The key of a TwitterAccount.
+        :returns: The profile dict or None if the account does not exist.
+
+        """
+        cp = CheckinProfile.keyOf(tkey).get()
+        if cp is None or cp.profile.get('version') != profiles.VERSION:
+            account = tkey.get()
+            if account is None:
+                return None
+            cp = CheckinProfile.make(account)
+            cp.put()
+        return cp.profile
+
+
 class EmailAccount(EncodableModel):
 
     """ The email account registered with this site. """
@@ -348,6 +453,62 @@ class GeoEntity(EncodableModel):  # pylint: disable=R0903,W0223
     visitors = ndb.model.KeyProperty(indexed=False, repeated=True,
                                      kind='TwitterAccount')
     geopt = ndb.model.GeoPtProperty(indexed=True)
+    # geohashes of geopt from geohash.MIN_PRECISION to MAX_PRECISION
+    geohashes = ndb.model.StringProperty(indexed=True, repeated=True)
+
+    def _pre_put_hook(self):
+        """ Keep the spatial index in line with geopt. """
+        if self.geopt is not None:
+            self.geohashes = geohash.prefixes(self.geopt.lat, self.geopt.lon)
+        else:
+            self.geohashes = []
+
+    @staticmethod
+    def geoptOf(info):
+        """ Return the GeoPt of info['location'] or None.
+
+        :info: The info of an entity as imported from Foursquare.
+
+        """
+        location = (info or {}).get('location') or {}
+        if location.get('lat') is None or location.get('lng') is None:
+            return None
+        return ndb.GeoPt(location['lat'], location['lng'])
+
+    @staticmethod
+    @ndb.tasklet
+    def nearby_async(lat, lng, radius, name=None):
+        """ Return a Future of the entities within radius of a point.
+
+        :lat: Latitude of the center.
+        :lng: Longitude of the center.
+        :radius: Radius in meters, up to tens of kilometers.
+        :name: Only entities with the name (case-insensitive) if given.
+        :returns: A list of (distance, GeoEntity) sorted by distance.
+
+        """
+        cells = geohash.covering(lat, lng, radius)
+        ents = yield GeoEntity.query(GeoEntity.geohashes.IN(cells)) \
+            .fetch_async()
+        name = name.lower() if name else None
+        found = []
+        for ent in ents:
+            if name and (ent.name or '').lower() != name:
+                continue
+            d = geohash.distance(lat, lng, ent.geopt.lat, ent.geopt.lon)
+            if d <= radius:
+                found.append((d, ent))
+        found.sort(key=lambda x: x[0])
+        raise ndb.Return(found)
+
+    @staticmethod
+    def nearby(lat, lng, radius, name=None):
+        """ Return the entities within radius of a point.
+
+        See nearby_async().
+
+        """
+        return GeoEntity.nearby_async(lat, lng, radius, name).get_result()
 
     @staticmethod
     def getByTFId(tfid):
@@ -362,6 +523,59 @@ class GeoEntity(EncodableModel):  # pylint: disable=R0903,W0223
         except IndexError:
             raise KeyError()
 
+    @staticmethod
+    def getPoiCategories(place_ids):
+        """ Return the known categories of the places.
+
+        POIs resolved before are kept as PoiCategory. Imported entities
+        are matched by tfid if they carry a category in info.
+
+        :place_ids: A list of distinct place ids.
+        :returns: A dict of place id to category.
+
+        """
+        cats = dict()
+        for pid, pc in zip(place_ids, ndb.get_multi(
+                [ndb.Key(PoiCategory, pid) for pid in place_ids])):
+            if pc is not None and pc.category:
+                cats[pid] = pc.category
+        missing = [pid for pid in place_ids if pid not in cats]
+        qrys = [GeoEntity.query(GeoEntity.tfid.IN(missing[i:i + 30]))
+                .fetch_async() for i in range(0, len(missing), 30)]
+        for ent in (e for q in qrys for e in q.get_result()):
+            if ent.info and ent.info.get('category'):
+                cats[ent.tfid] = ent.info['category']
+        return cats
+
+    @staticmethod
+    def putPoiCategories(places, categories):
+        """ Store the categories of places keyed by place id.
+
+        Places without a category are not stored, so they are looked up
+        again later.
+
+        :places: A list of places as in checkins.
+        :categories: A dict of place id to category.
+
+        """
+        ndb.put_multi([PoiCategory(id=p['id'],
+                                   name=p['name'],
+                                   category=categories[p['id']])
+                       for p in places if categories.get(p['id'])])
+
+
+class PoiCategory(ndb.Model):  # pylint: disable=R0903
+
+    """ The category of a place in checkins, see process_pois.
+
+    The id is the place id. The places are not GeoEntities, so they stay
+    out of the spatial index.
+
+    """
+
+    name = ndb.model.StringProperty(indexed=False)
+    category = ndb.model.JsonProperty(indexed=False)
+
 
 class Judgement(ndb.Model):  # pylint: disable=R0903
 
@@ -403,6 +617,7 @@ class Judgement(ndb.Model):  # pylint: disable=R0903
                 traceback=tb).put_async()
             for t, s in scores.items()
         ]
+        fs.append(TaskCoverage.incrementAsync(task.key))
         ndb.Future.wait_all(fs)
 
     def as_viewdict(self):
@@ -467,6 +682,61 @@ class AnnotationTask(ndb.Model):  # pylint: disable=R0903
 
     rankings = ndb.model.KeyProperty(repeated=True, kind=ExpertiseRank)
     candidate = ndb.model.KeyProperty(indexed=True, kind=TwitterAccount)
+    # Denormalised from rankings, one value per ranking in the same order
+    topic_ids = ndb.model.StringProperty(indexed=True, repeated=True)
+    rank_methods = ndb.model.StringProperty(indexed=True, repeated=True)
+    profile_types = ndb.model.StringProperty(indexed=True, repeated=True)
+
+    @staticmethod
+    def fromRankings(rankings, candidate, tid=None):
+        """ Make a task of the rankings with the summary filled.
+
+        :rankings: A list of ExpertiseRank.
+        :candidate: The key to the TwitterAccount.
+        :tid: The id of the task, allocated by the datastore if None.
+        :returns: An AnnotationTask (not put yet).
+
+        """
+        task = AnnotationTask(id=tid,
+                              rankings=[r.key for r in rankings],
+                              candidate=candidate)
+        task.fillSummary(rankings)
+        return task
+
+    def fillSummary(self, rankings):
+        """ Copy topic_id, rank_method and profile_type from rankings.
+
+        :rankings: The ExpertiseRanks of self.rankings in the same order.
+
+        """
+        self.topic_ids = [r.topic_id for r in rankings]
+        self.rank_methods = [r.rank_method for r in rankings]
+        self.profile_types = [r.rank_info['profile_type'] for r in rankings]
+
+    @staticmethod
+    def summaryOf(rankings):
+        """ Return (topic_id, rank_method, profile_type) per ranking. """
+        return [(r.topic_id, r.rank_method, r.rank_info['profile_type'])
+                for r in rankings]
+
+    def hasSummary(self):
+        """ Return whether the summary is filled for all rankings. """
+        return len(self.topic_ids) == len(self.rankings) and \
+            len(self.rank_methods) == len(self.rankings) and \
+            len(self.profile_types) == len(self.rankings)
+
+    def summary(self):
+        """ Return (topic_id, rank_method, profile_type) per ranking.
+
+        Rankings are only fetched for tasks made before the summary was
+        introduced and not yet backfilled. The task is left untouched, as
+        it may be shared by all requests through REFERENCE_CACHE.
+
+        """
+        if not self.hasSummary():
+            return AnnotationTask.summaryOf(
+                REFERENCE_CACHE.get_multi(self.rankings))
+        return zip(self.topic_ids, self.rank_methods, self.profile_types)
 
     def as_viewdict(self):
         """ Return a dict object of the task.
@@ -474,10 +744,58 @@ class AnnotationTask(ndb.Model):  # pylint: disable=R0903
         :returns: @todo
 
         """
-        return {'rankings': [r.get() for r in self.rankings],
+        return {'rankings': REFERENCE_CACHE.get_multi(self.rankings),
                 'candidate': self.candidate.get()}
 
 
+class TaskCoverage(ndb.Model):  # pylint: disable=R0903
+
+    """ The number of submissions judging an AnnotationTask.
+
+    The id is the id of the task, so coverages are fetched by key.
+
+    """
+
+    judgements = ndb.model.IntegerProperty(indexed=True, default=0)
+
+    @staticmethod
+    def keyOf(tkey):
+        """ Return the key to the coverage of the task. """
+        return ndb.Key(TaskCoverage, tkey.id())
+
+    @staticmethod
+    def incrementAsync(tkey, n=1):
+        """ Add n to the judgements of the task in a transaction.
+
+        :tkey: The key to an AnnotationTask.
+        :returns: A future of the new count.
+
+        """
+        @ndb.transactional_tasklet
+        def txn():
+            """ Increment the count. """
+            ckey = TaskCoverage.keyOf(tkey)
+            cov = yield ckey.get_async()
+            cov = cov or TaskCoverage(key=ckey, judgements=0)
+            cov.judgements += n
+            yield cov.put_async()
+            raise ndb.Return(cov.judgements)
+        return txn()
+
+    @staticmethod
+    def countsOf(tkeys):
+        """ Return a dict of task key to the number of judgements. """
+        return dict((k, c.judgements if c else 0) for k, c in zip(
+            tkeys, ndb.get_multi([TaskCoverage.keyOf(k) for k in tkeys])))
+
+    @staticmethod
+    def missing(tkeys):
+        """ Return new coverages for the tasks without one (not put yet). """
+        ckeys = [TaskCoverage.keyOf(k) for k in tkeys]
+        return [TaskCoverage(key=ck, judgements=0)
+                for ck, c in zip(ckeys, ndb.get_multi(ckeys)) if c is None]
+
+
 class TaskPackage(ndb.Model):
 
     """ A package of tasks. """
@@ -487,6 +805,9 @@ class TaskPackage(ndb.Model):
     done_by = ndb.model.KeyProperty(indexed=True, repeated=True, kind='User')
     confirm_code = ndb.model.StringProperty(indexed=True)
     assigned_at = ndb.model.DateTimeProperty(indexed=True)
+    # The least number of judgements among the tasks, for assignment by
+    # priority. It is refreshed when the package is finished or assigned.
+    coverage = ndb.model.IntegerProperty(indexed=True)
 
     class TaskPackageNotExists(Http404):
         """ If the task_pack_id doesn't exists"""
@@ -538,8 +859,23 @@ class TaskPackage(ndb.Model):
         """
         assert task.key == self.progress[0], 'Not assigned: ' + task.key.urlsafe()
         del self.progress[0]
+        if not self.progress:
+            self.refreshCoverage()
         self.put()
 
+    def refreshCoverage(self, counts=None):
+        """ Set coverage to the least number of judgements of the tasks.
+
+        :counts: A dict from TaskCoverage.countsOf(self.tasks), fetched if
+            None.
+        :returns: The dict of counts.
+
+        """
+        counts = counts if counts is not None \
+            else TaskCoverage.countsOf(self.tasks)
+        self.coverage = min(counts.values()) if counts else None
+        return counts
+
     def getConfirmationCode(self):
         """ Get the confirmation code.
 
@@ -706,3 +1042,115 @@ class User(EncodableModel):
         self.task_package.get().finish(task)
         self.finished_tasks += 1
         self.touch()
+
+
+class CacheGeneration(ndb.Model):  # pylint: disable=R0903
+
+    """ A counter bumped whenever reference entities are replaced. """
+
+    generation = ndb.model.IntegerProperty(indexed=False, default=0)
+
+    KEY = ndb.Key('CacheGeneration', 'reference')
+
+    @staticmethod
+    def current():
+        """ Return the current generation. """
+        g = CacheGeneration.KEY.get()
+        return g.generation if g else 0
+
+    @staticmethod
+    @ndb.transactional
+    def bump():
+        """ Increase the generation so that all instances drop their
+        ReferenceCache.
+
+        :returns: The new generation.
+
+        """
+        g = CacheGeneration.KEY.get() or \
+            CacheGeneration(key=CacheGeneration.KEY)
+        g.generation += 1
+        g.put()
+        return g.generation
+
+
+class ReferenceCache(object):
+
+    """ An instance-local LRU cache for entities which do not change during
+    a campaign (GeoEntity, ExpertiseRank and AnnotationTask).
+
+    Entities are keyed by urlsafe key and shared by all requests of the
+    instance, so they must not be modified. The cache is dropped when the
+    CacheGeneration changes, which is checked at most every CHECK_INTERVAL
+    seconds.
+
+    """
+
+    KINDS = frozenset(['GeoEntity', 'ExpertiseRank', 'AnnotationTask'])
+    CHECK_INTERVAL = 10
+
+    def __init__(self, size=50000):
+        self.size = size
+        self._entries = OrderedDict()
+        self._generation = None
+        self._checked_at = 0
+
+    def _check_generation(self):
+        """ Drop all entries if the generation has changed. """
+        now = time.time()
+        if now - self._checked_at < ReferenceCache.CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        generation = CacheGeneration.current()
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+
+    def get_multi(self, keys):
+        """ Return the entities of keys, fetching the missing ones in one
+        get_multi.
+
+        :keys: A list of ndb.Key.
+        :returns: A list of entities (None for nonexistent ones).
+
+        """
+        self._check_generation()
+        found = dict()
+        missing = list()
+        for k in keys:
+            us = k.urlsafe()
+            ent = self._entries.pop(us, None)
+            if ent is None:
+                missing.append(k)
+            else:
+                self._entries[us] = ent  # move to the most recent end
+                found[us] = ent
+        if missing:
+            for k, ent in zip(missing, ndb.get_multi(missing)):
+                found[k.urlsafe()] = ent
+                if ent is not None and k.kind() in ReferenceCache.KINDS:
+                    self._entries[k.urlsafe()] = ent
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return [found[k.urlsafe()] for k in keys]
+
+    def get(self, key):
+        """ Return the entity of key. """
+        return self.get_multi([key])[0]
+
+    def warm(self, keys):
+        """ Load the entities of keys into the cache. """
+        self.get_multi(keys)
+
+    def clear(self):
+        """ Drop all entries of this instance. """
+        self._entries.clear()
+
+    def invalidate(self):
+        """ Drop the entries on all instances, e.g., after import/reset. """
+        self._generation = CacheGeneration.bump()
+        self._checked_at = time.time()
+        self._entries.clear()
+
+
+REFERENCE_CACHE = ReferenceCache()
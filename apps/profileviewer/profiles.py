@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Histograms of the checkins of candidates.
+
+File: profiles.py
+Author: SpaceLis
+Email: Wen.Li@tudelft.nl
+GitHub: http://github.com/spacelis
+Description:
+    The checkins of a TwitterAccount are aggregated into a profile that
+    the expert view renders instead of the raw checkins. Checkins are
+    packed into an array of (place, year, month, day, hour) once, every
+    histogram is then computed with numpy over the columns.
+
+    The visits, i.e., the checkins counted per place and week, keep the
+    charts of the expert view filtering each other. Hours and weekdays
+    are in UTC.
+
+"""
+
+import numpy as np
+
+
+# Bumped when the layout of profiles changes, older ones are rebuilt
+VERSION = 1
+
+MONTHS = dict((m, i + 1) for i, m in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+     'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']))
+
+
+def _fields(created_at):
+    """ Return (year, month, day, hour) of a timestamp, either as given by
+    Twitter, e.g., "Wed Aug 27 13:08:45 +0000 2008", or in ISO 8601.
+
+    """
+    if created_at[3] == ' ':
+        return (int(created_at[-4:]), MONTHS[created_at[4:7]],
+                int(created_at[8:10]), int(created_at[11:13]))
+    return (int(created_at[:4]), int(created_at[5:7]),
+            int(created_at[8:10]), int(created_at[11:13]))
+
+
+def days_since_epoch(year, month, day):
+    """ Return the days since 1970-01-01 of arrays of dates.
+
+    The proleptic Gregorian calendar with the year starting in March, so
+    that leap days come last.
+
+    """
+    march = month <= 2
+    year = year - march
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * np.where(march, month + 9, month - 3) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def pack(checkins):
+    """ Return the distinct places and the packed checkins.
+
+    :checkins: A list of checkins as made by twitter_util.strip_checkin.
+    :returns: A list of places and an array of rows (index of the place,
+        year, month, day, hour), one per checkin with a place and a time.
+
+    """
+    places = list()
+    index = dict()
+    rows = list()
+    for c in checkins:
+        p, ts = c.get('place'), c.get('created_at')
+        if not p or not ts:
+            continue
+        i = index.get(p['id'])
+        if i is None:
+            i = index[p['id']] = len(places)
+            places.append(p)
+        rows.append((i, ) + _fields(ts))
+    return places, np.array(rows, dtype=np.int64).reshape(-1, 5)
+
+
+def _histogram(labels, weights):
+    """ Return [label, sum of weights] of equal labels, the largest first
+    and ties in the order seen.
+
+    :labels: A list of hashable labels.
+    :weights: An array of the weight of each label.
+
+    """
+    codes = dict()
+    names = list()
+    for l in labels:
+        if l not in codes:
+            codes[l] = len(names)
+            names.append(l)
+    sums = np.bincount(np.array([codes[l] for l in labels], dtype=np.int64),
+                       weights=weights, minlength=len(names))
+    return [[names[i], int(sums[i])]
+            for i in np.argsort(-sums, kind='mergesort').tolist()]
+
+
+def _category(place, field):
+    """ Return a field of the category of a place or None. """
+    return (place.get('category') or {}).get(field)
+
+
+def build_profile(checkins):
+    """ Return the profile of checkins.
+
+    :checkins: A list of checkins as made by twitter_util.strip_checkin.
+    :returns: A dict of
+        pois: The places, the most visited first.
+        visits: [place, week, checkins], the week as the days since
+            1970-01-01 of the Sunday starting it.
+        hours, weekdays: The checkins per hour of day and per day of week,
+            Monday first.
+        categories, zero_categories: [name, checkins], the most
+            visited first.
+
+    """
+    places, rows = pack(checkins)
+    profile = {'version': VERSION, 'num': len(rows), 'pois': [],
+               'visits': [], 'hours': [0] * 24, 'weekdays': [0] * 7,
+               'categories': [], 'zero_categories': []}
+    if not len(rows):
+        return profile
+    poi, hours = rows[:, 0], rows[:, 4]
+    days = days_since_epoch(rows[:, 1], rows[:, 2], rows[:, 3])
+
+    per_poi = np.bincount(poi, minlength=len(places))
+    order = np.argsort(-per_poi, kind='mergesort')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+
+    # 1970-01-01 is a Thursday
+    weeks = days - (days + 4) % 7
+    first = weeks.min()
+    span = (weeks.max() - first) // 7 + 1
+    keys = np.sort(rank[poi] * span + (weeks - first) // 7)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    counts = np.diff(np.concatenate((starts, [len(keys)])))
+    keys = keys[starts]
+
+    ordered = [places[i] for i in order.tolist()]
+    weights = per_poi[order]
+    profile.update({
+        'pois': [{'id': p['id'],
+                  'name': p.get('name'),
+                  'lat': p.get('lat'),
+                  'lng': p.get('lng'),
+                  'category': p.get('category')} for p in ordered],
+        'visits': np.column_stack((keys // span, (keys % span) * 7 + first,
+                                   counts)).tolist(),
+        'hours': np.bincount(hours, minlength=24).tolist(),
+        'weekdays': np.bincount((days + 3) % 7, minlength=7).tolist(),
+        'categories': _histogram([_category(p, 'name') for p in ordered],
+                                 weights),
+        'zero_categories': _histogram(
+            [_category(p, 'zero_category_name') for p in ordered], weights)
+    })
+    return profile
@@ -7,46 +7,138 @@ Author: SpaceLis
 Email: Wen.Li@tudelft.nl
 GitHub: http://github.com/spacelis
 Description:
+    Full-text search over candidates with the Search API. Each
+    TwitterAccount is a document made of the names, categories and texts
+    of its checkins, with the most visited place as its location and the
+    categories and regions of its checkins as facets.
 
+    Documents are put BATCH_SIZE at a time, the most the Search API takes
+    in one call. The index is built by the index_candidates job on the
+    batch queue, and documents are removed by the clear_TwitterAccount
+    job, see api/data.py.
 
 """
 
+from collections import Counter
 
 from google.appengine.api import search
-from google.appengine.ext import ndb
+
+from apps.profileviewer.util import partition
+from apps.profileviewer.checkin_stream import region_of
 
 INDEX = search.Index('EXPSEARCH')
 
+# The most documents taken by one Index.put()
+BATCH_SIZE = 200
 
-class IndexEntry(ndb.Model):
+# Texts beyond this are left out of a document, well below the 1MB limit
+# of a TextField
+MAX_TEXT = 100000
 
-    """ The model for storing index. """
+FACETS = ('category', 'region')
 
 
+def make_document(account):
+    """ Return the search document of a TwitterAccount.
 
-    def __init__(self):
-        """@todo: to be defined1. """
-        ndb.Model.__init__(self)
+    :account: A TwitterAccount.
+    :returns: A search.Document with the urlsafe key as its doc_id.
 
+    """
+    checkins = account.checkins or []
+    places = [c['place'] for c in checkins if c.get('place')]
+    visits = Counter((p['lat'], p['lng']) for p in places
+                     if p.get('lat') is not None)
+    # categories are dicts as made by twitter_util.category_of
+    categories = set(p['category']['name'] for p in places
+                     if p.get('category'))
+    regions = set(region_of(lat, lng) for lat, lng in visits)
+    names = set(p.get('full_name') or p.get('name') or u'' for p in places)
+    fields = [
+        search.AtomField(name='screen_name', value=account.screen_name),
+        search.TextField(name='places', value=u'\n'.join(names)),
+        search.TextField(name='categories', value=u'\n'.join(categories)),
+        search.TextField(name='text', value=u'\n'.join(
+            c.get('text') or u'' for c in checkins)[:MAX_TEXT]),
+        search.NumberField(name='checkins', value=len(checkins))
+    ]
+    if visits:
+        lat, lng = visits.most_common(1)[0][0]
+        fields.append(search.GeoField(name='location',
+                                      value=search.GeoPoint(lat, lng)))
+    facets = [search.AtomFacet(name='category', value=c)
+              for c in categories] + \
+        [search.AtomFacet(name='region', value=r) for r in regions]
+    return search.Document(doc_id=account.key.urlsafe(),
+                           fields=fields,
+                           facets=facets)
+
+
+def build_index(accounts):
+    """ Put the documents of the accounts into INDEX in batches.
+
+    Documents are keyed by the accounts, so building again replaces them.
+
+    :accounts: An iterable of TwitterAccounts.
+    :returns: The number of documents put.
 
+    """
+    num = 0
+    for batch in partition((make_document(a) for a in accounts),
+                           BATCH_SIZE, BATCH_SIZE):
+        INDEX.put(batch)
+        num += len(batch)
+    return num
 
 
-def build_index(user, checkins):
-    """ Build index for user with checkins.
+def unindex(keys):
+    """ Delete the documents of TwitterAccounts from INDEX in batches.
 
-    :user: @todo
-    :checkins: @todo
-    :returns: @todo
+    :keys: An iterable of keys of TwitterAccounts.
+    :returns: The number of documents deleted.
 
     """
-    pass
+    num = 0
+    for batch in partition((k.urlsafe() for k in keys),
+                           BATCH_SIZE, BATCH_SIZE):
+        INDEX.delete(batch)
+        num += len(batch)
+    return num
 
 
-def search_index(query):
+def search_index(query, refinements=None, near=None, limit=20, cursor=None):
     """ Search index with the query.
 
-    :query: @todo
-    :returns: @todo
+    :query: A query string of the Search API, e.g., "coffee places:park".
+    :refinements: A dict of facet values to narrow down to, e.g.,
+        {'region': 'chicago'}.
+    :near: A tuple (lat, lng, meters) the location should be within.
+    :limit: The number of results in a page.
+    :cursor: The web safe cursor returned with the previous page.
+    :returns: A dict of the results, their number, the counts of facet
+        values and the cursor of the next page.
 
     """
-    pass
+    if near is not None:
+        geo = 'distance(location, geopoint(%f, %f)) < %f' % tuple(near)
+        query = '(%s) %s' % (query, geo) if query else geo
+    found = INDEX.search(search.Query(
+        query_string=query or '',
+        options=search.QueryOptions(
+            limit=limit,
+            cursor=search.Cursor(web_safe_string=cursor) if cursor
+            else search.Cursor(),
+            returned_fields=['screen_name', 'checkins']),
+        return_facets=FACETS,
+        facet_refinements=[search.FacetRefinement(name, value=v)
+                           for name, v in (refinements or {}).iteritems()
+                           if v]))
+    return {
+        'num': found.number_found,
+        'results': [dict([('candidate', d.doc_id)] +
+                         [(f.name, f.value) for f in d.fields])
+                    for d in found.results],
+        'facets': dict((f.name, [(v.label, v.count) for v in f.values])
+                       for f in found.facets),
+        'cursor': found.cursor.web_safe_string if found.cursor else None
+    }
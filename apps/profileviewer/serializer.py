@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Pluggable json serialisation.
+
+File: serializer.py
+Author: SpaceLis
+Email: Wen.Li@tudelft.nl
+GitHub: http://github.com/spacelis
+Description:
+    APIRegistry and Encodable serialise through dumps() here. The fastest
+    registered encoder that is importable is used, others can be added
+    with register(). Values an encoder rejects fall back to the stdlib.
+
+"""
+
+import json
+
+
+# A compact encoder built once, json.dumps builds one per call for any
+# argument other than the defaults.
+_STDLIB = json.JSONEncoder(separators=(',', ':'))
+
+# Characters breaking out of a <script> block or a javascript string
+_JS_UNSAFE = [('<', '\\u003c'), ('>', '\\u003e'), ('&', '\\u0026')]
+
+
+def _stdlib_dumps(obj):
+    """ Serialise with the C accelerated encoder of the stdlib. """
+    return _STDLIB.encode(obj)
+
+
+def _ujson_dumps():
+    """ Return the dumps of ujson if installed. """
+    import ujson  # pylint: disable=F0401
+    return lambda obj: ujson.dumps(obj, ensure_ascii=True,
+                                   double_precision=15)
+
+
+ENCODERS = [('stdlib', lambda: _stdlib_dumps)]
+_ACTIVE = {'name': 'stdlib', 'dumps': _stdlib_dumps}
+
+
+def register(name, loader):
+    """ Register an encoder taking precedence over the registered ones.
+
+    :name: The name of the encoder.
+    :loader: A function returning dumps(obj) -> str, raising ImportError
+        if the encoder is not available.
+
+    """
+    ENCODERS.insert(0, (name, loader))
+    use()
+
+
+def use(name=None):
+    """ Use the named encoder, or the first available one if None.
+
+    :returns: The name of the encoder in use.
+
+    """
+    for n, loader in ENCODERS:
+        if name in (None, n):
+            try:
+                _ACTIVE.update(name=n, dumps=loader())
+                return n
+            except ImportError:
+                if name is not None:
+                    raise
+    raise KeyError(name)
+
+
+def current():
+    """ Return the name of the encoder in use. """
+    return _ACTIVE['name']
+
+
+def dumps(obj):
+    """ Return obj as a json string. """
+    try:
+        return _ACTIVE['dumps'](obj)
+    except (TypeError, OverflowError, ValueError):
+        # e.g., values beyond what the fast encoder supports
+        return _stdlib_dumps(obj)
+
+
+def js_literal(obj):
+    """ Return obj as a javascript expression safe to embed in html.
+
+    Non-ascii characters are escaped by the encoders, so the json only
+    needs <, > and & escaped instead of being base64 encoded.
+
+    """
+    s = dumps(obj)
+    for c, esc in _JS_UNSAFE:
+        s = s.replace(c, esc)
+    return s
+
+
+register('ujson', _ujson_dumps)
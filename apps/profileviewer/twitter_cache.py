@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" A tweepy cache backed by memcache and the datastore.
+
+File: twitter_cache.py
+Author: SpaceLis
+Email: Wen.Li@tudelft.nl
+GitHub: http://github.com/spacelis
+Description:
+    Two-tier cache for Twitter API responses. Memcache is checked first and
+    the datastore (CachedResponse) keeps the responses across evictions and
+    task retries.
+
+"""
+
+import re
+import time
+import calendar
+import zlib
+import hashlib
+from datetime import datetime as dt
+from datetime import timedelta
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from google.appengine.ext import ndb
+from google.appengine.api import memcache
+
+from tweepy.cache import Cache
+
+
+# Only responses about an explicitly given user are shared among clients,
+# anything depending on the authenticating user is never cached.
+CACHEABLE_URL = re.compile(r'[?&](user_id|screen_name|id)=')
+UNCACHEABLE_PATH = ('/account/', '/direct_messages', '/friendships/',
+                    '/statuses/home_timeline', '/statuses/mentions_timeline')
+# Responses that change as users tweet or follow, kept for volatile_timeout
+VOLATILE_PATH = ('/statuses/user_timeline', '/favorites/', '/friends/',
+                 '/followers/')
+
+
+class CachedResponse(ndb.Model):  # pylint: disable=R0903
+
+    """ A cached response from Twitter API. """
+
+    # Values are managed in memcache by DatastoreCache itself
+    _use_cache = False
+    _use_memcache = False
+
+    value = ndb.model.BlobProperty(indexed=False)
+    created_at = ndb.model.DateTimeProperty(indexed=False)
+    expires_at = ndb.model.DateTimeProperty(indexed=True)
+
+
+class DatastoreCache(Cache):
+
+    """ A tweepy cache keeping responses in memcache and CachedResponse.
+
+    Values are pickled and compressed with zlib before being stored in
+    either tier. The hit counters are kept per instance.
+
+    :timeout: The seconds responses are kept.
+    :volatile_timeout: The seconds responses under VOLATILE_PATH are kept,
+        so that crawling a timeline again finds the new statuses.
+
+    """
+
+    PREFIX = 'tweepy-cache:'
+    BATCH_SIZE = 500
+
+    def __init__(self, timeout=3600, volatile_timeout=300):
+        Cache.__init__(self, timeout)
+        self.volatile_timeout = volatile_timeout
+        self.hits = {'memcache': 0, 'datastore': 0, 'miss': 0}
+
+    @staticmethod
+    def cacheable(key):
+        """ Return whether the url is safe to share among clients.
+
+        :key: The url of the request.
+        :returns: True if the response can be cached.
+
+        """
+        return CACHEABLE_URL.search(key) is not None and \
+            not any(p in key for p in UNCACHEABLE_PATH)
+
+    @staticmethod
+    def _id(key):
+        """ Return the id used in both memcache and the datastore. """
+        return hashlib.md5(key).hexdigest()  # pylint: disable=E1101
+
+    def _timeout(self, key, timeout=None):
+        """ Return the timeout to apply to the url. """
+        if timeout is not None:
+            return timeout
+        if any(p in key for p in VOLATILE_PATH):
+            return min(self.timeout, self.volatile_timeout)
+        return self.timeout
+
+    @staticmethod
+    def _is_expired(created_at, timeout):
+        """ Return whether an entry created at created_at has expired. """
+        return timeout > 0 and (time.time() - created_at) >= timeout
+
+    def store(self, key, value):
+        """ Store the value in memcache and the datastore.
+
+        :key: The url of the request.
+        :value: The parsed response.
+
+        """
+        if not self.cacheable(key):
+            return
+        eid = self._id(key)
+        now = time.time()
+        timeout = self._timeout(key)
+        blob = zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        memcache.set(self.PREFIX + eid, (now, blob),  # pylint: disable=E1101
+                     time=timeout)
+        created_at = dt.utcfromtimestamp(now)
+        CachedResponse(id=eid,
+                       value=blob,
+                       created_at=created_at,
+                       expires_at=created_at + timedelta(
+                           seconds=timeout)).put()
+
+    def get(self, key, timeout=None):
+        """ Return the cached value of key or None.
+
+        :key: The url of the request.
+        :timeout: Override the timeout of the cache.
+
+        """
+        return self.get_multi([key], timeout).get(key)
+
+    def get_multi(self, keys, timeout=None):
+        """ Return the cached values for a list of keys.
+
+        Memcache is queried in one batch and the misses are then looked up
+        with one get_multi in the datastore.
+
+        :keys: A list of urls.
+        :timeout: Override the timeout of the cache.
+        :returns: A dict of url to value for the entries found.
+
+        """
+        ids = dict((self._id(k), k) for k in keys if self.cacheable(k))
+        found = dict()
+        hits = memcache.get_multi(ids.keys(),  # pylint: disable=E1101
+                                  key_prefix=self.PREFIX)
+        for eid, (created_at, blob) in hits.iteritems():
+            if not self._is_expired(created_at,
+                                    self._timeout(ids[eid], timeout)):
+                found[ids[eid]] = pickle.loads(zlib.decompress(blob))
+                self.hits['memcache'] += 1
+
+        missing = [eid for eid in ids if ids[eid] not in found]
+        refill = dict()
+        for eid, ent in zip(missing, ndb.get_multi(
+                [ndb.Key(CachedResponse, eid) for eid in missing])):
+            if ent is None:
+                self.hits['miss'] += 1
+                continue
+            created_at = calendar.timegm(ent.created_at.utctimetuple())
+            if self._is_expired(created_at,
+                                self._timeout(ids[eid], timeout)):
+                self.hits['miss'] += 1
+                continue
+            found[ids[eid]] = pickle.loads(zlib.decompress(ent.value))
+            refill[eid] = (created_at, ent.value)
+            self.hits['datastore'] += 1
+        # one batch per timeout
+        batches = dict()
+        for eid, value in refill.iteritems():
+            batches.setdefault(self._timeout(ids[eid]), {})[eid] = value
+        for ttl, batch in batches.iteritems():
+            memcache.set_multi(batch,  # pylint: disable=E1101
+                               key_prefix=self.PREFIX,
+                               time=ttl)
+        return found
+
+    def count(self):
+        """ Return the number of entries in the datastore. """
+        return CachedResponse.query().count()
+
+    def _delete_query(self, qry):
+        """ Delete entries matching the query from both tiers. """
+        cnt = 0
+        more, cur = True, None
+        while more:
+            keys, cur, more = qry.fetch_page(self.BATCH_SIZE,
+                                             start_cursor=cur,
+                                             keys_only=True)
+            memcache.delete_multi([k.id() for k in keys],  # pylint: disable=E1101
+                                  key_prefix=self.PREFIX)
+            ndb.delete_multi(keys)
+            cnt += len(keys)
+        return cnt
+
+    def cleanup(self):
+        """ Delete expired entries. """
+        return self._delete_query(CachedResponse.query(
+            CachedResponse.expires_at < dt.utcnow()))
+
+    def flush(self):
+        """ Delete all entries. """
+        return self._delete_query(CachedResponse.query())
+
+    def report(self):
+        """ Return the hit rates of this cache on the current instance.
+
+        :returns: A dict of counts and rates.
+
+        """
+        total = sum(self.hits.values())
+        rate = lambda n: float(n) / total if total else 0.0
+        return {
+            'lookups': total,
+            'memcache_hits': self.hits['memcache'],
+            'datastore_hits': self.hits['datastore'],
+            'misses': self.hits['miss'],
+            'hit_rate': rate(self.hits['memcache'] + self.hits['datastore']),
+            'memcache_hit_rate': rate(self.hits['memcache'])
+        }
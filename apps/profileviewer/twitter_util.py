@@ -12,23 +12,43 @@ Description:
 """
 
 import json
+import logging
+from Queue import Queue
+from Queue import Empty
+from threading import Thread
+
 import tweepy as tw
 
+from apps.profileviewer.twitter_cache import DatastoreCache
+
 with open('cred.json') as fin:
     APICRED = json.load(fin)
 
 with open('category_map.json') as fin:
     CATEGORY_MAP = json.load(fin)
 
+# Shared by all clients so that the hit rates cover the whole instance
+TWITTER_CACHE = DatastoreCache(timeout=7 * 24 * 3600)
+
 
-def new_twitter_client(token=None, secret=None):
-    """ return a Twitter API object. """
+def new_twitter_auth(token=None, secret=None):
+    """ return a Twitter OAuth handler. """
     auth = tw.OAuthHandler(
         APICRED['twitter_consumer_key'],
         APICRED['twitter_consumer_secret'])
     if token and secret:
         auth.set_access_token(token, secret)
-    return tw.API(auth)
+    return auth
+
+
+def new_twitter_client(token=None, secret=None, cache=True):
+    """ return a Twitter API object.
+
+    :cache: Whether GET responses are cached in TWITTER_CACHE.
+
+    """
+    return tw.API(new_twitter_auth(token, secret),
+                  cache=TWITTER_CACHE if cache else None)
 
 
 def new_foursquare_client(token=None, secret=None):  # pylint: disable=W0613
@@ -94,14 +114,15 @@ def iter_timeline(timeline, **kwargs):
             kwargs['max_id'] = i.id - 1  # pylint: disable=W0631
 
 
-def find_place(p):
+def find_place(p, cli=None):
     """ Find a place on Foursquare with the name and coordinates
 
     :p: a place request {'lat': xx, 'lng': yy, 'name': zzz}
+    :cli: a Foursquare client, a new one is made if not given
     :returns: @todo
 
     """
-    cli = new_foursquare_client()
+    cli = cli or new_foursquare_client()
     places = cli.venues.search(  # pylint: disable=E1101
         params={'ll': '%s,%s' % (p['lat'], p['lng']),
                 'query': p['name'],
@@ -113,16 +134,66 @@ def find_place(p):
         return None
 
 
+def category_of(venue):
+    """ Return the category of a Foursquare venue as in checkins.
+
+    :venue: a venue from Foursquare
+    :returns: a category dict or None if the venue has no category
+
+    """
+    if not venue or not venue.get('categories'):
+        return None
+    category = venue['categories'][0]
+    zcategory = CATEGORY_MAP[category['id']]
+    return {
+        'id': category['id'],
+        'name': category['name'],
+        'zero_category': zcategory['id'],
+        'zero_category_name': zcategory['name']}
+
+
 def update_poi_category(p):
     """ Find a place on Foursquare and update stored poi's
         category.
     """
-    fs_p = find_place(p)
-    category = fs_p['cateogry'][0]
-    category_id = category['id']
-    p['category'] = {
-        'id': category_id,
-        'name': category['name'],
-        'zcateogry_id': CATEGORY_MAP[category_id]['id'],
-        'zcategory': CATEGORY_MAP[category_id]['name']}
+    p['category'] = category_of(find_place(p))
     return p
+
+
+def resolve_categories(places, size=8):
+    """ Find the categories of places on Foursquare concurrently.
+
+    :places: a list of places as in checkins, the ids should be distinct
+    :size: the max number of concurrent requests
+    :returns: a dict of place id to category, places failed to resolve
+        or without a category are left out so that they can be retried
+        later
+
+    """
+    todo = Queue()
+    for p in places:
+        todo.put(p)
+    resolved = dict()
+
+    def worker():
+        """ Resolve places until none is left. """
+        cli = new_foursquare_client()
+        while True:
+            try:
+                p = todo.get_nowait()
+            except Empty:
+                return
+            try:
+                cate = category_of(find_place(p, cli))
+            except Exception:  # pylint: disable=broad-except
+                logging.exception('Failed to resolve place: %s', p['id'])
+            else:
+                if cate:
+                    resolved[p['id']] = cate
+
+    workers = [Thread(target=worker) for _ in range(min(size, len(places)))]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return resolved
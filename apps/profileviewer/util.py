@@ -17,6 +17,7 @@ import base64
 import json
 
 from itertools import chain
+from itertools import islice
 from itertools import groupby
 from collections import namedtuple
 
@@ -24,6 +25,7 @@ from django.utils.dateparse import parse_datetime
 
 from google.appengine.ext import ndb
 from google.appengine.api import mail
+import google.appengine.api.taskqueue as tq
 
 from apps.profileviewer.models import User
 
@@ -47,6 +49,61 @@ def throttle_map(it, callback, size=20):
     return i
 
 
+def partition(iterable, size=10, margin=None):
+    """ Partitioning iterable into groups of elements in given size.
+
+    The margin is for the last group of elements.
+    If there are less than margin number of elements, they will be
+    grouped together. E.g., the last group may contain 15, 14, 13
+    elements if margin is 15.
+
+    Only the current and the next group are kept in memory, so any
+    iterator can be used, e.g., a query iterator.
+
+    :iterable: An iterable through some elements.
+    :size: The maximum size of a group.
+    :margin: The maximum size of the last group after merging.
+    :yields: a list containing at most the given size of the elements
+        from iterable, or at most margin for the last one.
+
+    """
+    margin = margin if margin else int(1.5 * size)
+    assert margin < 2 * size, \
+        'The margin %s is too large for size %s' % (margin, size)
+
+    it = iter(iterable)
+    cur = list(islice(it, size))
+    while cur:
+        nex = list(islice(it, size))
+        # only the last group can be short enough for merging
+        if nex and len(cur) + len(nex) <= margin:
+            yield cur + nex
+            return
+        yield cur
+        cur = nex
+
+
+def enqueue(tasks, queue_name='batch', size=100):
+    """ Add tasks to a queue with one call per batch.
+
+    :tasks: An iterable of taskqueue.Task.
+    :queue_name: The name of the queue.
+    :size: The number of tasks per call, at most 100 on GAE.
+    :returns: The number of tasks added.
+
+    """
+    queue = tq.Queue(queue_name)
+    cnt = 0
+    for batch in partition(tasks, size, size):
+        try:
+            queue.add(batch)
+        except (tq.TaskAlreadyExistsError, tq.TombstonedTaskError):
+            # named tasks queued already, the rest of the batch is added
+            pass
+        cnt += sum(1 for t in batch if t.was_enqueued)
+    return cnt
+
+
 def get_user(request):
     """ Return the session attach to this request. """
     # session_toke is actually a token to a (temporary) user
@@ -116,6 +173,28 @@ def listCompressedProperty(model):
                 p.__class__ == ndb.model.StringProperty) and p._compressed]
 
 
+def fixCompressedEntities(entities, fields):
+    """ Fix Compressiion Error for the entities in place.
+        :entities: A list of entities.
+        :fields:  A list of field names.
+        :returns: The entities changed, which need to be put.
+
+    """
+    # pylint: disable-msg=W0212
+    changed = list()
+    for ins in entities:
+        fixed = False
+        for p in fields:
+            if ins._values.get(p) and not isinstance(
+                    ins._values.get(p).b_val, ndb.model._CompressedValue):
+                ins._values.get(p).b_val = \
+                    ndb.model._CompressedValue(ins._values.get(p).b_val)
+                fixed = True
+        if fixed:
+            changed.append(ins)
+    return changed
+
+
 def fixCompressedEntity(key, fields):
     """ Fix Compressiion Error for the entity with tkey.
         :key: The key of the entity.
@@ -123,13 +202,8 @@ def fixCompressedEntity(key, fields):
 
     """
     # apply the fixing
-    ins = key.get()
-    for p in fields:
-        if ins._values.get(p) and not isinstance(ins._values.get(p).b_val,
-                                                 ndb.model._CompressedValue):
-            ins._values.get(p).b_val = \
-                ndb.model._CompressedValue(ins._values.get(p).b_val)
-            ins.put()
+    for ins in fixCompressedEntities([key.get()], fields):
+        ins.put()
 
 
 Focus = namedtuple('Focus', ['name', 'value', 'chart'], verbose=False)
@@ -33,6 +33,7 @@ from apps.profileviewer.models import _k
 from apps.profileviewer.models import TaskPackage
 from apps.profileviewer.models import Judgement
 from apps.profileviewer.models import User
+from apps.profileviewer.models import REFERENCE_CACHE
 
 # from apps.profileviewer.form_map import get_gform_url
 from apps.profileviewer.util import request_property
@@ -354,9 +355,9 @@ def annotation_view(request, task_key):
     if user.task_package is None and not settings.DEBUG:
         raise Http404
     show_rk = request_property(request, 'show_rk', False)
-    task = _k(task_key, 'AnnotationTask').get()
-    rs = [r.get() for r in task.rankings]
-    ts = [r.topic.get() for r in rs]
+    task = REFERENCE_CACHE.get(_k(task_key, 'AnnotationTask'))
+    rs = REFERENCE_CACHE.get_multi(task.rankings)
+    ts = REFERENCE_CACHE.get_multi([r.topic for r in rs])
     if not show_rk:
         title = lambda ts, _: '\n'.join(
             ['Example Inquiry:'] +
@@ -434,7 +435,7 @@ def submit_annotation(request):
 
     try:
         task_key = request.POST.get('pv-task-key', None)
-        task = _k(task_key, 'AnnotationTask').get()
+        task = REFERENCE_CACHE.get(_k(task_key, 'AnnotationTask'))
 
         scores = get_scores(request)
         ipaddr, user_agent = get_client(request)
@@ -83,6 +83,576 @@ class TestImportAPI(unittest.TestCase):
                          set(range(20)))
 
 
+# pylint: disable=R0904
+class TestGenerationJobs(unittest.TestCase):
+
+    """ TestGenerationJobs. """
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.setup_env(app_id='geo-expertise')
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_taskqueue_stub(root_path='.')
+        from apps.profileviewer import jobs
+        import apps.profileviewer.api.data  # pylint: disable=W0612
+        # page sizes are shrunk by the tests
+        self.jobs = dict(jobs.JOBS)
+
+    def tearDown(self):
+        from apps.profileviewer import jobs
+        jobs.JOBS.clear()
+        jobs.JOBS.update(self.jobs)
+        self.testbed.deactivate()
+
+    def test_topical_taskpackages(self):
+        """ test_topical_taskpackages. """
+        from google.appengine.ext import ndb
+        from apps.profileviewer import jobs
+        from apps.profileviewer.models import AnnotationTask
+        from apps.profileviewer.models import ExpertiseRank
+        from apps.profileviewer.models import TaskPackage
+        rankings = [ExpertiseRank(topic_id=t, rank_method='m',
+                                  rank_info={'profile_type':
+                                             'rankCheckinProfile'})
+                    for t in ['a'] * 25 + ['b'] * 7]
+        ndb.put_multi(rankings)
+        ndb.put_multi([AnnotationTask.fromRankings([r], None)
+                       for r in rankings])
+        jobs.JOBS['make_topical_taskpackages'] = \
+            jobs.JOBS['make_topical_taskpackages']._replace(page_size=4)
+        ck = jobs.start('make_topical_taskpackages')
+        while ck.phase != jobs.DONE:
+            ck = jobs.run_page('make_topical_taskpackages')
+        self.assertEqual(ck.mapped, 32)
+        sizes = sorted(len(tp.tasks) for tp in TaskPackage.query())
+        self.assertEqual(sizes, [7, 10, 15])
+        self.assertEqual(jobs.GroupMember.query().count(), 0)
+
+        # redoing the whole job keeps the existing packages as they are
+        tp = TaskPackage.query().get()
+        tp.progress = []
+        tp.put()
+        ck = jobs.start('make_topical_taskpackages')
+        while ck.phase != jobs.DONE:
+            ck = jobs.run_page('make_topical_taskpackages')
+        self.assertEqual(TaskPackage.query().count(), 3)
+        self.assertEqual(tp.key.get().progress, [])
+
+    def test_empty_job(self):
+        """ test_empty_job. """
+        from apps.profileviewer import jobs
+        for name in ['make_topical_taskpackages', 'clear_Judgement']:
+            ck = jobs.start(name)
+            for _ in range(5):
+                if ck.phase == jobs.DONE:
+                    break
+                ck = jobs.run_page(name)
+            self.assertEqual(ck.phase, jobs.DONE)
+            self.assertEqual(ck.mapped, 0)
+
+    def test_done_hook(self):
+        """ test_done_hook. """
+        from google.appengine.ext import ndb
+        from apps.profileviewer import jobs
+        from apps.profileviewer.models import Judgement
+        calls = []
+        jobs.register('test_done', lambda p: Judgement.query(),
+                      lambda ents, p, n: [], page_size=2, done=calls.append)
+        ndb.put_multi([Judgement(score=i) for i in range(3)])
+        ck = jobs.start('test_done', {'a': 1})
+        while ck.phase != jobs.DONE:
+            self.assertEqual(calls, [])
+            ck = jobs.run_page('test_done')
+        self.assertEqual(calls, [{'a': 1}])
+        jobs.run_page('test_done')
+        self.assertEqual(calls, [{'a': 1}])
+
+    def test_enqueue(self):
+        """ test_enqueue. """
+        import google.appengine.api.taskqueue as tq
+        from apps.profileviewer.util import enqueue
+        tasks = lambda: [tq.Task(name='t%d' % i, url='/x') for i in range(3)]
+        self.assertEqual(enqueue(tasks()[:2]), 2)
+        # the named tasks queued already are skipped
+        self.assertEqual(enqueue(tasks()), 1)
+
+    def test_fix_compressed(self):
+        """ test_fix_compressed. """
+        import zlib
+        from google.appengine.api import datastore
+        from google.appengine.api import datastore_types
+        from google.appengine.ext import ndb
+        from apps.profileviewer import jobs
+        from apps.profileviewer.models import GeoEntity
+        # restored without the meaning of compressed values
+        raw = datastore.Entity('GeoEntity', name='restored')
+        raw['info'] = datastore_types.Blob(zlib.compress(json.dumps({'a': 1})))
+        datastore.Put(raw)
+        GeoEntity(id='intact', info={'b': 2}).put()
+        ck = jobs.start('fix_GeoEntity')
+        while ck.phase != jobs.DONE:
+            ck = jobs.run_page('fix_GeoEntity')
+        self.assertEqual((ck.mapped, ck.written), (2, 1))
+        ndb.get_context().clear_cache()
+        self.assertEqual(GeoEntity.get_by_id('restored').info, {'a': 1})
+        self.assertEqual(GeoEntity.get_by_id('intact').info, {'b': 2})
+
+    def test_reset_jobs(self):
+        """ test_reset_jobs. """
+        from google.appengine.ext import ndb
+        from apps.profileviewer import jobs
+        from apps.profileviewer.models import Judgement
+        from apps.profileviewer.models import TaskPackage
+        from apps.profileviewer.models import TaskCoverage
+        from apps.profileviewer.api.data import reset
+        from apps.profileviewer.api.data import reset_status
+        ndb.put_multi([Judgement(score=i) for i in range(7)])
+        tkeys = [ndb.Key('AnnotationTask', 1)]
+        ndb.put_multi([TaskPackage(tasks=tkeys, progress=[])])
+        TaskCoverage.incrementAsync(tkeys[0], 7).get_result()
+        jobs.JOBS['clear_Judgement'] = \
+            jobs.JOBS['clear_Judgement']._replace(page_size=3)
+        ret = reset('annotation')
+        self.assertIn('clear_Judgement', ret['jobs'])
+        for name in ret['jobs']:
+            ck = jobs.status(name)
+            while ck.phase != jobs.DONE:
+                ck = jobs.run_page(name)
+        self.assertEqual(Judgement.query().count(), 0)
+        self.assertEqual(TaskPackage.query().get().progress, tkeys)
+        # the surviving task is counted as judged by none
+        self.assertEqual(TaskCoverage.keyOf(tkeys[0]).get().judgements, 0)
+        status = reset_status()
+        self.assertTrue(status['done'])
+        self.assertEqual(status['num'], 9)
+
+        # the index and profiles are derived from the kept candidates
+        self.assertNotIn('clear_IndexEntry', reset('tasks')['jobs'])
+        self.assertIn('clear_CheckinProfile', reset('ALL')['jobs'])
+
+    def test_assign_least_covered(self):
+        """ test_assign_least_covered. """
+        from datetime import datetime as dt
+        from google.appengine.ext import ndb
+        from apps.profileviewer.models import TaskPackage
+        from apps.profileviewer.api.data import assign_least_covered
+        leased, free = dt.utcnow(), dt(2000, 1, 1)
+        tps = [TaskPackage(tasks=[ndb.Key('AnnotationTask', i + 1)],
+                           progress=[], coverage=0, assigned_at=leased)
+               for i in range(5)]
+        tps.append(TaskPackage(tasks=[ndb.Key('AnnotationTask', 6)],
+                               progress=[], coverage=1, assigned_at=free))
+        ndb.put_multi(tps)
+        # the first pages are all leased
+        self.assertEqual(assign_least_covered(3, size=2),
+                         tps[-1].key.urlsafe())
+        self.assertRaises(TaskPackage.NoMoreTaskPackage,
+                          assign_least_covered, 3, 2)
+
+    def test_index_geoentities(self):
+        """ test_index_geoentities. """
+        from apps.profileviewer.models import GeoEntity
+        from apps.profileviewer.api.data import index_geoentities
+        # imported before geopt was set by the loader
+        GeoEntity(tfid='a', name='Cafe',
+                  info={'location': {'lat': 40.7, 'lng': -74.0}}).put()
+        GeoEntity(tfid='b', name='Cafe', info={'location': {}}).put()
+        self.assertEqual(GeoEntity.nearby(40.7, -74.0, 100), [])
+        self.assertFalse(index_geoentities()['more'])
+        self.assertEqual([e.tfid for _, e in GeoEntity.nearby(40.7, -74.0, 100)],
+                         ['a'])
+
+    def test_candidate_index(self):
+        """ test_candidate_index. """
+        from google.appengine.ext import ndb
+        from apps.profileviewer import jobs
+        from apps.profileviewer import invindex
+        from apps.profileviewer.models import ExpertiseRank
+        from apps.profileviewer.models import TwitterAccount
+        from apps.profileviewer.api.data import candidates_by
+        place = lambda lat, lng, cat: {'place': {'lat': lat, 'lng': lng,
+                                                 'category': {'name': cat}}}
+        tkeys = ndb.put_multi([
+            TwitterAccount(checkins=[place(41.88, -87.63, 'Cafe')]),
+            TwitterAccount(checkins=[place(40.71, -74.00, 'Cafe')]),
+            TwitterAccount(checkins=[place(40.71, -74.00, 'Food')])])
+        ndb.put_multi([ExpertiseRank(topic_id=t, region=r, candidate=c)
+                       for t, r, c in [('1', 'chicago', tkeys[0]),
+                                       ('1', 'chicago', tkeys[1]),
+                                       ('2', 'new-york', tkeys[1]),
+                                       ('2', 'new-york', tkeys[2])]])
+        # left by an earlier build
+        ndb.put_multi(invindex.make_shards('topic:3', [tkeys[0].id()]))
+        # posting lists span reduce pages
+        jobs.JOBS['index_rankings'] = \
+            jobs.JOBS['index_rankings']._replace(page_size=3, reduce_size=2)
+        jobs.JOBS['index_checkins'] = \
+            jobs.JOBS['index_checkins']._replace(reduce_size=2)
+        jobs.start('drop_postings')
+        for name in ['drop_postings', 'index_rankings', 'index_checkins']:
+            ck = jobs.status(name)
+            while ck.phase != jobs.DONE:
+                ck = jobs.run_page(name)
+
+        def found(**kwargs):
+            """ Return the keys of the candidates found. """
+            ret = candidates_by(**kwargs).get_result()
+            return [ndb.Key(urlsafe=k) for k in ret['candidates']]
+
+        self.assertEqual(found(topic=['1']), tkeys[:2])
+        self.assertEqual(found(topic=['3']), [])
+        self.assertEqual(found(region=['chicago', 'new-york']), tkeys)
+        # ranked for 1 and in new-york, but not for 1 in new-york
+        self.assertEqual(found(topic=['1'], region=['new-york']), [])
+        self.assertEqual(found(topic=['1', '2'], region=['new-york']),
+                         tkeys[1:])
+        self.assertEqual(found(topic=['1', '2'], category=['Cafe']),
+                         tkeys[:2])
+        self.assertEqual(found(visited=['new-york'], category=['Food']),
+                         tkeys[2:])
+        self.assertEqual(found(topic=['1', '2'], size=2,
+                               after=tkeys[0].id()), tkeys[1:])
+
+
+# pylint: disable=R0904
+class TestMetrics(unittest.TestCase):
+
+    """ TestMetrics. """
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.setup_env(app_id='geo-expertise')
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def test_histogram(self):
+        """ test_histogram. """
+        from apps.profileviewer.api.metrics import Histogram
+        h = Histogram()
+        for v in range(1, 101):
+            h.add(v)
+        self.assertEqual(h.total(), 100)
+        self.assertTrue(50 <= h.percentile(50) <= 50 * 1.2)
+        self.assertTrue(99 <= h.percentile(99) <= 99 * 1.2)
+        self.assertIsNone(Histogram().percentile(50))
+
+    def test_recorder(self):
+        """ test_recorder. """
+        from google.appengine.ext import ndb
+        from google.appengine.api import memcache
+        from apps.profileviewer.api import metrics
+        from apps.profileviewer.models import Judgement
+        metrics.RECORDER.start('data.test')
+        ndb.put_multi([Judgement(score=1), Judgement(score=2)])
+        memcache.get_multi(['a', 'b'])
+        metrics.RECORDER.stop(123)
+        stats = [s for s in metrics.report() if s['endpoint'] == 'data.test']
+        self.assertEqual(stats[0]['calls'], 1)
+        self.assertTrue(stats[0]['datastore_rpcs']['p50'] >= 1)
+        self.assertTrue(stats[0]['memcache_misses']['p50'] >= 2)
+        self.assertTrue(123 <= stats[0]['response_bytes']['p99'] <= 150)
+
+
+# pylint: disable=R0904
+class TestResponseCache(unittest.TestCase):
+
+    """ TestResponseCache. """
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.setup_env(app_id='geo-expertise')
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_taskqueue_stub(root_path='.')
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def test_cached_endpoint(self):
+        """ test_cached_endpoint. """
+        from apps.profileviewer.api import APIRegistry
+        from apps.profileviewer.api.respcache import CachePolicy
+        from apps.profileviewer.api.respcache import RESPONSE_CACHE
+        reg = APIRegistry()
+        calls = []
+
+        @reg.api_endpoint(cache=CachePolicy(ttl=60, tags=['t']))
+        def counted(a):  # pylint: disable=W0612
+            """ Count the calls. """
+            calls.append(a)
+            return {'a': a, 'n': len(calls)}
+
+        def call(**params):
+            """ Call the endpoint with the params. """
+            req = Mock()
+            req.GET = params
+            req.POST = {}
+            req.COOKIES = {}
+            req.path = '/api/data/counted'
+            return json.loads(reg.call_endpoint(req, 'counted').content)
+
+        self.assertEqual(call(a='x'), {'a': 'x', 'n': 1})
+        self.assertEqual(call(a='x'), {'a': 'x', 'n': 1})
+        RESPONSE_CACHE.clear()
+        self.assertEqual(call(a='x'), {'a': 'x', 'n': 1})
+        self.assertEqual(call(a='y'), {'a': 'y', 'n': 2})
+        RESPONSE_CACHE.invalidate('t')
+        self.assertEqual(call(a='x'), {'a': 'x', 'n': 3})
+        self.assertEqual(call(a='x', _refresh='1'), {'a': 'x', 'n': 4})
+
+    def test_argument_tags(self):
+        """ test_argument_tags. """
+        from google.appengine.ext import ndb
+        from apps.profileviewer.api.respcache import CachePolicy
+        from apps.profileviewer.api.respcache import RESPONSE_CACHE
+        policy = CachePolicy(ttl=60, tags=['t', 'c:%(c)s'])
+        key = ndb.Key('TwitterAccount', 1)
+        self.assertEqual(policy.tagsOf({'c': key}),
+                         ['t', 'c:' + key.urlsafe()])
+
+        k1 = RESPONSE_CACHE.key('e', policy, {'c': key})
+        other = ndb.Key('TwitterAccount', 2)
+        k2 = RESPONSE_CACHE.key('e', policy, {'c': other})
+        RESPONSE_CACHE.invalidate('c:' + key.urlsafe())
+        self.assertNotEqual(RESPONSE_CACHE.key('e', policy, {'c': key}), k1)
+        self.assertEqual(RESPONSE_CACHE.key('e', policy, {'c': other}), k2)
+
+
+# pylint: disable=R0904
+class TestBatch(unittest.TestCase):
+
+    """ TestBatch. """
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.setup_env(app_id='geo-expertise')
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_taskqueue_stub(root_path='.')
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def test_batch(self):
+        """ test_batch. """
+        from apps.profileviewer.api import APIRegistry
+        from apps.profileviewer.api.batch import call_batch
+        req = Mock()
+        req.GET = {'_admin_key': APIRegistry.ADMIN_KEY,
+                   'calls': json.dumps([['data/model_stats', {}],
+                                        ['data/job_status', {'name': 'x'}],
+                                        ['data/no_such_endpoint', {}],
+                                        ['nowhere/model_stats']])}
+        req.POST = {}
+        req.COOKIES = {}
+        req.META = {}
+        ret = json.loads(call_batch(req).content)
+        self.assertEqual(ret['num'], 4)
+        self.assertEqual([r['status'] for r in ret['results']],
+                         [200, 200, 404, 404])
+        self.assertEqual(ret['results'][0]['data']['Judgement'], 0)
+        self.assertEqual(ret['results'][1]['data']['jobs'], [])
+
+
+# pylint: disable=R0904
+class TestSearch(unittest.TestCase):
+
+    """ TestSearch. """
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.setup_env(app_id='geo-expertise')
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_search_stub()
+        self.testbed.init_taskqueue_stub(root_path='.')
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def test_search_index(self):
+        """ test_search_index. """
+        from apps.profileviewer.models import TwitterAccount
+        from apps.profileviewer.search import build_index, search_index
+
+        def checkin(text, name, category, lat, lng):
+            """ Return a stripped checkin. """
+            return {'text': text,
+                    'place': {'name': name, 'full_name': name,
+                              'category': {'name': category},
+                              'lat': lat, 'lng': lng}}
+
+        accounts = [
+            TwitterAccount(screen_name='a', checkins=[
+                checkin('great coffee', 'Bean', 'Cafe', 41.88, -87.63),
+                checkin('lunch', 'Deli', 'Food', 41.88, -87.63)]),
+            TwitterAccount(screen_name='b', checkins=[
+                checkin('more coffee', 'Cup', 'Cafe', 40.71, -74.00)]),
+            TwitterAccount(screen_name='c', checkins=[
+                checkin('running', 'Park', 'Outdoors', 40.71, -74.00)])]
+        for ta in accounts:
+            ta.put()
+        self.assertEqual(build_index(accounts), 3)
+
+        found = search_index('coffee')
+        self.assertEqual(found['num'], 2)
+        self.assertEqual(sorted(r['screen_name'] for r in found['results']),
+                         ['a', 'b'])
+        self.assertEqual(dict(found['facets']['region']),
+                         {'chicago': 1, 'new-york': 1})
+        found = search_index('coffee', {'region': 'new-york'})
+        self.assertEqual([r['screen_name'] for r in found['results']], ['b'])
+        found = search_index(None, {'category': 'Food'})
+        self.assertEqual([r['screen_name'] for r in found['results']], ['a'])
+        found = search_index(None, near=(40.71, -74.00, 1000))
+        self.assertEqual(found['num'], 2)
+
+        # clearing the accounts removes their documents
+        from apps.profileviewer import jobs
+        import apps.profileviewer.api.data  # pylint: disable=W0612
+        ck = jobs.start('clear_TwitterAccount')
+        while ck.phase != jobs.DONE:
+            ck = jobs.run_page('clear_TwitterAccount')
+        self.assertEqual(search_index('coffee')['num'], 0)
+
+
+    def test_tasksearch(self):
+        """ test_tasksearch. """
+        import time
+        from datetime import datetime as dt
+        from google.appengine.ext import ndb
+        from google.appengine.datastore.datastore_query import Cursor
+        from apps.profileviewer.api.data import tasksearch
+        from apps.profileviewer.models import Judgement, TwitterAccount
+        ta = TwitterAccount(screen_name='someone')
+        ta.put()
+        judge = ndb.Key('User', 1)
+        ndb.put_multi([Judgement(judge=judge, candidate=ta.key,
+                                 topic_id='t%d' % (i % 2, ), score=i,
+                                 created_at=dt(2014, 1, 1, 0, i),
+                                 task=ndb.Key('AnnotationTask', i))
+                       for i in range(5)])
+        req = Mock()
+        req.build_absolute_uri = lambda p: p
+
+        def search(**kwargs):
+            """ Return the json of the search. """
+            return json.loads(tasksearch(req, fmt='json', **kwargs)
+                              .get_result().content)
+
+        page = search(judge=judge, size=3)
+        self.assertEqual([j['score'] for j in page['judgements']], [4, 3, 2])
+        self.assertEqual(page['judgements'][0]['candidate'], 'someone')
+        self.assertTrue(page['more'])
+        page = search(judge=judge, size=3,
+                      cursor=Cursor(urlsafe=page['cursor']))
+        self.assertEqual([j['score'] for j in page['judgements']], [1, 0])
+        self.assertFalse(page['more'])
+        page = search(topic_id='t1')
+        self.assertEqual([j['score'] for j in page['judgements']], [3, 1])
+        self.assertEqual(TwitterAccount.screenNamesAsync([ta.key])
+                         .get_result(), {ta.key: 'someone'})
+        # a rename shows once the cached name expires
+        ta.screen_name = 'renamed'
+        ta.put()
+        self.assertEqual(TwitterAccount.screenNamesAsync([ta.key])
+                         .get_result(), {ta.key: 'someone'})
+        later = int(time.time()) + TwitterAccount.SCREEN_NAME_TTL + 1
+        with mock.patch.object(self.testbed.get_stub('memcache'),
+                               '_gettime', lambda: later):
+            self.assertEqual(TwitterAccount.screenNamesAsync([ta.key])
+                             .get_result(), {ta.key: 'renamed'})
+
+
+# pylint: disable=R0904
+class TestAPIRegistry(unittest.TestCase):
+
+    """ TestAPIRegistry. """
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.setup_env(app_id='geo-expertise')
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def test_tasklet_endpoint(self):
+        """ test_tasklet_endpoint. """
+        from google.appengine.ext import ndb
+        from apps.profileviewer.api import APIRegistry
+        from apps.profileviewer.models import Judgement
+        reg = APIRegistry()
+        ndb.put_multi([Judgement(score=i) for i in range(3)])
+
+        @reg.api_endpoint()
+        def counted(score):
+            """ Count judgements concurrently. """
+            total, high = yield (
+                Judgement.query().count_async(),
+                Judgement.query(Judgement.score >= int(score)).count_async())
+            raise ndb.Return({'total': total, 'high': high})
+
+        self.assertEqual(counted('1').get_result(), {'total': 3, 'high': 2})
+        req = Mock()
+        req.GET = {'score': '2'}
+        req.POST = {}
+        self.assertEqual(json.loads(reg.call_endpoint(req, 'counted').content),
+                         {'total': 3, 'high': 1})
+
+    def test_typed_params(self):
+        """ test_typed_params. """
+        from google.appengine.ext import ndb
+        from apps.profileviewer.api import APIRegistry
+        from apps.profileviewer.api.params import Int, Bool, CSV, KeyOf
+        reg = APIRegistry()
+        calls = []
+        tkey = ndb.Key('TwitterAccount', 1)
+
+        @reg.api_endpoint(params={'n': Int(min_value=1),
+                                  'flag': Bool,
+                                  'keys': CSV(KeyOf('TwitterAccount'))})
+        def typed(n, keys=None, flag=False, s='default'):
+            """ Echo the typed arguments. """
+            calls.append(n)
+            return {'n': n, 'flag': flag, 's': s,
+                    'keys': [k.id() for k in keys or []]}
+
+        def call(**params):
+            """ Call the endpoint with the params. """
+            req = Mock()
+            req.GET = params
+            req.POST = {}
+            return reg.call_endpoint(req, 'typed')
+
+        self.assertEqual(json.loads(call(n='2', flag='yes',
+                                         keys=tkey.urlsafe()).content),
+                         {'n': 2, 'flag': True, 's': 'default', 'keys': [1]})
+        self.assertEqual(json.loads(call(s='x').content),
+                         {'n': None, 'flag': False, 's': 'x', 'keys': []})
+        for bad in [{'n': '0'}, {'n': 'x'}, {'flag': 'maybe'},
+                    {'keys': ndb.Key('Judgement', 1).urlsafe()},
+                    {'keys': 'garbage'}]:
+            resp = call(**bad)
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(json.loads(resp.content)['argument'],
+                             bad.keys()[0])
+        self.assertEqual(len(calls), 2)
+        with self.assertRaises(TypeError):
+            reg.api_endpoint(params={'nothing': Int()})(typed)
+
+
 class TestUtilFunctions(unittest.TestCase):
 
     """ Test general util functions. """
@@ -102,3 +672,34 @@ class TestUtilFunctions(unittest.TestCase):
                           [7, 8, 9, 10, 11, 12, 13],
                           [14, 15, 16, 17]
                           ])
+
+    def test_partition_iterator(self):
+        """ test_partition_iterator. """
+        from apps.profileviewer.util import partition
+        self.assertEqual(list(partition(iter([]), 10)), [])
+        self.assertEqual([len(g) for g in partition(iter(xrange(25)), 10)],
+                         [10, 15])
+        self.assertEqual([len(g) for g in partition(iter(xrange(26)), 10)],
+                         [10, 10, 6])
+        self.assertRaises(AssertionError, list, partition(range(5), 10, 20))
+
+    def test_serializer(self):
+        """ test_serializer. """
+        from apps.profileviewer import serializer
+        obj = {'a': [1, 2.5, None], 'b': u'</script>\u2028caf\xe9 & co'}
+        self.assertEqual(json.loads(serializer.dumps(obj)), obj)
+        js = serializer.js_literal(obj)
+        self.assertNotIn('<', js)
+        self.assertNotIn('&', js)
+        self.assertEqual(json.loads(js), obj)
+        self.assertEqual(json.loads(serializer.dumps(2 ** 70)), 2 ** 70)
+
+    def test_iter_csv_json(self):
+        """ test_iter_csv_json. """
+        from apps.profileviewer.api.data import iter_csv
+        from apps.profileviewer.api.data import iter_json
+        recs = [{'a': 1}, {'a': 2}]
+        self.assertEqual(''.join(iter_csv(recs)), 'a\r\n1\r\n2\r\n')
+        self.assertEqual(json.loads(''.join(iter_json(recs))), recs)
+        self.assertEqual(json.loads(''.join(iter_json([]))), [])
+        self.assertEqual(list(iter_csv([])), [])
@@ -337,3 +337,160 @@ class TestModels(unittest.TestCase):
         self.assertLessEqual(s.last_seen, dt.utcnow())
         self.assertGreaterEqual(s.last_seen,
                                 dt.utcnow() - timedelta(seconds=2))
+
+    def test_User_js_encode(self):
+        """ test_User_js_encode. """
+        tkeys = [ndb.Key(M.AnnotationTask, i) for i in (1, 2)]
+        tp = M.TaskPackage(tasks=tkeys, progress=tkeys)
+        tp.put()
+        u = M.User.unit().assign(tp.key)
+        self.assertIn('"package_progress":0', u.js_encode())
+        # e.g., a judgement on another instance
+        tp.progress = tkeys[1:]
+        tp.put()
+        self.assertIn('"package_progress":1', u.js_encode())
+
+    def test_PoiCategories(self):
+        """ test_PoiCategories. """
+        cate = {'id': 'c1', 'name': 'Office',
+                'zero_category': 'z1', 'zero_category_name': 'Work'}
+        M.GeoEntity(tfid='p3', name='P3', level='poi',
+                    info={'category': cate}).put()
+        M.GeoEntity.putPoiCategories(
+            [{'id': 'p1', 'name': 'P1', 'lat': 1.0, 'lng': 2.0},
+             {'id': 'p2', 'name': 'P2', 'lat': 1.0, 'lng': 2.0},
+             {'id': 'p4', 'name': 'P4', 'lat': 1.0, 'lng': 2.0}],
+            {'p1': cate, 'p4': None})
+        self.assertEqual(M.GeoEntity.getPoiCategories(['p1', 'p2', 'p3',
+                                                       'p4']),
+                         {'p1': cate, 'p3': cate})
+        # venues without a category are retried later
+        self.assertIsNone(ndb.Key(M.PoiCategory, 'p4').get())
+        # resolved places stay out of the spatial index
+        self.assertEqual(M.GeoEntity.nearby(1.0, 2.0, 100), [])
+
+    def test_GeoEntity_nearby(self):
+        """ test_GeoEntity_nearby. """
+        M.GeoEntity(tfid='a', name='Cafe', geopt=ndb.GeoPt(40.7000, -74.0)).put()
+        M.GeoEntity(tfid='b', name='Bar', geopt=ndb.GeoPt(40.7005, -74.0)).put()
+        M.GeoEntity(tfid='c', name='Cafe', geopt=ndb.GeoPt(40.7100, -74.0)).put()
+        M.GeoEntity(tfid='d', name='Cafe').put()
+        self.assertEqual([e.tfid for _, e in M.GeoEntity.nearby(40.7, -74.0, 100)],
+                         ['a', 'b'])
+        self.assertEqual([e.tfid for _, e in
+                          M.GeoEntity.nearby(40.7, -74.0, 2000, name='cafe')],
+                         ['a', 'c'])
+
+    def test_ReferenceCache(self):
+        """ test_ReferenceCache. """
+        cache = M.ReferenceCache(size=2)
+        keys = [M.GeoEntity(tfid=str(i), name='n').put() for i in range(3)]
+        ents = cache.get_multi(keys[:2])
+        self.assertEqual([e.tfid for e in ents], ['0', '1'])
+        keys[0].delete()
+        self.assertIs(cache.get(keys[0]), ents[0])
+        cache.get(keys[2])
+        self.assertEqual(len(cache._entries), 2)  # pylint: disable=W0212
+        cache.invalidate()
+        self.assertIsNone(cache.get(keys[0]))
+        self.assertEqual(M.CacheGeneration.current(), 1)
+
+    def test_AnnotationTask_summary(self):
+        """ test_AnnotationTask_summary. """
+        rs = [M.ExpertiseRank(topic_id=t, rank_method=m,
+                              rank_info={'profile_type': 'p'})
+              for t, m in [('t1', 'm1'), ('t2', 'm2')]]
+        ndb.put_multi(rs)
+        task = M.AnnotationTask.fromRankings(rs, None)
+        task.put()
+        self.assertEqual(task.summary(), [('t1', 'm1', 'p'), ('t2', 'm2', 'p')])
+        self.assertEqual(M.AnnotationTask.query(
+            M.AnnotationTask.rank_methods == 'm2').count(), 1)
+        legacy = M.AnnotationTask(rankings=[r.key for r in rs])
+        self.assertFalse(legacy.hasSummary())
+        self.assertEqual(legacy.summary(), task.summary())
+        # may be shared through REFERENCE_CACHE, so not filled in place
+        self.assertFalse(legacy.hasSummary())
+
+    def test_TaskCoverage(self):
+        """ test_TaskCoverage. """
+        tkeys = [ndb.Key(M.AnnotationTask, i) for i in range(1, 4)]
+        ndb.put_multi(M.TaskCoverage.missing(tkeys))
+        self.assertEqual(M.TaskCoverage.incrementAsync(tkeys[0]).get_result(),
+                         1)
+        M.TaskCoverage.incrementAsync(tkeys[0]).get_result()
+        M.TaskCoverage.incrementAsync(tkeys[1]).get_result()
+        self.assertEqual(M.TaskCoverage.countsOf(tkeys),
+                         {tkeys[0]: 2, tkeys[1]: 1, tkeys[2]: 0})
+        self.assertEqual(M.TaskCoverage.missing(tkeys), [])
+        tp = M.TaskPackage(tasks=tkeys[:2], progress=tkeys[1:2])
+        tp.finish(M.AnnotationTask(key=tkeys[1]))
+        self.assertEqual(tp.coverage, 1)
+
+    def test_IndexEntry(self):
+        """ test_IndexEntry. """
+        from apps.profileviewer import invindex as I
+        ids = [3, 1, 2 ** 40, 7, 3]
+        self.assertEqual(I.decode_postings(I.encode_postings([1, 3, 7])),
+                         [1, 3, 7])
+        self.assertEqual(I.decode_postings(I.encode_postings([])), [])
+        size, I.SHARD_SIZE = I.SHARD_SIZE, 2
+        try:
+            shards = I.make_shards('topic:1', ids)
+        finally:
+            I.SHARD_SIZE = size
+        self.assertEqual([s.num for s in shards], [2, 2])
+        ndb.put_multi(shards + I.make_shards('region:x', [2, 3, 2 ** 40]))
+        self.assertEqual(I.lookup_async(['topic:1', 'nothing']).get_result(),
+                         {'topic:1': [1, 3, 7, 2 ** 40], 'nothing': []})
+        self.assertEqual(I.query_async([['topic:1'], ['region:x']])
+                         .get_result(), [3, 2 ** 40])
+        self.assertEqual(I.query_async([['topic:1', 'region:x']])
+                         .get_result(), [1, 2, 3, 7, 2 ** 40])
+        self.assertEqual(I.intersect([[1, 5, 9, 12], range(0, 100, 3)]),
+                         [9, 12])
+        self.assertEqual(I.gallop(range(0, 100, 2), 51, 3), 26)
+        # parts put one after another, the last one empty
+        ndb.put_multi(I.make_part('visited:y', [9, 4], 0, False))
+        ndb.put_multi(I.make_part('visited:y', [5, 1], 1, False))
+        ndb.put_multi(I.make_part('visited:y', [], 2, True))
+        self.assertEqual(I.IndexEntry.keyOf('visited:y').get().shards, 2)
+        self.assertEqual(I.lookup_async(['visited:y']).get_result(),
+                         {'visited:y': [1, 4, 5, 9]})
+
+    def test_CheckinProfile(self):
+        """ test_CheckinProfile. """
+        cate = {'id': 'c1', 'name': 'Cafe', 'zero_category': 'z1',
+                'zero_category_name': 'Food'}
+        p1 = {'id': 'p1', 'name': 'A', 'lat': 1.0, 'lng': 2.0,
+              'category': cate}
+        p2 = {'id': 'p2', 'name': 'B', 'lat': 3.0, 'lng': 4.0}
+        ta = M.TwitterAccount(screen_name='a', checkins=[
+            {'place': p2, 'created_at': 'Wed Aug 27 13:08:45 +0000 2008'},
+            {'place': p1, 'created_at': 'Sun Aug 31 09:00:00 +0000 2008'},
+            {'place': p1, 'created_at': '2008-09-01T23:10:00'},
+            {'place': None, 'created_at': '2008-09-01T23:10:00'}])
+        ta.put()
+        profile = M.CheckinProfile.getOrBuild(ta.key)
+        self.assertEqual(profile['num'], 3)
+        self.assertEqual([p['id'] for p in profile['pois']], ['p1', 'p2'])
+        # 2008-08-24 and 2008-08-31 are Sundays
+        self.assertEqual(profile['visits'], [[0, 14122, 2], [1, 14115, 1]])
+        self.assertEqual(profile['weekdays'], [1, 0, 1, 0, 0, 0, 1])
+        self.assertEqual([h for h, n in enumerate(profile['hours']) if n],
+                         [9, 13, 23])
+        self.assertEqual(profile['categories'], [['Cafe', 2], [None, 1]])
+        self.assertEqual(profile['zero_categories'], [['Food', 2], [None, 1]])
+        self.assertEqual(M.CheckinProfile.keyOf(ta.key).get().profile,
+                         profile)
+        self.assertIsNone(M.CheckinProfile.getOrBuild(
+            ndb.Key(M.TwitterAccount, 404)))
+
+        # refreshed only when the checkins changed
+        self.assertEqual(M.CheckinProfile.refresh([ta]), [])
+        ta.checkins = ta.checkins[:1]
+        ta.put()
+        self.assertEqual(M.CheckinProfile.refresh([ta]), [ta.key])
+        self.assertEqual(M.CheckinProfile.keyOf(ta.key).get().profile['num'],
+                         1)
+        self.assertEqual(M.CheckinProfile.refresh([ta]), [])
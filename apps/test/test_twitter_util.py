@@ -181,3 +181,192 @@ class TestTwitterUitl(unittest.TestCase):
         self.assertEqual(s['user']['screen_name'], "Morris_King")
         self.assertEqual(s['place']['category']['id'], "4bf58dd8d48988d124941735")
         self.assertEqual(s['place']['category']['zcategory'], "4d4b7105d754a06375d81259")
+
+
+class TestDatastoreCache(unittest.TestCase):
+
+    """ Test the two-tier cache for Twitter responses. """
+
+    def setUp(self):
+        from google.appengine.ext import testbed
+        self.testbed = testbed.Testbed()
+        self.testbed.setup_env(app_id='geo-expertise')
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def test_cacheable(self):
+        """ test_cacheable """
+        from apps.profileviewer.twitter_cache import DatastoreCache
+        self.assertTrue(DatastoreCache.cacheable(
+            '/1.1/statuses/user_timeline.json?user_id=1&count=200'))
+        self.assertFalse(DatastoreCache.cacheable(
+            '/1.1/account/verify_credentials.json'))
+        self.assertFalse(DatastoreCache.cacheable(
+            '/1.1/statuses/home_timeline.json?count=200'))
+
+    def test_store_get(self):
+        """ test_store_get """
+        from google.appengine.api import memcache
+        from apps.profileviewer.twitter_cache import DatastoreCache
+        url = '/1.1/users/show.json?user_id=%s'
+        cache = DatastoreCache(timeout=60)
+        cache.store(url % 1, {'id': 1})
+        cache.store(url % 2, {'id': 2})
+        self.assertEqual(cache.get(url % 1), {'id': 1})
+        memcache.flush_all()
+        self.assertEqual(cache.get_multi([url % 1, url % 2, url % 3]),
+                         {url % 1: {'id': 1}, url % 2: {'id': 2}})
+        self.assertEqual(cache.count(), 2)
+        report = cache.report()
+        self.assertEqual(report['memcache_hits'], 1)
+        self.assertEqual(report['datastore_hits'], 2)
+        self.assertEqual(report['misses'], 1)
+        cache.flush()
+        self.assertEqual(cache.count(), 0)
+        self.assertIsNone(cache.get(url % 1))
+
+    def test_volatile_timeout(self):
+        """ test_volatile_timeout """
+        import time
+        import mock
+        from apps.profileviewer import twitter_cache as C
+        timeline = '/1.1/statuses/user_timeline.json?user_id=1&count=200'
+        user = '/1.1/users/show.json?user_id=1'
+        cache = C.DatastoreCache(timeout=3600, volatile_timeout=60)
+        cache.store(timeline, [{'id': 1}])
+        cache.store(user, {'id': 1})
+        ent = C.CachedResponse.get_by_id(cache._id(timeline))
+        self.assertEqual(ent.expires_at - ent.created_at,
+                         C.timedelta(seconds=60))
+        later = time.time() + 120
+        with mock.patch.object(C.time, 'time', lambda: later):
+            self.assertIsNone(cache.get(timeline))
+            self.assertEqual(cache.get(user), {'id': 1})
+
+
+class TestPrefetchIterator(unittest.TestCase):
+
+    """ Test fetching pages ahead on a worker thread. """
+
+    class Pages(object):
+
+        """ A page iterator over a list of pages. """
+
+        def __init__(self, pages, error=None):
+            self.pages = list(pages)
+            self.error = error
+            self.fetched = 0
+
+        def next(self):
+            """ Return the next page or raise. """
+            if self.fetched == len(self.pages):
+                if self.error:
+                    raise self.error
+                raise StopIteration
+            self.fetched += 1
+            return self.pages[self.fetched - 1]
+
+    def test_order(self):
+        """ test_order """
+        from tweepy.cursor import PrefetchIterator, ItemIterator
+        pages = [[1, 2], [3], [4, 5, 6]]
+        self.assertEqual(list(PrefetchIterator(self.Pages(pages), 2)), pages)
+        self.assertEqual(
+            list(ItemIterator(PrefetchIterator(self.Pages(pages), 1))),
+            [1, 2, 3, 4, 5, 6])
+
+    def test_error(self):
+        """ test_error """
+        from tweepy.cursor import PrefetchIterator
+        from tweepy.error import TweepError
+        it = PrefetchIterator(self.Pages([[1]], TweepError('rate limit')))
+        self.assertEqual(it.next(), [1])
+        self.assertRaises(TweepError, it.next)
+        self.assertRaises(StopIteration, it.next)
+
+    def test_abandon(self):
+        """ test_abandon """
+        import gc
+        from tweepy.cursor import PrefetchIterator
+        pages = self.Pages([[i] for i in range(100)])
+        it = PrefetchIterator(pages, 1)
+        for page in it:
+            if page == [0]:
+                break
+        worker = it._worker  # pylint: disable=W0212
+        del it
+        gc.collect()
+        worker.join(1.0)
+        self.assertFalse(worker.is_alive())
+        # the page taken and the ones queued or in flight at most
+        self.assertLessEqual(pages.fetched, 3)
+
+        it = PrefetchIterator(self.Pages([[i] for i in range(100)]), 1)
+        it.close()
+        it._worker.join(1.0)  # pylint: disable=W0212
+        self.assertFalse(it._worker.is_alive())  # pylint: disable=W0212
+        self.assertRaises(StopIteration, it.next)
+
+
+class TestCheckinListener(unittest.TestCase):
+
+    """ Test buffering and flushing checkins from a stream. """
+
+    def setUp(self):
+        from google.appengine.ext import testbed
+        self.testbed = testbed.Testbed()
+        self.testbed.setup_env(app_id='geo-expertise')
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+        self.testbed.init_datastore_v3_stub()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    @staticmethod
+    def tweet(tid, uid, place=True):
+        """ Return a raw tweet as received from the stream. """
+        return json.dumps({
+            'id': tid, 'text': 'I am at somewhere', 'created_at': '',
+            'retweeted': False, 'retweet_count': 0, 'favorited': False,
+            'favorite_count': 0, 'in_reply_to_status_id': None,
+            'in_reply_to_screen_name': None, 'in_reply_to_user_id': None,
+            'user': {'id': uid, 'screen_name': 'user%s' % uid},
+            'place': {'place_type': 'poi', 'name': 'P', 'full_name': 'P',
+                      'id': 'p%s' % tid,
+                      'bounding_box': {'coordinates': [[[1.0, 2.0]]]}}
+                     if place else None})
+
+    def test_flush_on_size(self):
+        """ test_flush_on_size """
+        from apps.profileviewer.models import TwitterAccount
+        from apps.profileviewer.checkin_stream import CheckinListener
+        TwitterAccount(screen_name='user1', twitter_id=1,
+                       checkins=[{'id': 1}]).put()
+        listener = CheckinListener(batch_size=3, flush_interval=3600)
+        listener.on_data(self.tweet(1, 1))
+        listener.on_data(self.tweet(2, 1))
+        listener.on_data(self.tweet(3, 1, place=False))
+        self.assertEqual(listener.stats['flushes'], 0)
+        listener.on_data(self.tweet(4, 2))
+        self.assertEqual(listener.stats['flushes'], 1)
+        self.assertEqual(
+            [c['id'] for c in TwitterAccount.getByScreenName('user1').checkins],
+            [1, 2])
+        self.assertEqual(TwitterAccount.query().count(), 1)
+
+    def test_create_accounts(self):
+        """ test_create_accounts """
+        from apps.profileviewer.models import TwitterAccount
+        from apps.profileviewer.checkin_stream import CheckinListener
+        flushed = []
+        listener = CheckinListener(create_accounts=True,
+                                   on_flush=flushed.extend)
+        listener.on_data(self.tweet(1, 5))
+        self.assertEqual(listener.flush(), 1)
+        self.assertEqual(TwitterAccount.getByScreenName('user5').twitter_id, 5)
+        self.assertEqual([ta.twitter_id for ta in flushed], [5])
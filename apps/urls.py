@@ -29,6 +29,7 @@ urlpatterns = patterns(
         'apps.profileviewer.api.data.call_endpoint'),
     url(r'^api/taskworker/([a-zA-Z_]+).*$',
         'apps.profileviewer.api.taskworker.call_endpoint'),
+    url(r'^api/batch$', 'apps.profileviewer.api.batch.call_batch'),
 
     # Static pages
     url(r'^survey$', TemplateView.as_view(template_name="survey.html")),
@@ -13,11 +13,9 @@ function _profileviewer(d3, crossfilter, dc, GMaps, $){
   //var map_infowindow = new google.maps.InfoWindow({
     //maxWidth: 300
   //});
-  var _data;
-  var _created_at;
+  var _data; // visits of places per week, see profiles.py
+  var _DAY = 864e5; // milliseconds
 
-  //var time_parser = d3.time.format.utc("%a %b %d %H:%M:%S +0000 %Y").parse;
-  var time_parser = function(d){return new Date(d);};
   var _chartTypeMap;
   var _allpois;
   var _filter_set;
@@ -76,8 +74,7 @@ function _profileviewer(d3, crossfilter, dc, GMaps, $){
     _fact = crossfilter(_data);
 
     var by_week = _fact.dimension(function(c){
-      //return year_month(c.created_at);
-      return d3.time.week(c.created_at);
+      return c.week;
     });
     var by_category = _fact.dimension(function(c){
       return c.place.category.name;
@@ -86,9 +83,6 @@ function _profileviewer(d3, crossfilter, dc, GMaps, $){
       return c.place.category.zero_category_name;
     });
     var by_poi = _fact.dimension(function(c){
-      c.place.valueOf = function(){
-        return c.place.id;
-      };
       return c.place;
     });
     var by_region = _fact.dimension(function(c){
@@ -100,13 +94,13 @@ function _profileviewer(d3, crossfilter, dc, GMaps, $){
       }
       return "Other";
     });
-    _created_at = _fact.dimension(function(c){return c.created_at;}); // for checkin exporting
 
-    var checkins_by_week = by_week.group().reduceCount();
-    var checkins_by_category = by_category.group().reduceCount();
-    var checkins_by_zcate = by_zcate.group().reduceCount();
-    var checkins_by_poi = by_poi.group().reduceCount();
-    var checkins_by_region = by_region.group().reduceCount();
+    function count(c){ return c.count; }
+    var checkins_by_week = by_week.group().reduceSum(count);
+    var checkins_by_category = by_category.group().reduceSum(count);
+    var checkins_by_zcate = by_zcate.group().reduceSum(count);
+    var checkins_by_poi = by_poi.group().reduceSum(count);
+    var checkins_by_region = by_region.group().reduceSum(count);
     _allpois = checkins_by_poi.all();
 
     function patchGrouper(_chart, excludes){
@@ -288,15 +282,24 @@ function _profileviewer(d3, crossfilter, dc, GMaps, $){
   function initCharts (hash_id, filter_set) {
     _filter_set = filter_set;
     d3.json(
-      "/api/data/checkins?candidate=" + hash_id,
+      "/api/data/checkin_profile?candidate=" + hash_id,
       function(err, json){
         if (err){
           throw "Fail to get data for " + hash_id;
         }
         else{
-          _data = json;
-          _data.forEach(function (c){
-            c.created_at = time_parser(c.created_at);
+          json.pois.forEach(function (p){
+            p.valueOf = function(){
+              return p.id;
+            };
+          });
+          // visits are [poi, the days since epoch of the week, checkins]
+          _data = json.visits.map(function (v){
+            return {
+              place: json.pois[v[0]],
+              week: new Date(v[1] * _DAY),
+              count: v[2]
+            };
           });
           render_charts();
         }
@@ -337,15 +340,10 @@ function _profileviewer(d3, crossfilter, dc, GMaps, $){
     dc.redrawAll();
   }
 
-  function filteredRecentCheckins(k){
-    return _created_at.top(k);
-  }
-
   return {
     initCharts: initCharts,
     focusTopic: focusTopic,
-    unfocus: unfocus,
-    filteredRecentCheckins: filteredRecentCheckins
+    unfocus: unfocus
   };
 }
 
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Benchmarking tweepy FileCache.
+
+File: bench_filecache.py
+Author: SpaceLis
+Email: Wen.Li@tudelft.nl
+GitHub: http://github.com/spacelis
+Description:
+    Store, read, count and clean up cached timeline pages in a FileCache.
+    Usage: python test/bench_filecache.py [pages] [--compress]
+
+"""
+
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, '.')
+
+from tweepy.cache import FileCache  # pylint: disable=wrong-import-position
+
+
+def timeline_page(i, size=200):
+    """ Return a fake timeline page similar to a parsed user_timeline. """
+    return [{'id': i * size + j,
+             'text': 'Checking in at some place #%s' % (j, ),
+             'place': {'id': '%016x' % (j, ), 'name': 'Place %s' % (j, )}}
+            for j in range(size)]
+
+
+def timed(label, func, num):
+    """ Run func and report the throughput. """
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print '%-10s %8.2fs %10.1f ops/s' % (label, elapsed, num / elapsed)
+
+
+def main(pages=100000, compress=False):
+    """ Run the benchmark with the given number of pages. """
+    cache_dir = tempfile.mkdtemp(prefix='bench-filecache-')
+    try:
+        cache = FileCache(cache_dir, timeout=3600, compress=compress)
+        page = timeline_page(0)
+        urls = ['/1.1/statuses/user_timeline.json?user_id=%s&count=200' % i
+                for i in range(pages)]
+
+        def store():
+            """ store all pages """
+            for url in urls:
+                cache.store(url, page)
+
+        def get():
+            """ get all pages """
+            for url in urls:
+                cache.get(url)
+
+        timed('store', store, pages)
+        timed('get', get, pages)
+        timed('count', cache.count, pages)
+        timed('cleanup', cache.cleanup, pages)
+        timed('flush', cache.flush, pages)
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    ARGS = [a for a in sys.argv[1:] if not a.startswith('--')]
+    main(int(ARGS[0]) if ARGS else 100000, '--compress' in sys.argv)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Benchmarking the geohash spatial index.
+
+File: bench_geohash.py
+Author: SpaceLis
+Email: Wen.Li@tudelft.nl
+GitHub: http://github.com/spacelis
+Description:
+    Index synthetic POIs by geohash and answer nearby queries the way the
+    datastore does, by scanning a sorted index for the covering cells.
+    Usage: python test/bench_geohash.py [pois] [queries] [radius]
+
+"""
+
+import sys
+import time
+import random
+from bisect import bisect_left
+
+sys.path.insert(0, '.')
+
+# pylint: disable=wrong-import-position
+from apps.profileviewer import geohash
+
+# Bounding boxes of the regions POIs are drawn from
+REGIONS = [(41.64, -87.94, 42.02, -87.52),
+           (40.48, -74.26, 40.92, -73.70),
+           (33.70, -118.67, 34.34, -118.16),
+           (37.70, -122.52, 37.83, -122.35)]
+
+
+def synthetic_pois(num):
+    """ Return num random points within REGIONS. """
+    rnd = random.Random(1)
+    pois = []
+    for _ in range(num):
+        s, w, n, e = rnd.choice(REGIONS)
+        pois.append((rnd.uniform(s, n), rnd.uniform(w, e)))
+    return pois
+
+
+def main(num=1000000, queries=10000, radius=100):
+    """ Run the benchmark. """
+    pois = synthetic_pois(num)
+
+    start = time.time()
+    index = sorted((geohash.encode(lat, lng), i)
+                   for i, (lat, lng) in enumerate(pois))
+    hashes = [h for h, _ in index]
+    elapsed = time.time() - start
+    print 'index     %8d pois    %8.2fs %10.1f pois/s' % (num, elapsed,
+                                                         num / elapsed)
+
+    rnd = random.Random(2)
+    centers = [pois[rnd.randrange(num)] for _ in range(queries)]
+    scanned = found = 0
+    start = time.time()
+    for lat, lng in centers:
+        for cell in geohash.covering(lat, lng, radius):
+            i = bisect_left(hashes, cell)
+            while i < num and hashes[i].startswith(cell):
+                plat, plng = pois[index[i][1]]
+                scanned += 1
+                if geohash.distance(lat, lng, plat, plng) <= radius:
+                    found += 1
+                i += 1
+    elapsed = time.time() - start
+    print 'nearby    %8d queries %8.2fs %10.1f queries/s' % (
+        queries, elapsed, queries / elapsed)
+    print '          %.1f candidates and %.1f matches per query' % (
+        float(scanned) / queries, float(found) / queries)
+
+    sample = centers[:max(1, queries // 1000)]
+    start = time.time()
+    for lat, lng in sample:
+        for plat, plng in pois:
+            geohash.distance(lat, lng, plat, plng)
+    elapsed = time.time() - start
+    print 'full scan %8d queries %8.2fs %10.1f queries/s' % (
+        len(sample), elapsed, len(sample) / elapsed)
+
+
+if __name__ == '__main__':
+    main(*[t(a) for t, a in zip((int, int, float), sys.argv[1:])])
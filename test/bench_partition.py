@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Benchmarking partition against the fn.Stream version it replaced.
+
+File: bench_partition.py
+Author: SpaceLis
+Email: Wen.Li@tudelft.nl
+GitHub: http://github.com/spacelis
+Description:
+    Partition synthetic keys into packages of 10 and report the throughput
+    and the peak memory of the process.
+    Usage: python test/bench_partition.py [keys]
+
+"""
+
+import sys
+import time
+import resource
+from itertools import groupby
+from itertools import cycle
+from itertools import izip
+
+sys.path.insert(0, '.')
+
+# pylint: disable=wrong-import-position
+from fn import Stream
+from fn import _ as L
+from fn.iters import drop
+from fn.uniform import zip_longest
+from fn.uniform import map  # pylint: disable=redefined-builtin
+
+from apps.profileviewer.util import partition
+
+
+def legacy_partition(iterator, size=10, margin=None):
+    """ The partition in api/data.py before the linear chunker. """
+    margin = margin if margin else int(1.5 * size)
+    grps = Stream() << map(
+        (lambda x: [i[1] for i in x]),
+        map(L[1],
+            Stream() <<
+            groupby(izip(cycle([0] * size + [1] * size), iterator),
+                    key=L[0])))
+    for nex, cur in zip_longest(drop(1, grps), grps):
+        if nex and len(cur + nex) <= margin:
+            yield cur + nex
+            return
+        else:
+            yield cur
+
+
+def keys(num):
+    """ Yield num urlsafe-like keys without materialising them. """
+    for i in xrange(num):
+        yield 'ahBzfmdlby1leHBlcnRpc2VyFAsSDkFubm90YXRpb25UYXNr%08d' % i
+
+
+def bench(name, fn, num):
+    """ Time partitioning num keys and check the sizes of the groups. """
+    start = time.time()
+    groups = cnt = 0
+    for grp in fn(keys(num), 10):
+        groups += 1
+        cnt += len(grp)
+    elapsed = time.time() - start
+    assert cnt == num
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print '%-8s %8d keys %7d groups %6.2fs %10.0f keys/s peak %.0fMB' % (
+        name, num, groups, elapsed, num / elapsed, peak)
+
+
+def main():
+    """ Run the benchmark, the new version first as peak RSS only grows. """
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 10 ** 6
+    for n in (0, 7, 995, 1003, 1006):
+        assert list(partition(keys(n), 10)) == \
+            list(legacy_partition(keys(n), 10))
+    bench('linear', partition, num)
+    bench('stream', legacy_partition, num)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Benchmarking the full-text search of candidates.
+
+File: bench_search.py
+Author: SpaceLis
+Email: Wen.Li@tudelft.nl
+GitHub: http://github.com/spacelis
+Description:
+    Index synthetic candidates into the local search stub of the SDK, in
+    batches of search.BATCH_SIZE and one document per put, then run
+    text, faceted and geo queries against it.
+    Usage: python test/bench_search.py [candidates] [checkins] [queries]
+    The App Engine SDK should be on the PYTHONPATH.
+
+"""
+
+import sys
+import time
+import random
+
+sys.path.insert(0, '.')
+
+# pylint: disable=wrong-import-position
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from apps.profileviewer import search
+from apps.profileviewer.models import TwitterAccount
+from apps.profileviewer.checkin_stream import REGIONS
+
+WORDS = ['coffee', 'lunch', 'park', 'museum', 'gym', 'bar', 'pizza',
+         'beach', 'concert', 'library', 'airport', 'office']
+CATEGORIES = ['Cafe', 'Food', 'Outdoors', 'Arts', 'Nightlife', 'Travel']
+
+
+def synthetic_accounts(num, checkins):
+    """ Return num TwitterAccounts with checkins in REGIONS. """
+    rnd = random.Random(1)
+    regions = REGIONS.values()
+    accounts = []
+    for i in range(num):
+        w, s, e, n = rnd.choice(regions)
+        cks = []
+        for _ in range(checkins):
+            word = rnd.choice(WORDS)
+            cks.append({'text': 'I am at the %s' % (word, ),
+                        'place': {'name': '%s %d' % (word, rnd.randrange(50)),
+                                  'full_name': None,
+                                  'category': {
+                                      'name': rnd.choice(CATEGORIES)},
+                                  'lat': rnd.uniform(s, n),
+                                  'lng': rnd.uniform(w, e)}})
+        accounts.append(TwitterAccount(key=ndb.Key(TwitterAccount, i + 1),
+                                       screen_name='user%d' % (i, ),
+                                       checkins=cks))
+    return accounts
+
+
+def timed(label, func, num, unit):
+    """ Run func and report the throughput. """
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print '%-12s %8d %-8s %8.2fs %10.1f %s/s' % (label, num, unit, elapsed,
+                                                  num / elapsed, unit)
+
+
+def main(num=2000, checkins=20, queries=200):
+    """ Run the benchmark. """
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub()
+    tb.init_memcache_stub()
+    tb.init_search_stub()
+    accounts = synthetic_accounts(num, checkins)
+
+    timed('documents', lambda: [search.make_document(a) for a in accounts],
+          num, 'docs')
+    timed('put batched', lambda: search.build_index(accounts), num, 'docs')
+    batch_size, search.BATCH_SIZE = search.BATCH_SIZE, 1
+    timed('put singly', lambda: search.build_index(accounts), num, 'docs')
+    search.BATCH_SIZE = batch_size
+
+    rnd = random.Random(2)
+    words = [rnd.choice(WORDS) for _ in range(queries)]
+    timed('text', lambda: [search.search_index(w) for w in words],
+          queries, 'queries')
+    timed('faceted', lambda: [
+        search.search_index(w, {'category': rnd.choice(CATEGORIES),
+                                'region': rnd.choice(REGIONS.keys())})
+        for w in words], queries, 'queries')
+    timed('near', lambda: [
+        search.search_index(w, near=(41.88, -87.63, 5000)) for w in words],
+          queries, 'queries')
+    found = search.search_index('coffee')
+    print '%d of %d candidates match coffee, regions: %s' % (
+        found['num'], num, sorted(found['facets'].get('region', [])))
+    tb.deactivate()
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Benchmarking json serialisation of the largest checkins payloads.
+
+File: bench_serializer.py
+Author: SpaceLis
+Email: Wen.Li@tudelft.nl
+GitHub: http://github.com/spacelis
+Description:
+    Serialise the checkins of a user with a full timeline (3200 tweets,
+    the most Twitter returns) the way the checkins endpoint did and does,
+    and encode a user payload with and without base64.
+    Usage: python test/bench_serializer.py [checkins] [rounds]
+
+"""
+
+import sys
+import time
+import json
+import base64
+import random
+
+sys.path.insert(0, '.')
+
+# pylint: disable=wrong-import-position
+from apps.profileviewer import serializer
+
+
+def synthetic_checkins(num):
+    """ Return num checkins shaped like twitter_util.strip_checkin(). """
+    rnd = random.Random(1)
+    words = [u'coffee', u'caf\xe9', u'@home', u'<3', u'park', u'#chicago',
+             u'http://4sq.com/x', u'museum', u'pizza', u'&more']
+    return [{
+        'created_at': 'Mon Sep 24 03:35:21 +0000 2013',
+        'retweeted': False,
+        'retweet_count': rnd.randint(0, 5),
+        'in_reply_to_status_id': None,
+        'in_reply_to_screen_name': None,
+        'in_reply_to_user_id': None,
+        'favorited': False,
+        'favorite_count': rnd.randint(0, 5),
+        'id': 380000000000000000 + i,
+        'text': u' '.join(rnd.choice(words) for _ in range(14)),
+        'place': {
+            'place_type': 'poi',
+            'lng': rnd.uniform(-87.94, -87.52),
+            'lat': rnd.uniform(41.64, 42.02),
+            'name': u'Place %d' % rnd.randint(0, 500),
+            'full_name': u'Place, Chicago',
+            'id': '%016x' % rnd.getrandbits(64),
+            'category': None,
+        },
+        'user': {'id': 12345678, 'screen_name': 'someone'}
+    } for i in range(num)]
+
+
+def bench(name, fn, obj, rounds):
+    """ Time fn(obj) and report the throughput. """
+    start = time.time()
+    for _ in range(rounds):
+        out = fn(obj)
+    elapsed = time.time() - start
+    print '%-22s %8.2fms/call %9d bytes' % (name, elapsed / rounds * 1000,
+                                             len(out))
+    return out
+
+
+def main():
+    """ Run the benchmark. """
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 3200
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    checkins = synthetic_checkins(num)
+    print 'encoders:', ', '.join(n for n, _ in serializer.ENCODERS), \
+        '- in use:', serializer.current()
+    ref = json.loads(bench('json.dumps', json.dumps, checkins, rounds))
+    out = bench('serializer.dumps', serializer.dumps, checkins, rounds)
+    assert json.loads(out) == ref
+    bench('json + base64', lambda o: base64.b64encode(json.dumps(o)),
+          checkins, rounds)
+    out = bench('serializer.js_literal', serializer.js_literal,
+                checkins, rounds)
+    assert json.loads(out) == ref
+
+
+if __name__ == '__main__':
+    main()
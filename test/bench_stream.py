@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Benchmarking the tweepy Stream reader.
+
+File: bench_stream.py
+Author: SpaceLis
+Email: Wen.Li@tudelft.nl
+GitHub: http://github.com/spacelis
+Description:
+    Replay a length-delimited stream through a local HTTP server and
+    measure how fast Stream reads it.
+    Usage: python test/bench_stream.py [recorded_stream] [messages]
+    Without a recorded stream, synthetic statuses are generated.
+
+"""
+
+import sys
+import json
+import time
+import threading
+import BaseHTTPServer
+
+sys.path.insert(0, '.')
+
+# pylint: disable=wrong-import-position
+from tweepy.streaming import Stream
+from tweepy.streaming import StreamListener
+
+
+def synthetic_stream(num):
+    """ Return a length-delimited stream of num fake statuses. """
+    parts = []
+    for i in range(num):
+        status = json.dumps({'id': i,
+                             'text': 'I am at Some Place #%s' % (i, ),
+                             'in_reply_to_status_id': None,
+                             'user': {'id': i % 1000,
+                                      'screen_name': 'user%s' % (i % 1000)},
+                             'place': {'id': '%016x' % (i % 5000, )}})
+        parts.append('%s\r\n%s' % (len(status), status))
+        if i % 100 == 0:
+            parts.append('\r\n')  # keep-alive
+    return ''.join(parts)
+
+
+def replay_server(payload):
+    """ Start a local server sending payload in one chunk per message. """
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+        """ Reply every POST with the recorded stream. """
+
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            """ Send the payload chunked. """
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            step = 64 * 1024
+            for i in range(0, len(payload), step):
+                chunk = payload[i:i + step]
+                self.wfile.write('%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write('0\r\n\r\n')
+            self.close_connection = 1
+
+        def log_message(self, *args):
+            """ Keep quiet. """
+            pass
+
+    server = BaseHTTPServer.HTTPServer(('localhost', 0), Handler)
+    thread = threading.Thread(target=server.handle_request)
+    thread.daemon = True
+    thread.start()
+    return 'localhost:%s' % (server.server_address[1], )
+
+
+class NoAuth(object):
+
+    """ An auth handler doing nothing. """
+
+    def apply_auth(self, *args):
+        """ Nothing to apply. """
+        pass
+
+
+class CountingListener(StreamListener):
+
+    """ Count the messages and bytes received. """
+
+    def __init__(self, expected, parse):
+        super(CountingListener, self).__init__()
+        self.expected = expected
+        self.parse = parse
+        self.messages = 0
+        self.size = 0
+
+    def on_data(self, raw_data):
+        self.messages += 1
+        self.size += len(raw_data)
+        if self.parse:
+            json.loads(raw_data)
+        return self.messages < self.expected
+
+
+class LegacyStream(Stream):
+
+    """ Stream reading the length prefix byte by byte as before. """
+
+    def _read_loop(self, resp):
+        while self.running and not resp.isclosed():
+            c = '\n'
+            while c == '\n' and self.running and not resp.isclosed():
+                c = resp.read(1)
+            delimited_string = c
+            d = ''
+            while d != '\n' and self.running and not resp.isclosed():
+                d = resp.read(1)
+                delimited_string += d
+            if delimited_string.strip().isdigit():
+                self._data(resp.read(int(delimited_string)))
+
+
+def run(stream_cls, payload, expected, parse, **options):
+    """ Run one stream over the payload and report the throughput. """
+    listener = CountingListener(expected, parse)
+    stream = stream_cls(NoAuth(), listener, secure=False, **options)
+    stream.host = replay_server(payload)
+    start = time.time()
+    stream.filter(locations=[-180, -90, 180, 90])
+    elapsed = time.time() - start
+    print '%-40s %8d msgs %8.2fs %10.1f msgs/s %8.2f MB/s' % (
+        stream_cls.__name__ + ' ' + ','.join('%s=%s' % kv
+                                             for kv in options.items()),
+        listener.messages, elapsed, listener.messages / elapsed,
+        listener.size / elapsed / 1e6)
+
+
+def main():
+    """ Run the benchmark. """
+    if len(sys.argv) > 1 and not sys.argv[1].isdigit():
+        with open(sys.argv[1]) as fin:
+            payload = fin.read()
+        expected = int(sys.argv[2]) if len(sys.argv) > 2 else sys.maxint
+    else:
+        expected = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+        payload = synthetic_stream(expected)
+    for parse in (False, True):
+        print 'json parsing' if parse else 'raw delivery'
+        run(LegacyStream, payload, expected, parse)
+        run(Stream, payload, expected, parse)
+        run(Stream, payload, expected, parse, buffer_size=16384)
+        if not parse:
+            run(Stream, payload, expected, parse, buffer_size=16384,
+                zero_copy=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,8 @@ import time
 import datetime
 import threading
 import os
+import tempfile
+import zlib
 
 try:
     import cPickle as pickle
@@ -18,13 +20,6 @@ except ImportError:
     # python 2.4
     import md5 as hashlib
 
-try:
-    import fcntl
-except ImportError:
-    # Probably on a windows system
-    # TODO: use win32file
-    pass
-
 
 class Cache(object):
     """Cache interface"""
@@ -132,89 +127,97 @@ class MemoryCache(Cache):
 
 
 class FileCache(Cache):
-    """File-based cache"""
+    """File-based cache
 
-    # locks used to make cache thread-safe
-    cache_locks = {}
+    Entries are spread over two levels of hashed subdirectories so that no
+    single directory grows too large. Each entry is written to a temporary
+    file and renamed into place, so readers never see a partial write and
+    no lock files are needed. The modification time of an entry file is its
+    creation time, which lets cleanup() expire entries without unpickling.
+    """
 
-    def __init__(self, cache_dir, timeout=60):
+    TEMP_PREFIX = '.tmp-'
+    FLAG_PLAIN = 'p'
+    FLAG_ZLIB = 'z'
+
+    def __init__(self, cache_dir, timeout=60, compress=False):
         Cache.__init__(self, timeout)
         if os.path.exists(cache_dir) is False:
             os.mkdir(cache_dir)
         self.cache_dir = cache_dir
-        if cache_dir in FileCache.cache_locks:
-            self.lock = FileCache.cache_locks[cache_dir]
-        else:
-            self.lock = threading.Lock()
-            FileCache.cache_locks[cache_dir] = self.lock
-
-        if os.name == 'posix':
-            self._lock_file = self._lock_file_posix
-            self._unlock_file = self._unlock_file_posix
-        elif os.name == 'nt':
-            self._lock_file = self._lock_file_win32
-            self._unlock_file = self._unlock_file_win32
-        else:
-            print 'Warning! FileCache locking not supported on this system!'
-            self._lock_file = self._lock_file_dummy
-            self._unlock_file = self._unlock_file_dummy
+        self.compress = compress
 
     def _get_path(self, key):
         md5 = hashlib.md5()
         md5.update(key)
-        return os.path.join(self.cache_dir, md5.hexdigest())
-
-    def _lock_file_dummy(self, path, exclusive=True):
-        return None
-
-    def _unlock_file_dummy(self, lock):
-        return
-
-    def _lock_file_posix(self, path, exclusive=True):
-        lock_path = path + '.lock'
-        if exclusive is True:
-            f_lock = open(lock_path, 'w')
-            fcntl.lockf(f_lock, fcntl.LOCK_EX)
-        else:
-            f_lock = open(lock_path, 'r')
-            fcntl.lockf(f_lock, fcntl.LOCK_SH)
-        if os.path.exists(lock_path) is False:
-            f_lock.close()
-            return None
-        return f_lock
+        digest = md5.hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest[2:4], digest)
 
-    def _unlock_file_posix(self, lock):
-        lock.close()
-
-    def _lock_file_win32(self, path, exclusive=True):
-        # TODO: implement
-        return None
-
-    def _unlock_file_win32(self, lock):
-        # TODO: implement
-        return
+    def _iter_paths(self):
+        for shard in os.listdir(self.cache_dir):
+            shard_dir = os.path.join(self.cache_dir, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for subshard in os.listdir(shard_dir):
+                subshard_dir = os.path.join(shard_dir, subshard)
+                if not os.path.isdir(subshard_dir):
+                    continue
+                for entry in os.listdir(subshard_dir):
+                    if entry.startswith(FileCache.TEMP_PREFIX):
+                        continue
+                    yield os.path.join(subshard_dir, entry)
+
+    def _is_expired(self, path, timeout):
+        if timeout is None:
+            timeout = self.timeout
+        try:
+            return timeout > 0 and \
+                (time.time() - os.path.getmtime(path)) >= timeout
+        except OSError:
+            # removed by someone else, treat as expired
+            return True
 
     def _delete_file(self, path):
-        os.remove(path)
-        if os.path.exists(path + '.lock'):
-            os.remove(path + '.lock')
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _dumps(self, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if self.compress:
+            return FileCache.FLAG_ZLIB + zlib.compress(data)
+        return FileCache.FLAG_PLAIN + data
+
+    @staticmethod
+    def _loads(data):
+        if data[:1] == FileCache.FLAG_ZLIB:
+            return pickle.loads(zlib.decompress(data[1:]))
+        return pickle.loads(data[1:])
 
     def store(self, key, value):
         path = self._get_path(key)
-        self.lock.acquire()
+        entry_dir = os.path.dirname(path)
+        if os.path.exists(entry_dir) is False:
+            try:
+                os.makedirs(entry_dir)
+            except OSError:
+                # created concurrently
+                pass
+
+        # write to a temporary file and rename it into place
+        fd, tmp_path = tempfile.mkstemp(prefix=FileCache.TEMP_PREFIX,
+                                        dir=entry_dir)
         try:
-            # acquire lock and open file
-            f_lock = self._lock_file(path)
-            datafile = open(path, 'wb')
-
-            # write data
-            pickle.dump((time.time(), value), datafile)
-
-            # close and unlock file
-            datafile.close()
-            self._unlock_file(f_lock)
-        finally:
-            self.lock.release()
+            with os.fdopen(fd, 'wb') as datafile:
+                datafile.write(self._dumps(value))
+            if os.name == 'nt' and os.path.exists(path):
+                # rename does not replace existing files on windows
+                self._delete_file(path)
+            os.rename(tmp_path, path)
+        except Exception:
+            self._delete_file(tmp_path)
+            raise
 
     def get(self, key, timeout=None):
         return self._get(self._get_path(key), timeout)
@@ -223,49 +226,31 @@ class FileCache(Cache):
         if os.path.exists(path) is False:
             # no record
             return None
-        self.lock.acquire()
+        if self._is_expired(path, timeout):
+            # expired! delete from cache
+            self._delete_file(path)
+            return None
         try:
-            # acquire lock and open
-            f_lock = self._lock_file(path, False)
-            datafile = open(path, 'rb')
-
-            # read pickled object
-            created_time, value = pickle.load(datafile)
-            datafile.close()
-
-            # check if value is expired
-            if timeout is None:
-                timeout = self.timeout
-            if timeout > 0 and (time.time() - created_time) >= timeout:
-                # expired! delete from cache
-                value = None
-                self._delete_file(path)
-
-            # unlock and return result
-            self._unlock_file(f_lock)
-            return value
-        finally:
-            self.lock.release()
+            with open(path, 'rb') as datafile:
+                return self._loads(datafile.read())
+        except IOError:
+            # removed between the expiry check and the read
+            return None
 
     def count(self):
         c = 0
-        for entry in os.listdir(self.cache_dir):
-            if entry.endswith('.lock'):
-                continue
+        for _ in self._iter_paths():
             c += 1
         return c
 
     def cleanup(self):
-        for entry in os.listdir(self.cache_dir):
-            if entry.endswith('.lock'):
-                continue
-            self._get(os.path.join(self.cache_dir, entry), None)
+        for path in self._iter_paths():
+            if self._is_expired(path, None):
+                self._delete_file(path)
 
     def flush(self):
-        for entry in os.listdir(self.cache_dir):
-            if entry.endswith('.lock'):
-                continue
-            self._delete_file(os.path.join(self.cache_dir, entry))
+        for path in self._iter_paths():
+            self._delete_file(path)
 
 class MemCacheCache(Cache):
     """Cache interface"""
@@ -2,6 +2,11 @@
 # Copyright 2009-2010 Joshua Roesslein
 # See LICENSE for details.
 
+import sys
+import threading
+import weakref
+from Queue import Queue, Full
+
 from tweepy.error import TweepError
 
 class Cursor(object):
@@ -20,15 +25,21 @@ class Cursor(object):
         else:
             raise TweepError('This method does not perform pagination')
 
-    def pages(self, limit=0):
-        """Return iterator for pages"""
+    def pages(self, limit=0, prefetch=0):
+        """Return iterator for pages
+
+        If prefetch > 0, up to that many pages are fetched ahead
+        on a worker thread while the current page is processed.
+        """
         if limit > 0:
             self.iterator.limit = limit
+        if prefetch > 0:
+            return PrefetchIterator(self.iterator, prefetch)
         return self.iterator
 
-    def items(self, limit=0):
+    def items(self, limit=0, prefetch=0):
         """Return iterator for items in each page"""
-        i = ItemIterator(self.iterator)
+        i = ItemIterator(self.pages(prefetch=prefetch))
         i.limit = limit
         return i
 
@@ -136,6 +147,79 @@ class PageIterator(BaseIterator):
         self.current_page -= 1
         return self.method(page=self.current_page, *self.args, **self.kargs)
 
+class PrefetchIterator(BaseIterator):
+    """Fetch pages of another page iterator ahead on a worker thread
+
+    At most `depth` pages are held in the queue, the worker blocks
+    until the consumer takes one (backpressure). Errors raised while
+    fetching are re-raised by next() in the consumer's thread.
+
+    The worker holds no reference to the PrefetchIterator, so one
+    dropped without close(), e.g. on an early break, is collected and
+    the worker stops within _POLL seconds of a blocked put.
+    """
+
+    _END = object()
+    _POLL = 0.1
+
+    def __init__(self, page_iterator, depth=1):
+        self.page_iterator = page_iterator
+        self.limit = 0
+        self._queue = Queue(maxsize=depth)
+        self._stopped = threading.Event()
+        self._done = False
+        # set when the iterator is collected, the ref lives in the worker
+        owner = weakref.ref(self, lambda _, stopped=self._stopped: stopped.set())
+        self._worker = threading.Thread(
+            target=_prefetch,
+            args=(owner, page_iterator, self._queue, self._stopped, self._END,
+                  self._POLL))
+        self._worker.daemon = True
+        self._worker.start()
+
+    def next(self):
+        if self._done:
+            raise StopIteration
+        page, exc_info = self._queue.get()
+        if page is self._END:
+            self._done = True
+            if exc_info:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            raise StopIteration
+        return page
+
+    def prev(self):
+        raise TweepError('Can not page back with prefetching')
+
+    def close(self):
+        """Stop fetching ahead, pages in flight are discarded"""
+        self._stopped.set()
+        self._done = True
+
+def _prefetch(owner, page_iterator, queue, stopped, end, poll):
+    """Worker of PrefetchIterator
+
+    owner is the weakref to the iterator, held here so that its callback
+    stops the worker when the iterator is collected.
+    """
+    def put(item):
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=poll)
+                return True
+            except Full:
+                continue
+        return False
+
+    try:
+        while not stopped.is_set():
+            if not put((page_iterator.next(), None)):
+                return
+    except StopIteration:
+        put((end, None))
+    except Exception:
+        put((end, sys.exc_info()))
+
 class ItemIterator(BaseIterator):
 
     def __init__(self, page_iterator):
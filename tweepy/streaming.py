@@ -38,7 +38,10 @@ class StreamListener(object):
 
         Override this method if you wish to manually handle
         the stream data. Return False to stop stream and close connection.
+        raw_data is a memoryview if the stream is created with zero_copy.
         """
+        if isinstance(raw_data, memoryview):
+            raw_data = raw_data.tobytes()
         data = json.loads(raw_data)
 
         if 'in_reply_to_status_id' in data:
@@ -107,6 +110,79 @@ class StreamListener(object):
         return
 
 
+class ReadBuffer(object):
+    """Read a response in chunks into a reusable bytearray
+
+    Slices returned by read() are memoryviews into the buffer and
+    are only valid until the next call.
+    """
+
+    def __init__(self, resp, chunk_size):
+        self.resp = resp
+        self.chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._pos = 0
+
+    def _fill(self):
+        """Append the next chunk to the buffer, False at end of stream"""
+        resp = self.resp
+        amt = self.chunk_size
+        if resp.isclosed():
+            return False
+        # httplib only returns early at the end of an http chunk,
+        # so never ask for more than the current chunk holds.
+        if getattr(resp, 'chunked', False):
+            if resp.chunk_left is None:
+                # reading one byte makes httplib parse the chunk size
+                data = resp.read(1)
+                if resp.chunk_left:
+                    data += resp.read(min(amt, resp.chunk_left))
+            else:
+                data = resp.read(min(amt, resp.chunk_left))
+        else:
+            data = resp.read(amt)
+        if not data:
+            return False
+
+        if self._pos > len(self._buffer) // 2:
+            # reclaim the consumed part before growing
+            try:
+                del self._buffer[:self._pos]
+            except BufferError:
+                # a slice handed out earlier is still referenced
+                self._buffer = bytearray(self._buffer[self._pos:])
+            self._pos = 0
+        try:
+            self._buffer.extend(data)
+        except BufferError:
+            self._buffer = bytearray(self._buffer)
+            self._buffer.extend(data)
+        return True
+
+    def read_line(self):
+        """Return the next line including the newline, None at end"""
+        # offset from _pos already searched, _fill() may move _pos
+        searched = 0
+        while True:
+            end = self._buffer.find('\n', self._pos + searched)
+            if end >= 0:
+                line = str(self._buffer[self._pos:end + 1])
+                self._pos = end + 1
+                return line
+            searched = len(self._buffer) - self._pos
+            if not self._fill():
+                return None
+
+    def read(self, length):
+        """Return a memoryview of the next length bytes, None at end"""
+        while len(self._buffer) - self._pos < length:
+            if not self._fill():
+                return None
+        data = memoryview(self._buffer)[self._pos:self._pos + length]
+        self._pos += length
+        return data
+
+
 class Stream(object):
 
     host = 'stream.twitter.com'
@@ -124,6 +200,8 @@ class Stream(object):
         self.snooze_time_step = options.get("snooze_time", 0.25)
         self.snooze_time_cap = options.get("snooze_time_cap", 16)
         self.buffer_size = options.get("buffer_size",  1500)
+        # hand memoryview slices to on_data() instead of strings
+        self.zero_copy = options.get("zero_copy", False)
         if options.get("secure", True):
             self.scheme = "https"
         else:
@@ -204,26 +282,27 @@ class Stream(object):
             self.running = False
 
     def _read_loop(self, resp):
+        buf = ReadBuffer(resp, self.buffer_size)
 
-        while self.running and not resp.isclosed():
+        # the buffer may still hold messages after resp is closed
+        while self.running:
 
             # Note: keep-alive newlines might be inserted before each length value.
-            # read until we get a digit...
-            c = '\n'
-            while c == '\n' and self.running and not resp.isclosed():
-                c = resp.read(1)
-            delimited_string = c
-
-            # read rest of delimiter length..
-            d = ''
-            while d != '\n' and self.running and not resp.isclosed():
-                d = resp.read(1)
-                delimited_string += d
+            delimited_string = buf.read_line()
+            if delimited_string is None:
+                break
+            if not delimited_string.strip().isdigit():
+                continue
 
             # read the next twitter status object
-            if delimited_string.strip().isdigit():
-                next_status_obj = resp.read( int(delimited_string) )
+            next_status_obj = buf.read(int(delimited_string))
+            if next_status_obj is None:
+                break
+            if self.zero_copy:
                 self._data(next_status_obj)
+            else:
+                self._data(next_status_obj.tobytes())
+            del next_status_obj
 
         if resp.isclosed():
             self.on_closed(resp)